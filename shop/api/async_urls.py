@@ -0,0 +1,17 @@
+from django.urls import path, re_path
+
+from api import async_views
+
+# те же адреса, что в api/urls.py, для запуска под ASGI (shop/asgi.py)
+urlpatterns = [
+    re_path(r'^categories/?$', async_views.categories, name='async_categories_list'),
+    re_path(r'^tags/?$', async_views.tags, name='async_tags'),
+    path('catalog', async_views.catalog, name='async_catalog'),
+    path('catalog/<int:id>', async_views.catalog_with_id, name='async_catalog_wit_id'),
+    re_path(r'^products/popular/?$', async_views.popular, name='async_popular'),
+    re_path(r'^products/limited/?$', async_views.limited, name='async_limited'),
+    re_path(r'^banners/?$', async_views.banners, name='async_on_banners'),
+    path('products/<int:pk>', async_views.product_detail, name='async_product_detail'),
+    path('sales', async_views.sales, name='async_sales_list'),
+    path('home', async_views.home, name='async_home'),
+]
@@ -0,0 +1,195 @@
+import asyncio
+import functools
+from collections import defaultdict
+
+from django.http import Http404, HttpResponse
+from django.utils.cache import get_conditional_response
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from api.cache import aget_category_tree, aget_tags, aget_or_build, aget_version_info
+from api.db_routing import read_only_view
+from api.facets import aget_facets
+from api.fast_serializers import FAST_SERIALIZERS, FastSalesSerializer
+from api.models import Product, Image
+from api.product_cache import aget_product_data
+from api.serializers import ProductSerializer, SalesSerializer
+from api.views import ProductsCatalogViewSet, ProductsCatalogWithIdViewSet, ProductsPopularViewSet, \
+    ProductsLimitedViewSet, ProductsBannersViewSet, ProductViewSet, SalesViewSet, set_validators, list_etag, \
+    product_etag, plain_data
+
+# Асинхронные (ASGI) варианты read-only эндпоинтов, подключены в shop/urls.py под /api/async/.
+# Ответы совпадают с api/views.py байт в байт: те же фильтры, пагинация, сериализаторы и ключи кэша,
+# но запросы к БД идут через async ORM и не держат поток воркера.
+
+
+class Detached:
+    # объект для сериализатора: уже загруженные связи списками, остальное берется из instance
+
+    def __init__(self, instance, **related):
+        self._instance = instance
+        self.__dict__.update(related)
+
+    def __getattr__(self, name):
+        return getattr(self._instance, name)
+
+
+def render(data, status_code=status.HTTP_200_OK):
+    return HttpResponse(JSONRenderer().render(data), status=status_code, content_type='application/json')
+
+
+def async_api_view(view):
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return render({'detail': f'Method "{request.method}" not allowed.'},
+                          status.HTTP_405_METHOD_NOT_ALLOWED)
+        try:
+            return await view(request, *args, **kwargs)
+        except Http404:
+            return render({'detail': 'Not found.'}, status.HTTP_404_NOT_FOUND)
+        except APIException as exc:
+            # как rest_framework.views.exception_handler
+            data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+            return render(data, exc.status_code)
+
+    # ATOMIC_REQUESTS не поддерживается для async-представлений, а чтению транзакция не нужна
+    return read_only_view(wrapper)
+
+
+async def aconditional_response(request, etag, last_modified, build):
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    return set_validators(response if response is not None else await build(), etag, last_modified)
+
+
+async def alist(queryset):
+    return [obj async for obj in queryset.aiterator()]
+
+
+async def aproduct_images(product_ids):
+    images = defaultdict(list)
+    async for image in Image.objects.filter(content_type__app_label='api', content_type__model='product',
+                                            object_id__in=product_ids).order_by('id').aiterator():
+        images[image.object_id].append(image)
+    return images
+
+
+def get_view(view_class, request, **kwargs):
+    return view_class(request=Request(request), args=(), kwargs=kwargs, format_kwarg=None)
+
+
+async def build_catalog(view_class, request, **kwargs):
+    view = get_view(view_class, request, **kwargs)
+    queryset = view.filter_queryset(view.get_queryset())
+    cards = await view.paginator.apaginate_queryset(queryset, view.request, view)
+    data = view.paginator.get_paginated_response([card.data for card in cards]).data
+    data['facets'] = await aget_facets(view, queryset)
+    return render(data)
+
+
+async def build_cards(view):
+    return [card.data async for card in (await view.aget_queryset()).aiterator()]
+
+
+async def build_sales(view):
+    if FAST_SERIALIZERS:
+        rows = await view.paginator.apaginate_queryset(FastSalesSerializer.values(view.get_queryset()), view.request,
+                                                       view)
+        return plain_data(view.paginator.get_paginated_response(await FastSalesSerializer.abuild(rows)).data)
+    # aiterator() не поддерживает prefetch_related, картинки грузятся отдельно
+    sales = await view.paginator.apaginate_queryset(view.get_queryset().prefetch_related(None), view.request, view)
+    images = await aproduct_images([sale.product_id for sale in sales])
+    data = SalesSerializer([Detached(sale, product=Detached(sale.product, images=images[sale.product_id]))
+                            for sale in sales], many=True).data
+    return plain_data(view.paginator.get_paginated_response(data).data)
+
+
+async def cached_sales(request):
+    view = get_view(SalesViewSet, request)
+    return await aget_or_build(view.get_cache_name(), 'product_lists', lambda: build_sales(view))
+
+
+async def build_product(pk):
+    product = await ProductViewSet.queryset.aget(pk=pk)
+    images, tags, reviews, specifications = await asyncio.gather(
+        aproduct_images([pk]), alist(product.tags.all()), alist(product.latest_reviews()),
+        alist(product.specifications.all()))
+    return ProductSerializer(Detached(product, images=images[pk], tags=tags, latest_reviews=reviews,
+                                      specifications=specifications)).data
+
+
+async def cached_product(pk, version, updated_at):
+    return render(await aget_product_data(pk, version, updated_at, lambda: build_product(pk)))
+
+
+async def conditional_list(request, build):
+    version, modified = await aget_version_info('product_lists')
+    return await aconditional_response(request, list_etag(request, version, modified), modified, build)
+
+
+@async_api_view
+async def catalog(request):
+    return await conditional_list(request, lambda: build_catalog(ProductsCatalogViewSet, request))
+
+
+@async_api_view
+async def catalog_with_id(request, id):
+    return await conditional_list(request, lambda: build_catalog(ProductsCatalogWithIdViewSet, request, id=id))
+
+
+async def cached_cards(view_class, request):
+    view = get_view(view_class, request)
+    return await aget_or_build(view.get_cache_name(), 'product_lists', lambda: build_cards(view))
+
+
+def cached_cards_view(view_class):
+    @async_api_view
+    async def view(request):
+        async def build():
+            return render(await cached_cards(view_class, request))
+        return await conditional_list(request, build)
+    return view
+
+
+popular = cached_cards_view(ProductsPopularViewSet)
+limited = cached_cards_view(ProductsLimitedViewSet)
+banners = cached_cards_view(ProductsBannersViewSet)
+
+
+@async_api_view
+async def product_detail(request, pk):
+    try:
+        version, updated_at = await Product.objects.values_list('version', 'updated_at').aget(pk=pk)
+    except Product.DoesNotExist:
+        raise Http404
+    return await aconditional_response(request, product_etag(pk, version), int(updated_at.timestamp()),
+                                       lambda: cached_product(pk, version, updated_at))
+
+
+@async_api_view
+async def sales(request):
+    return render(await cached_sales(request))
+
+
+@async_api_view
+async def tags(request):
+    return render(await aget_tags())
+
+
+@async_api_view
+async def categories(request):
+    return render(await aget_category_tree())
+
+
+@async_api_view
+async def home(request):
+    # независимые блоки главной страницы одновременно
+    banners_data, popular_data, limited_data, sales_data, categories_data = await asyncio.gather(
+        cached_cards(ProductsBannersViewSet, request), cached_cards(ProductsPopularViewSet, request),
+        cached_cards(ProductsLimitedViewSet, request),
+        cached_sales(request),
+        aget_category_tree())
+    return render({'banners': banners_data, 'popular': popular_data, 'limited': limited_data, 'sales': sales_data,
+                   'categories': categories_data})
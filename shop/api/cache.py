@@ -0,0 +1,213 @@
+import asyncio
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from api.db_routing import primary_reads
+from api.local_cache import local_cache
+
+CATEGORY_TREE_TIMEOUT = getattr(settings, 'API_CATEGORY_TREE_TIMEOUT', 60 * 60)
+TAGS_TIMEOUT = getattr(settings, 'API_TAGS_TIMEOUT', 60 * 60)
+RESPONSE_CACHE_TIMEOUT = getattr(settings, 'API_RESPONSE_CACHE_TIMEOUT', 5 * 60)
+# сколько держится блокировка пересчета и сколько остальные запросы ждут результат
+RESPONSE_CACHE_LOCK_TIMEOUT = getattr(settings, 'API_RESPONSE_CACHE_LOCK_TIMEOUT', 10)
+RESPONSE_CACHE_WAIT = 0.05
+
+
+def version_key(name):
+    return f'api:version:{name}'
+
+
+def modified_key(name):
+    return f'api:modified:{name}'
+
+
+def get_version(name):
+    key = version_key(name)
+    version = local_cache.get(key)
+    if version is None:
+        cache.add(key, 1, timeout=None)
+        version = cache.get(key, 1)
+    return version
+
+
+def get_version_info(name):
+    # версия и время ее последней смены одним обращением к кэшу, для ETag/Last-Modified.
+    # Если кэш потерял ключи, время берется текущее, и старые ETag клиентов уже не совпадут
+    keys = [version_key(name), modified_key(name)]
+    values = local_cache.get_many(keys)
+    if len(values) < len(keys):
+        cache.add(keys[0], 1, timeout=None)
+        cache.add(keys[1], int(time.time()), timeout=None)
+        values = local_cache.get_many(keys)
+    return values.get(keys[0], 1), values.get(keys[1], int(time.time()))
+
+
+def bump_version(name):
+    key = version_key(name)
+    cache.set(modified_key(name), int(time.time()), timeout=None)
+    try:
+        version = cache.incr(key)
+    except ValueError:
+        cache.add(key, 2, timeout=None)
+        version = cache.get(key, 2)
+    local_cache.invalidate()
+    return version
+
+
+def bump_version_on_commit(name):
+    # при ATOMIC_REQUESTS версия меняется только после коммита, иначе параллельный запрос
+    # успеет положить в кэш старые данные уже под новой версией
+    transaction.on_commit(lambda: bump_version(name))
+
+
+def get_or_build(name, version_name, build, timeout=RESPONSE_CACHE_TIMEOUT):
+    key = f'api:{name}:{get_version(version_name)}'
+    stale_key = f'api:{name}:stale'
+    data = local_cache.get(key)
+    if data is not None:
+        return data
+
+    lock_key = f'{key}:lock'
+    if cache.add(lock_key, 1, RESPONSE_CACHE_LOCK_TIMEOUT):
+        try:
+            # по default, а не по реплике: версия уже новая, а реплика может отставать (api/db_routing.py)
+            with primary_reads():
+                data = build()
+            cache.set_many({key: data, stale_key: data}, timeout)
+            local_cache.put(key, data)
+        finally:
+            cache.delete(lock_key)
+        return data
+
+    # пересчитывает другой запрос: отдаем прошлую версию, если она есть, иначе ждем
+    data = cache.get(stale_key)
+    deadline = time.monotonic() + RESPONSE_CACHE_LOCK_TIMEOUT
+    while data is None and time.monotonic() < deadline:
+        time.sleep(RESPONSE_CACHE_WAIT)
+        data = cache.get(key)
+    return data if data is not None else build()
+
+
+def category_rows():
+    from api.models import Category
+
+    return Category.objects.order_by('id').values('id', 'title', 'image', 'maincategories')
+
+
+def render_category_tree(categories):
+    from api.serializers import CategorySerializer
+
+    children = defaultdict(list)
+    for category in categories:
+        category['href'] = f'/catalog/{category["id"]}'
+        category['subcategories'] = children[category['id']]
+        children[category['maincategories']].append(category)
+    return list(CategorySerializer(children[None], many=True).data)
+
+
+def build_category_tree():
+    return render_category_tree(list(category_rows()))
+
+
+def get_category_tree():
+    key = f'api:categories:{get_version("categories")}'
+    tree = local_cache.get(key)
+    if tree is None:
+        with primary_reads():
+            tree = build_category_tree()
+        local_cache.set(key, tree, CATEGORY_TREE_TIMEOUT)
+    return tree
+
+
+def render_tags(tags):
+    from api.serializers import TagSerializer
+
+    return list(TagSerializer(tags, many=True).data)
+
+
+def tag_rows():
+    from api.models import Tag
+
+    return Tag.objects.all()
+
+
+def get_tags():
+    key = f'api:tags:{get_version("tags")}'
+    tags = local_cache.get(key)
+    if tags is None:
+        with primary_reads():
+            tags = render_tags(tag_rows())
+        local_cache.set(key, tags, TAGS_TIMEOUT)
+    return tags
+
+
+# async-варианты для api/async_views.py, та же схема ключей и версий
+
+async def aget_version(name):
+    key = version_key(name)
+    version = await local_cache.aget(key)
+    if version is None:
+        await cache.aadd(key, 1, timeout=None)
+        version = await cache.aget(key, 1)
+    return version
+
+
+async def aget_version_info(name):
+    keys = [version_key(name), modified_key(name)]
+    values = await local_cache.aget_many(keys)
+    if len(values) < len(keys):
+        await cache.aadd(keys[0], 1, timeout=None)
+        await cache.aadd(keys[1], int(time.time()), timeout=None)
+        values = await local_cache.aget_many(keys)
+    return values.get(keys[0], 1), values.get(keys[1], int(time.time()))
+
+
+async def aget_or_build(name, version_name, build, timeout=RESPONSE_CACHE_TIMEOUT):
+    # build - корутинная функция
+    key = f'api:{name}:{await aget_version(version_name)}'
+    stale_key = f'api:{name}:stale'
+    data = await local_cache.aget(key)
+    if data is not None:
+        return data
+
+    lock_key = f'{key}:lock'
+    if await cache.aadd(lock_key, 1, RESPONSE_CACHE_LOCK_TIMEOUT):
+        try:
+            with primary_reads():
+                data = await build()
+            await cache.aset_many({key: data, stale_key: data}, timeout)
+            local_cache.put(key, data)
+        finally:
+            await cache.adelete(lock_key)
+        return data
+
+    data = await cache.aget(stale_key)
+    deadline = time.monotonic() + RESPONSE_CACHE_LOCK_TIMEOUT
+    while data is None and time.monotonic() < deadline:
+        await asyncio.sleep(RESPONSE_CACHE_WAIT)
+        data = await cache.aget(key)
+    return data if data is not None else await build()
+
+
+async def aget_category_tree():
+    key = f'api:categories:{await aget_version("categories")}'
+    tree = await local_cache.aget(key)
+    if tree is None:
+        with primary_reads():
+            tree = render_category_tree([category async for category in category_rows().aiterator()])
+        await local_cache.aset(key, tree, CATEGORY_TREE_TIMEOUT)
+    return tree
+
+
+async def aget_tags():
+    key = f'api:tags:{await aget_version("tags")}'
+    tags = await local_cache.aget(key)
+    if tags is None:
+        with primary_reads():
+            tags = render_tags([tag async for tag in tag_rows().aiterator()])
+        await local_cache.aset(key, tags, TAGS_TIMEOUT)
+    return tags
@@ -0,0 +1,70 @@
+import json
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Value, CharField, Max
+from django.db.models.functions import Concat
+from rest_framework.utils.encoders import JSONEncoder
+
+from api.fast_serializers import FAST_SERIALIZERS, FastProductsSerializer
+from api.models import Product, ProductCard
+from api.serializers import ProductsSerializer
+
+CARD_FIELDS = ['category', 'title', 'price', 'date', 'rating', 'review_count', 'limited', 'on_banner', 'freeDelivery',
+               'count']
+
+
+def card_products():
+    # в карточке цена с действующей скидкой: по ней сортирует и фильтрует каталог
+    return Product.with_effective_price(Product.objects.select_related('category').prefetch_related('images', 'tags').
+                                        annotate(href=Concat(Value('/catalog/'), 'id', output_field=CharField())))
+
+
+def with_card_price(product):
+    product.price = product.effective_price
+    return product
+
+
+def render_card(product):
+    # через json, чтобы в JSONField лежало ровно то, что отдает API (Decimal -> float)
+    return json.loads(json.dumps(ProductsSerializer(product).data, cls=JSONEncoder))
+
+
+def model_cards(product_ids):
+    return [ProductCard(product=product, data=render_card(product),
+                        **{field: getattr(product, field) for field in CARD_FIELDS})
+            for product in map(with_card_price, card_products().filter(pk__in=product_ids))]
+
+
+def fast_cards(product_ids):
+    # то же из строк .values() (api/fast_serializers.py), без моделей и ProductsSerializer
+    rows = list(FastProductsSerializer.values(Product.objects.filter(pk__in=product_ids)))
+    return [ProductCard(product_id=row['id'], data=data, category_id=row['category'], price=row['effective_price'],
+                        **{field: row[field] for field in CARD_FIELDS if field not in ('category', 'price')})
+            for row, data in zip(rows, FastProductsSerializer.render_json(rows))]
+
+
+def refresh_cards(product_ids):
+    cards = fast_cards(product_ids) if FAST_SERIALIZERS else model_cards(product_ids)
+    ProductCard.objects.bulk_create(cards, update_conflicts=True, unique_fields=['product'],
+                                    update_fields=CARD_FIELDS + ['data'])
+    return len(cards)
+
+
+def refresh_cards_on_commit(product_ids):
+    product_ids = list(product_ids)
+    if product_ids:
+        transaction.on_commit(lambda: refresh_cards(product_ids))
+
+
+def rebuild_cards(batch_size=1000):
+    last_id = Product.objects.aggregate(Max('id'))['id__max'] or 0
+    total = 0
+    for start in range(0, last_id, batch_size):
+        with transaction.atomic():
+            total += refresh_cards(range(start + 1, start + batch_size + 1))
+    return total
+
+
+def product_content_type():
+    return ContentType.objects.get_for_model(Product)
@@ -0,0 +1,310 @@
+import csv
+import io
+import json
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models.constants import OnConflict
+from django.utils import timezone
+
+from api.cards import refresh_cards, product_content_type
+from api.models import Category, Tag, Image, Product, Specification
+from api.search import get_search_backend
+
+# Массовая загрузка и выгрузка каталога (manage.py import_catalog / export_catalog). Запись - товар со связями:
+# {"id": 1, "category": 3, "title": ..., "price": "10.50", "date": ..., "tags": ["tag-1"], "images": ["imgs/1.jpg"],
+#  "specifications": [{"name": ..., "value": ...}]}. Файл читается и пишется потоком, в памяти одна пачка.
+# Повторный импорт того же файла ничего не меняет: товары - upsert по id, связи приводятся к списку из записи
+# (отсутствующий в записи ключ связей не трогает).
+PRODUCT_FIELDS = ['category', 'price', 'count', 'date', 'title', 'description', 'fullDescription', 'freeDelivery',
+                  'limited', 'on_banner']
+REQUIRED_FIELDS = ['id', 'category', 'title', 'price', 'date']
+RELATION_FIELDS = ['tags', 'images', 'specifications']
+CSV_COLUMNS = ['id', *PRODUCT_FIELDS, *RELATION_FIELDS]
+FORMATS = ('jsonl', 'csv')
+
+
+class CatalogImportError(ValueError):
+
+    def __init__(self, line, message):
+        super().__init__(f'line {line}: {message}')
+        self.line = line
+
+
+def batches(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def json_default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def read_jsonl(stream):
+    for line, text in enumerate(stream, 1):
+        if text.strip():
+            try:
+                yield line, json.loads(text)
+            except ValueError as exc:
+                raise CatalogImportError(line, f'invalid JSON: {exc}')
+
+
+def read_csv(stream):
+    # связи в ячейках CSV - JSON-массивы, пустая ячейка - связи не трогать
+    for line, row in enumerate(csv.DictReader(stream), 2):
+        record = {key: value for key, value in row.items() if key and value != ''}
+        for field in RELATION_FIELDS:
+            if field in record:
+                try:
+                    record[field] = json.loads(record[field])
+                except ValueError as exc:
+                    raise CatalogImportError(line, f'{field}: invalid JSON: {exc}')
+        yield line, record
+
+
+def write_jsonl(stream, records):
+    for record in records:
+        stream.write(json.dumps(record, ensure_ascii=False, default=json_default) + '\n')
+
+
+def write_csv(stream, records):
+    writer = csv.DictWriter(stream, CSV_COLUMNS)
+    writer.writeheader()
+    for record in records:
+        writer.writerow({**record, **{field: json.dumps(record[field], ensure_ascii=False)
+                                      for field in RELATION_FIELDS}})
+
+
+READERS = {'jsonl': read_jsonl, 'csv': read_csv}
+WRITERS = {'jsonl': write_jsonl, 'csv': write_csv}
+
+
+def prepare_rows(objs):
+    # все колонки модели и значения для БД: значения по умолчанию Django в схеме БД не хранятся
+    fields = [field for field in objs[0]._meta.concrete_fields
+              if not (field.primary_key and getattr(objs[0], field.attname) is None)]
+    return fields, [[field.get_db_prep_save(getattr(obj, field.attname), connection) for field in fields]
+                    for obj in objs]
+
+
+def conflict_sql(opts, fields, unique_fields, update_fields):
+    if not update_fields:
+        return ''
+    return ' ' + connection.ops.on_conflict_suffix_sql(
+        fields, OnConflict.UPDATE, [opts.get_field(field).column for field in update_fields],
+        [opts.get_field(field).column for field in unique_fields])
+
+
+def copy_rows(objs, unique_fields=None, update_fields=None):
+    # PostgreSQL: COPY во временную таблицу и один INSERT ... SELECT
+    qn = connection.ops.quote_name
+    opts = objs[0]._meta
+    fields, rows = prepare_rows(objs)
+    columns = ', '.join(qn(field.column) for field in fields)
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows([[r'\N' if value is None else value for value in row] for row in rows])
+    buffer.seek(0)
+    with connection.cursor() as cursor:
+        cursor.execute(f'CREATE TEMP TABLE import_rows AS SELECT {columns} FROM {qn(opts.db_table)} WITH NO DATA')
+        cursor.copy_expert(f"COPY import_rows ({columns}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buffer)
+        cursor.execute(f'INSERT INTO {qn(opts.db_table)} ({columns}) SELECT {columns} FROM import_rows'
+                       f'{conflict_sql(opts, fields, unique_fields, update_fields)}')
+        cursor.execute('DROP TABLE import_rows')
+
+
+def insert_rows(model, fields, rows, unique_fields=None, update_fields=None):
+    # rows - кортежи значений fields (attname); с update_fields - upsert по unique_fields.
+    # Один подготовленный INSERT на все строки (executemany) вместо сборки SQL в bulk_create
+    if not rows:
+        return
+    objs = [model(**dict(zip(fields, row))) for row in rows]
+    if connection.vendor == 'postgresql':
+        return copy_rows(objs, unique_fields, update_fields)
+    qn = connection.ops.quote_name
+    opts = model._meta
+    fields, rows = prepare_rows(objs)
+    with connection.cursor() as cursor:
+        cursor.executemany(f'INSERT INTO {qn(opts.db_table)} ({", ".join(qn(field.column) for field in fields)}) '
+                           f'VALUES ({", ".join(["%s"] * len(fields))})'
+                           f'{conflict_sql(opts, fields, unique_fields, update_fields)}', rows)
+
+
+def delete_rows(model, pks):
+    # обычный DELETE по первичному ключу: сигналы на каждую строку (post_delete Image и т.п.) пропускаются
+    # намеренно, версии товаров, карточки и поисковый индекс импорт обновляет один раз на пачку.
+    # Удаляются только строки связей без зависимых таблиц, каскад не нужен
+    if not pks:
+        return
+    qn = connection.ops.quote_name
+    opts = model._meta
+    placeholders = ', '.join(['%s'] * len(pks))
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {qn(opts.db_table)} WHERE {qn(opts.pk.column)} IN ({placeholders})', pks)
+
+
+def reset_sequences(*models):
+    # id товаров приходят из файла, счетчик PostgreSQL сам не сдвигается
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), models):
+            cursor.execute(sql)
+
+
+def sync_links(model, owner_field, target_field, wanted):
+    # привести строки model (owner, target) к wanted: {owner: set(target)}; лишние удаляются, недостающие
+    # вставляются, совпадающие не трогаются
+    if not wanted:
+        return
+    existing = list(model.objects.filter(**{f'{owner_field}__in': list(wanted)}).
+                    values_list('pk', owner_field, target_field))
+    delete_rows(model, [pk for pk, owner, target in existing if target not in wanted[owner]])
+    present = {(owner, target) for _, owner, target in existing}
+    insert_rows(model, [owner_field, target_field],
+                [(owner, target) for owner, targets in wanted.items() for target in targets
+                 if (owner, target) not in present])
+
+
+class CatalogImporter:
+
+    def __init__(self, batch_size=2000):
+        self.batch_size = batch_size
+        self.now = timezone.now()
+        # справочники небольшие, держим в памяти весь импорт
+        self.category_ids = set(Category.objects.values_list('pk', flat=True))
+        self.tag_ids = set(Tag.objects.values_list('pk', flat=True))
+        self.specification_ids = {(name, value): pk for pk, name, value in
+                                  Specification.objects.order_by('pk').values_list('pk', 'name', 'value')}
+        self.content_type = product_content_type()
+        self.fields = {name: Product._meta.get_field(name) for name in PRODUCT_FIELDS}
+        self.products = 0
+
+    def parse(self, line, record):
+        if not isinstance(record, dict):
+            raise CatalogImportError(line, 'record must be an object')
+        missing = [field for field in REQUIRED_FIELDS if record.get(field) in (None, '')]
+        if missing:
+            raise CatalogImportError(line, f'missing fields: {", ".join(missing)}')
+        values = {}
+        try:
+            values['id'] = Product._meta.pk.to_python(record['id'])
+        except ValidationError as exc:
+            raise CatalogImportError(line, f'id: {"; ".join(exc.messages)}')
+        try:
+            for name, field in self.fields.items():
+                value = field.get_default() if record.get(name) is None else field.to_python(record[name])
+                values[field.attname] = value
+        except ValidationError as exc:
+            raise CatalogImportError(line, f'{name}: {"; ".join(exc.messages)}')
+        if values['category_id'] not in self.category_ids:
+            raise CatalogImportError(line, f'unknown category {values["category_id"]}')
+        if timezone.is_naive(values['date']):
+            values['date'] = timezone.make_aware(values['date'])
+        relations = {field: record[field] for field in RELATION_FIELDS if record.get(field) is not None}
+        for field, items in relations.items():
+            if not isinstance(items, list):
+                raise CatalogImportError(line, f'{field} must be a list')
+        try:
+            relations = {
+                'tags': {str(tag) for tag in relations['tags']} if 'tags' in relations else None,
+                'images': list(dict.fromkeys(str(image) for image in relations['images']))
+                if 'images' in relations else None,
+                'specifications': {(str(item['name']), str(item['value'])) for item in relations['specifications']}
+                if 'specifications' in relations else None,
+            }
+        except (TypeError, KeyError):
+            raise CatalogImportError(line, 'specifications must be a list of {"name": ..., "value": ...}')
+        return values, relations
+
+    def import_records(self, records):
+        # records - пары (номер строки, запись), каждая пачка - своя транзакция
+        for batch in batches(records, self.batch_size):
+            parsed = {}
+            for line, record in batch:
+                values, relations = self.parse(line, record)
+                parsed[values['id']] = values, relations
+            with transaction.atomic():
+                self.import_batch(parsed)
+            self.products += len(parsed)
+        reset_sequences(Product)
+        return self.products
+
+    def import_batch(self, parsed):
+        fields = ['id', *(self.fields[name].attname for name in PRODUCT_FIELDS), 'updated_at']
+        insert_rows(Product, fields, [tuple(values[field] for field in fields[:-1]) + (self.now,)
+                                      for values, _ in parsed.values()],
+                    unique_fields=['id'], update_fields=fields[1:])
+        self.import_tags({pk: relations['tags'] for pk, (_, relations) in parsed.items()
+                          if relations['tags'] is not None})
+        self.import_images({pk: relations['images'] for pk, (_, relations) in parsed.items()
+                            if relations['images'] is not None})
+        self.import_specifications({pk: relations['specifications'] for pk, (_, relations) in parsed.items()
+                                    if relations['specifications'] is not None})
+        # сигналы не срабатывают: версия (ETag, кэш товара), карточки и поисковый индекс - по всей пачке
+        product_ids = list(parsed)
+        Product.touch(product_ids)
+        refresh_cards(product_ids)
+        get_search_backend().update_index_many(product_ids)
+
+    def import_tags(self, wanted):
+        new_tags = {tag for tags in wanted.values() for tag in tags} - self.tag_ids
+        if new_tags:
+            Tag.objects.bulk_create([Tag(id=tag, name=tag) for tag in sorted(new_tags)], ignore_conflicts=True)
+            self.tag_ids |= new_tags
+        sync_links(Product.tags.through, 'product_id', 'tag_id', wanted)
+
+    def import_images(self, wanted):
+        # картинки - GenericRelation, сравниваются по пути файла
+        if not wanted:
+            return
+        existing = list(Image.objects.filter(content_type=self.content_type, object_id__in=list(wanted)).
+                        values_list('pk', 'object_id', 'image'))
+        delete_rows(Image, [pk for pk, object_id, image in existing if image not in wanted[object_id]])
+        present = {(object_id, image) for _, object_id, image in existing}
+        insert_rows(Image, ['image', 'content_type_id', 'object_id'],
+                    [(image, self.content_type.pk, pk) for pk, images in wanted.items() for image in images
+                     if (pk, image) not in present])
+
+    def import_specifications(self, wanted):
+        new_specifications = sorted({pair for pairs in wanted.values() for pair in pairs} -
+                                    set(self.specification_ids))
+        if new_specifications:
+            for specification in Specification.objects.bulk_create(
+                    [Specification(name=name, value=value) for name, value in new_specifications]):
+                self.specification_ids[specification.name, specification.value] = specification.pk
+        sync_links(Specification.product.through, 'product_id', 'specification_id',
+                   {pk: {self.specification_ids[pair] for pair in pairs} for pk, pairs in wanted.items()})
+
+
+def group_pairs(pairs):
+    grouped = defaultdict(list)
+    for key, value in pairs:
+        grouped[key].append(value)
+    return grouped
+
+
+def export_records(chunk_size=2000):
+    # товары курсором (iterator), связи - тремя запросами на пачку
+    products = Product.objects.order_by('pk').values('id', *PRODUCT_FIELDS).iterator(chunk_size=chunk_size)
+    content_type = product_content_type()
+    for chunk in batches(products, chunk_size):
+        ids = [row['id'] for row in chunk]
+        tags = group_pairs(Product.tags.through.objects.filter(product__in=ids).order_by('product', 'tag').
+                           values_list('product', 'tag'))
+        images = group_pairs(Image.objects.filter(content_type=content_type, object_id__in=ids).order_by('id').
+                             values_list('object_id', 'image'))
+        specifications = group_pairs(
+            (product, {'name': name, 'value': value}) for product, name, value in
+            Specification.product.through.objects.filter(product__in=ids).order_by('specification').
+            values_list('product', 'specification__name', 'specification__value'))
+        for row in chunk:
+            yield {**row, 'tags': tags[row['id']], 'images': images[row['id']],
+                   'specifications': specifications[row['id']]}
@@ -0,0 +1,64 @@
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Q
+
+from api.models import Category, CategoryClosure
+
+
+def subtree(category_id):
+    return CategoryClosure.objects.filter(ancestor=category_id).values('descendant')
+
+
+def subtree_condition(category_id, field='category'):
+    # товары категории и всех ее подкатегорий: подзапрос по индексу (ancestor, descendant)
+    return Q(**{f'{field}__in': subtree(category_id)})
+
+
+def ancestors(category_id):
+    return list(CategoryClosure.objects.filter(descendant=category_id).values_list('ancestor', 'depth'))
+
+
+def add_category(category):
+    links = [CategoryClosure(ancestor_id=category.pk, descendant_id=category.pk, depth=0)]
+    if category.maincategories_id is not None:
+        links += [CategoryClosure(ancestor_id=ancestor, descendant_id=category.pk, depth=depth + 1)
+                  for ancestor, depth in ancestors(category.maincategories_id)]
+    CategoryClosure.objects.bulk_create(links)
+
+
+def check_move(category_id, parent_id):
+    # ValidationError, а не ValueError: Category.clean() и формы показывают ее как ошибку поля
+    if parent_id is not None and CategoryClosure.objects.filter(ancestor=category_id, descendant=parent_id).exists():
+        raise ValidationError({'maincategories': f'Category {parent_id} is inside the subtree of category '
+                                                 f'{category_id}'})
+
+
+def move_category(category_id, parent_id):
+    # поддерево переносится целиком: связи с прежними предками удаляются, с новыми - добавляются
+    nodes = list(CategoryClosure.objects.filter(ancestor=category_id).values_list('descendant', 'depth'))
+    node_ids = [node for node, _ in nodes]
+    CategoryClosure.objects.filter(descendant__in=node_ids).exclude(ancestor__in=node_ids).delete()
+    if parent_id is not None:
+        CategoryClosure.objects.bulk_create([
+            CategoryClosure(ancestor_id=ancestor, descendant_id=node, depth=ancestor_depth + depth + 1)
+            for ancestor, ancestor_depth in ancestors(parent_id) for node, depth in nodes])
+
+
+def closure_links(parents):
+    # parents - {id: id родителя}; цикл в данных обрывается на повторе
+    for category_id in parents:
+        ancestor, depth, seen = category_id, 0, set()
+        while ancestor is not None and ancestor not in seen:
+            seen.add(ancestor)
+            yield ancestor, category_id, depth
+            ancestor, depth = parents.get(ancestor), depth + 1
+
+
+def rebuild_category_tree(batch_size=2000):
+    parents = dict(Category.objects.values_list('id', 'maincategories'))
+    links = [CategoryClosure(ancestor_id=ancestor, descendant_id=descendant, depth=depth)
+             for ancestor, descendant, depth in closure_links(parents)]
+    with transaction.atomic():
+        CategoryClosure.objects.all().delete()
+        CategoryClosure.objects.bulk_create(links, batch_size=batch_size)
+    return len(links)
@@ -0,0 +1,118 @@
+import asyncio
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections, transaction
+from rest_framework.permissions import SAFE_METHODS
+
+# Чтение с реплики: GET/HEAD read-only представлений (read_only_view, ReadOnlyViewMixin) идут в базу
+# API_READ_REPLICA из DATABASES, все остальное и любая запись - в default. После изменяющего запроса клиент
+# STICKY_SECONDS читает с default (cookie), чтобы видеть свои изменения, пока реплика догоняет.
+# API_READ_REPLICA = None (по умолчанию) - реплики нет, все запросы к default.
+# Данные для общего кэша (api/cache.py) строятся по default (primary_reads): версия меняется сразу после коммита
+# в default, и построенное по отставшей реплике легло бы под новую версию до конца TTL у всех клиентов.
+STICKY_SECONDS = getattr(settings, 'API_REPLICA_STICKY_SECONDS', 5)
+STICKY_COOKIE = 'primary_until'
+
+read_alias = ContextVar('read_alias', default=None)
+
+
+def get_read_replica():
+    # читается при каждом запросе, чтобы реплику можно было включить в тесте через override_settings
+    return getattr(settings, 'API_READ_REPLICA', None)
+
+
+@contextmanager
+def primary_reads():
+    token = read_alias.set(None)
+    try:
+        yield
+    finally:
+        read_alias.reset(token)
+
+
+def read_only_view(view):
+    # ATOMIC_REQUESTS не нужен чтению: без транзакции на каждый запрос ни в default, ни в реплике
+    for alias in connections:
+        view = transaction.non_atomic_requests(alias)(view)
+    view.read_replica = True
+    return view
+
+
+class ReadOnlyViewMixin:
+
+    @classmethod
+    def as_view(cls, *args, **initkwargs):
+        return read_only_view(super().as_view(*args, **initkwargs))
+
+    def handle_exception(self, exc):
+        # exception_handler DRF помечает на откат открытую транзакцию, считая ее транзакцией запроса.
+        # У read-only представления своей нет, а чужую (внешний atomic, тест) трогать нельзя
+        states = [(connection, connection.needs_rollback) for connection in connections.all()]
+        try:
+            return super().handle_exception(exc)
+        finally:
+            for connection, needs_rollback in states:
+                connection.needs_rollback = needs_rollback
+
+
+class ReplicaRouter:
+    # db_for_write не задан: запись всегда в default
+
+    def db_for_read(self, model, **hints):
+        return read_alias.get()
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # реплика - копия default, объекты из них можно связывать
+        databases = {'default', get_read_replica()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+def is_sticky(request):
+    try:
+        return float(request.COOKIES.get(STICKY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+class ReplicaRoutingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self._is_coroutine = asyncio.coroutines._is_coroutine if asyncio.iscoroutinefunction(get_response) else None
+
+    def __call__(self, request):
+        if self._is_coroutine:
+            return self.__acall__(request)
+        token = read_alias.set(None)
+        try:
+            response = self.get_response(request)
+        finally:
+            read_alias.reset(token)
+        return self.process_response(request, response)
+
+    async def __acall__(self, request):
+        token = read_alias.set(None)
+        try:
+            response = await self.get_response(request)
+        finally:
+            read_alias.reset(token)
+        return self.process_response(request, response)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        replica = get_read_replica()
+        if replica and getattr(view_func, 'read_replica', False) and request.method in SAFE_METHODS \
+                and not is_sticky(request):
+            read_alias.set(replica)
+
+    def process_response(self, request, response):
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            response.set_cookie(STICKY_COOKIE, f'{time.time() + STICKY_SECONDS:.3f}', max_age=STICKY_SECONDS,
+                                httponly=True, samesite='Lax')
+        return response
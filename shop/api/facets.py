@@ -0,0 +1,148 @@
+import hashlib
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db.models import Q, Case, When, Value, BooleanField, Count, Min, Max
+from django.db.models.functions import Floor
+from rest_framework.exceptions import ValidationError
+
+from api.cache import get_or_build, aget_or_build
+from api.models import Product
+
+# фильтры каталога. Фронтенд шлет filter[name]=...&filter[minPrice]=...&tags[]=..., старые версии axios -
+# filter={"name": ...}; строка поиска со страницы поиска приходит как ?filter=текст
+FLAG_FILTERS = ('freeDelivery', 'available', 'limited')
+NUMBER_FILTERS = ('minPrice', 'maxPrice', 'minRating')
+RATING_FACETS = (4, 3, 2, 1)
+# сколько самых частых тегов отдается в facets.tags
+TAG_FACETS = getattr(settings, 'API_FACET_TAGS', 20)
+
+
+def is_true(value):
+    return value is True or str(value).lower() in ('true', '1')
+
+
+def parse_number(name, value):
+    try:
+        number = Decimal(str(value))
+    except InvalidOperation:
+        number = None
+    if number is None or not number.is_finite():
+        raise ValidationError({f'filter[{name}]': ['A valid number is required.']})
+    return number
+
+
+def get_raw_filter(query_params):
+    raw = {}
+    value = query_params.get('filter', '')
+    if value.startswith('{'):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            pass
+    if isinstance(value, dict):
+        raw.update(value)
+    elif value:
+        raw['name'] = value
+    for name in ('name', *FLAG_FILTERS, *NUMBER_FILTERS):
+        if f'filter[{name}]' in query_params:
+            raw[name] = query_params[f'filter[{name}]']
+    return raw
+
+
+def get_filter_params(query_params):
+    # нормализованные фильтры: пустые и выключенные значения отбрасываются, чтобы ключ кэша
+    # не зависел от формы запроса
+    raw = get_raw_filter(query_params)
+    params = {}
+    name = str(raw.get('name') or '').strip()
+    if name:
+        params['name'] = name
+    for flag in FLAG_FILTERS:
+        if is_true(raw.get(flag)):
+            params[flag] = True
+    for number in NUMBER_FILTERS:
+        if raw.get(number) not in (None, ''):
+            params[number] = parse_number(number, raw[number])
+    tags = query_params.getlist('tags[]') or query_params.getlist('tags')
+    if tags:
+        params['tags'] = sorted(set(tags))
+    return params
+
+
+def get_filter_conditions(params):
+    conditions = []
+    if 'minPrice' in params:
+        conditions.append(Q(price__gte=params['minPrice']))
+    if 'maxPrice' in params:
+        conditions.append(Q(price__lte=params['maxPrice']))
+    if 'minRating' in params:
+        conditions.append(Q(rating__gte=params['minRating']))
+    if params.get('freeDelivery'):
+        conditions.append(Q(freeDelivery=True))
+    if params.get('available'):
+        conditions.append(Q(count__gt=0))
+    if params.get('limited'):
+        conditions.append(Q(limited=True))
+    if params.get('tags'):
+        # товар с любым из выбранных тегов
+        conditions.append(Q(pk__in=Product.tags.through.objects.filter(tag__in=params['tags']).values('product')))
+    return conditions
+
+
+def facet_groups(queryset):
+    # все счетчики одним GROUP BY: не больше 2 * 2 * 2 * 6 строк на любой фильтр
+    return queryset.order_by().values(
+        'freeDelivery', 'limited',
+        available=Case(When(count__gt=0, then=Value(True)), default=Value(False), output_field=BooleanField()),
+        stars=Floor('rating'),
+    ).annotate(total=Count('pk'), min_price=Min('price'), max_price=Max('price'))
+
+
+def facet_tags(queryset):
+    return Product.tags.through.objects.filter(product__in=queryset.order_by().values('pk')).\
+        values('tag', 'tag__name').annotate(total=Count('product')).order_by('-total', 'tag')[:TAG_FACETS]
+
+
+def render_facets(groups, tags):
+    total = sum(group['total'] for group in groups)
+    prices = [group for group in groups if group['min_price'] is not None]
+    return {
+        'total': total,
+        'price': {
+            'min': float(min(group['min_price'] for group in prices)) if prices else None,
+            'max': float(max(group['max_price'] for group in prices)) if prices else None,
+        },
+        'freeDelivery': sum(group['total'] for group in groups if group['freeDelivery']),
+        'available': sum(group['total'] for group in groups if group['available']),
+        'limited': sum(group['total'] for group in groups if group['limited']),
+        'rating': [{'minRating': stars, 'count': sum(group['total'] for group in groups if group['stars'] >= stars)}
+                   for stars in RATING_FACETS],
+        'tags': [{'id': tag['tag'], 'name': tag['tag__name'], 'count': tag['total']} for tag in tags],
+    }
+
+
+def build_facets(queryset):
+    return render_facets(list(facet_groups(queryset)), list(facet_tags(queryset)))
+
+
+async def abuild_facets(queryset):
+    return render_facets([group async for group in facet_groups(queryset)],
+                         [tag async for tag in facet_tags(queryset)])
+
+
+def facets_cache_name(view):
+    # один ключ на набор фильтров: страница, лимит и сортировка на счетчики не влияют
+    query_params = view.request.query_params
+    key = json.dumps({'kwargs': view.kwargs, 'category': query_params.get('category'),
+                      'filter': get_filter_params(query_params)}, sort_keys=True, default=str)
+    return f'facets:{hashlib.md5(key.encode()).hexdigest()}'
+
+
+def get_facets(view, queryset):
+    return get_or_build(facets_cache_name(view), 'product_lists', lambda: build_facets(queryset))
+
+
+async def aget_facets(view, queryset):
+    return await aget_or_build(facets_cache_name(view), 'product_lists', lambda: abuild_facets(queryset))
@@ -0,0 +1,208 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+
+from api.models import Image, Product, OrderProduct
+from api.serializers import ProductsSerializer, SalesSerializer, OrderSerializer, OrderProductSerializer, \
+    OrderSummarySerializer
+
+# Быстрый режим горячих списков: ответ собирается из строк .values() заранее подготовленными функциями полей,
+# без обхода атрибутов и копирования полей ModelSerializer на каждый объект. Значения преобразует to_representation
+# тех же полей DRF, поэтому вывод совпадает с сериализаторами байт в байт (FastSerializerTest).
+# Связи (картинки, теги, строки заказа) - по одному запросу на страницу, как prefetch_related.
+FAST_SERIALIZERS = getattr(settings, 'API_FAST_SERIALIZERS', True)
+
+
+def image_url():
+    return Image._meta.get_field('image').storage.url
+
+
+def compile_fields(serializer_class, columns):
+    # (поле, колонка строки, преобразование) в порядке полей сериализатора. columns - поле -> колонка
+    # или (колонка, функция), функция None - значение уже готово (собрано из связей);
+    # по умолчанию колонка - source поля, преобразование - to_representation поля
+    extractors = []
+    for name, field in serializer_class().fields.items():
+        if field.write_only:
+            continue
+        column = columns.get(name, field.source.replace('.', '__'))
+        extractors.append((name, column, field.to_representation) if isinstance(column, str) else (name, *column))
+    return extractors
+
+
+def render_rows(extractors, rows):
+    data = []
+    for row in rows:
+        item = {}
+        for name, column, convert in extractors:
+            value = row[column]
+            # как Serializer.to_representation: None не преобразуется
+            item[name] = value if value is None or convert is None else convert(value)
+        data.append(item)
+    return data
+
+
+class Related:
+    # связь "один ко многим" одним запросом: field - куда в строку положить список, key - колонка строки,
+    # rows(keys) - .values() связанных строк, related_key - их колонка со ссылкой на строку
+
+    def __init__(self, field, key, rows, related_key, convert):
+        self.field = field
+        self.key = key
+        self.rows = rows
+        self.related_key = related_key
+        self.convert = convert
+
+    def fill(self, rows, related_rows):
+        grouped = defaultdict(list)
+        for related_row in related_rows:
+            grouped[related_row[self.related_key]].append(self.convert(related_row))
+        for row in rows:
+            row[self.field] = grouped.get(row[self.key], [])
+
+
+def product_images(key):
+    url = image_url()
+    return Related('images', key, lambda keys: Image.objects.filter(
+        content_type__app_label='api', content_type__model='product', object_id__in=keys).order_by('id').
+        values('object_id', 'image'), 'object_id', lambda row: url(row['image']))
+
+
+class FastSerializer:
+    # подменяет serializer_class(rows, many=True) для списков: rows - строки .values(cls.value_columns())
+    serializer_class = None
+    columns = {}
+    extra_columns = ()
+
+    def __init__(self, instance=None, many=False, **kwargs):
+        self.instance = instance
+        self.many = many
+
+    @classmethod
+    def get_extractors(cls):
+        if '_extractors' not in cls.__dict__:
+            cls._extractors = compile_fields(cls.serializer_class, cls.columns)
+        return cls._extractors
+
+    @classmethod
+    def get_related(cls):
+        return []
+
+    @classmethod
+    def value_columns(cls):
+        related = {relation.field for relation in cls.get_related()}
+        columns = [column for _, column, _ in cls.get_extractors() if column not in related]
+        columns += [relation.key for relation in cls.get_related()] + list(cls.extra_columns)
+        return list(dict.fromkeys(columns))
+
+    @classmethod
+    def values(cls, queryset):
+        return queryset.prefetch_related(None).values(*cls.value_columns())
+
+    @classmethod
+    def render(cls, rows):
+        return render_rows(cls.get_extractors(), rows)
+
+    @classmethod
+    def build(cls, rows):
+        rows = list(rows)
+        for relation in cls.get_related():
+            keys = {row[relation.key] for row in rows}
+            relation.fill(rows, list(relation.rows(keys)) if keys else [])
+        return cls.render(rows)
+
+    @classmethod
+    async def abuild(cls, rows):
+        rows = list(rows)
+        for relation in cls.get_related():
+            keys = {row[relation.key] for row in rows}
+            relation.fill(rows, [related async for related in relation.rows(keys)] if keys else [])
+        return cls.render(rows)
+
+    @property
+    def data(self):
+        if self.many:
+            return self.build(self.instance)
+        return self.build([self.instance])[0]
+
+
+class FastProductsSerializer(FastSerializer):
+    # карточка товара (api/cards.py): цена со скидкой, как with_card_price
+    serializer_class = ProductsSerializer
+    columns = {
+        'price': 'effective_price',
+        'href': ('id', lambda pk: f'/catalog/{pk}'),
+        'images': ('images', None),
+        'tags': ('tags', None),
+    }
+    extra_columns = ('limited', 'on_banner')
+
+    @classmethod
+    def get_related(cls):
+        return [product_images('id'),
+                Related('tags', 'id', lambda keys: Product.tags.through.objects.filter(product__in=keys).
+                        order_by('product', 'tag').values('product', 'tag'), 'product', lambda row: row['tag'])]
+
+    @classmethod
+    def values(cls, queryset):
+        return Product.with_effective_price(queryset.prefetch_related(None)).values(*cls.value_columns())
+
+    @classmethod
+    def render_json(cls, rows):
+        # как json.loads(json.dumps(data, cls=JSONEncoder)) в render_card: Decimal -> float
+        return [{name: float(value) if isinstance(value, Decimal) else value for name, value in item.items()}
+                for item in cls.build(rows)]
+
+
+class FastSalesSerializer(FastSerializer):
+    serializer_class = SalesSerializer
+    columns = {
+        'href': ('product__id', lambda pk: f'catalog/{pk}'),
+        'images': ('images', None),
+    }
+
+    @classmethod
+    def get_related(cls):
+        return [product_images('product__id')]
+
+
+class FastOrderProductSerializer(FastSerializer):
+    serializer_class = OrderProductSerializer
+
+
+class FastOrderSerializer(FastSerializer):
+    serializer_class = OrderSerializer
+    columns = {'products': ('products', None)}
+
+    @classmethod
+    def get_related(cls):
+        # тот же запрос, что prefetch_related('products'), без сортировки
+        return [Related('products', 'orderId', lambda keys: OrderProduct.objects.filter(order__in=keys).values(
+            'order', *FastOrderProductSerializer.value_columns()), 'order',
+            lambda row: FastOrderProductSerializer.render([row])[0])]
+
+
+class FastOrderSummarySerializer(FastSerializer):
+    serializer_class = OrderSummarySerializer
+
+
+class FastListMixin:
+    # list() собирает ответ fast_serializer_class из .values(); остальные действия и API_FAST_SERIALIZERS = False -
+    # обычный serializer_class
+    fast_serializer_class = None
+    fast = False
+
+    def list(self, request, *args, **kwargs):
+        self.fast = FAST_SERIALIZERS
+        return super().list(request, *args, **kwargs)
+
+    def get_fast_serializer_class(self):
+        return self.fast_serializer_class
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        return self.get_fast_serializer_class().values(queryset) if self.fast else queryset
+
+    def get_serializer_class(self):
+        return self.get_fast_serializer_class() if self.fast else super().get_serializer_class()
@@ -0,0 +1,151 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+from api.metrics import registry
+
+# Первый уровень перед общим кэшем Django: ограниченный LRU с TTL в памяти процесса (воркера). Ключи api/cache.py
+# содержат версию, и значение под ключом не меняется, меняются только сами версии. Поэтому для согласованности
+# между воркерами хватает счетчика поколений в общем кэше: bump_version увеличивает его, каждый воркер сверяет
+# счетчик не чаще раза в LOCAL_CACHE_CHECK_INTERVAL секунд и при смене очищает свой уровень. Значения отдаются
+# без копирования, изменять их нельзя.
+LOCAL_CACHE_SIZE = getattr(settings, 'API_LOCAL_CACHE_SIZE', 1000)
+LOCAL_CACHE_TTL = getattr(settings, 'API_LOCAL_CACHE_TTL', 60)
+LOCAL_CACHE_CHECK_INTERVAL = getattr(settings, 'API_LOCAL_CACHE_CHECK_INTERVAL', 1.0)
+GENERATION_KEY = 'api:local:generation'
+CACHE_NAME = 'local'
+
+
+class LocalCache:
+
+    def __init__(self, maxsize=LOCAL_CACHE_SIZE, ttl=LOCAL_CACHE_TTL, check_interval=LOCAL_CACHE_CHECK_INTERVAL,
+                 clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.generation = None
+        self.checked_at = None
+
+    def needs_check(self, now):
+        return self.checked_at is None or now - self.checked_at >= self.check_interval
+
+    def sync_generation(self, generation, now):
+        with self.lock:
+            if generation != self.generation:
+                if self.entries:
+                    registry.inc('api_local_cache_invalidations_total')
+                self.entries.clear()
+                self.generation = generation
+            self.checked_at = now
+
+    def lookup(self, key, now):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= now:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, value):
+        # только в память процесса, общий кэш не трогается
+        if value is None:
+            return
+        with self.lock:
+            self.entries[key] = (self.clock() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                registry.inc('api_local_cache_evictions_total')
+
+    def count_lookup(self, hits, misses):
+        for result, count in (('hit', hits), ('miss', misses)):
+            if count:
+                registry.inc('api_cache_requests_total', count, cache=CACHE_NAME, result=result)
+
+    def get_local_many(self, keys):
+        now = self.clock()
+        values = {}
+        for key in keys:
+            value = self.lookup(key, now)
+            if value is not None:
+                values[key] = value
+        self.count_lookup(len(values), len(keys) - len(values))
+        return values
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys):
+        now = self.clock()
+        if self.needs_check(now):
+            self.sync_generation(cache.get(GENERATION_KEY), now)
+        values = self.get_local_many(keys)
+        missing = [key for key in keys if key not in values]
+        if missing:
+            for key, value in cache.get_many(missing).items():
+                self.put(key, value)
+                values[key] = value
+        return values
+
+    def set(self, key, value, timeout):
+        cache.set(key, value, timeout)
+        self.put(key, value)
+
+    def invalidate(self):
+        # после смены версии: свой уровень очищается сразу, остальные воркеры - при следующей сверке
+        try:
+            generation = cache.incr(GENERATION_KEY)
+        except ValueError:
+            cache.add(GENERATION_KEY, 1, timeout=None)
+            generation = cache.get(GENERATION_KEY)
+        self.sync_generation(generation, self.clock())
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.checked_at = None
+
+    def stats(self):
+        with self.lock:
+            size = len(self.entries)
+        return {
+            'size': size,
+            'maxsize': self.maxsize,
+            'hits': registry.get_count('api_cache_requests_total', cache=CACHE_NAME, result='hit'),
+            'misses': registry.get_count('api_cache_requests_total', cache=CACHE_NAME, result='miss'),
+            'evictions': registry.get_count('api_local_cache_evictions_total'),
+            'invalidations': registry.get_count('api_local_cache_invalidations_total'),
+        }
+
+    # async-варианты для api/async_views.py
+
+    async def aget(self, key):
+        return (await self.aget_many([key])).get(key)
+
+    async def aget_many(self, keys):
+        now = self.clock()
+        if self.needs_check(now):
+            self.sync_generation(await cache.aget(GENERATION_KEY), now)
+        values = self.get_local_many(keys)
+        missing = [key for key in keys if key not in values]
+        if missing:
+            for key, value in (await cache.aget_many(missing)).items():
+                self.put(key, value)
+                values[key] = value
+        return values
+
+    async def aset(self, key, value, timeout):
+        await cache.aset(key, value, timeout)
+        self.put(key, value)
+
+
+local_cache = LocalCache()
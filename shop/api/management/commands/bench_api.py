@@ -0,0 +1,165 @@
+import json
+import statistics
+import subprocess
+import time
+from datetime import datetime, timezone
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from api import metrics, urls
+from api.models import Category, Product, Order, Baskets
+
+ALLOWED_HOST = 'localhost'
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Прогоняет все маршруты api/urls.py через тестовый клиент и считает задержки, запросы и пропускную ' \
+           'способность. Изменяющие запросы откатываются. Данные - generate_catalog.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50, help='запросов на маршрут')
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument('--route', action='append', dest='routes', help='только указанные url name')
+        parser.add_argument('--json', help='сохранить результат в файл')
+        parser.add_argument('--compare', help='сравнить с прошлым результатом (json)')
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(username__startswith='bench_user_', baskets__isnull=False).first()
+        product = Product.objects.order_by('-review_count').first()
+        category = Category.objects.filter(products__isnull=False).first()
+        if user is None or product is None:
+            raise CommandError('no benchmark data, run generate_catalog first')
+        order = Order.objects.filter(user=user).order_by('-createdAt').first()
+
+        client = Client(HTTP_HOST=ALLOWED_HOST)
+        client.force_login(user)
+        # /api/_metrics открыт только staff и адресам из API_METRICS_ALLOWED_IPS, пускаем адрес тестового клиента
+        metrics.ALLOWED_IPS = (*metrics.ALLOWED_IPS, '127.0.0.1')
+        scenarios = self.get_scenarios(user, product, category, order)
+        uncovered = {pattern.name for pattern in urls.urlpatterns} - set(scenarios)
+        if uncovered:
+            self.stderr.write(f'routes without scenario: {", ".join(sorted(uncovered))}')
+
+        results = {}
+        for name, (method, path, data) in scenarios.items():
+            if options['routes'] and name not in options['routes']:
+                continue
+            results[name] = self.run_route(client, method, path, data, options['requests'], options['warmup'])
+            self.print_row(name, results[name])
+
+        report = {
+            'meta': {
+                'commit': self.get_commit(),
+                'database': connection.vendor,
+                'requests': options['requests'],
+                'created': datetime.now(timezone.utc).isoformat(),
+            },
+            'routes': results,
+        }
+        if options['json']:
+            with open(options['json'], 'w') as file:
+                json.dump(report, file, indent=2)
+        if options['compare']:
+            with open(options['compare']) as file:
+                self.compare(json.load(file)['routes'], results)
+
+    def get_scenarios(self, user, product, category, order):
+        basket_product = Baskets.objects.filter(user=user).values_list('product', flat=True).first()
+        order_data = {'orderId': '1', 'createdAt': '2023-05-05 12:12', 'fullName': 'Bench', 'email': 'b@example.com',
+                      'phone': '89000000000', 'deliveryType': 'free', 'paymentType': 'online', 'totalCost': 1,
+                      'status': 'accepted', 'city': 'Moscow', 'address': 'red square 1', 'products': []}
+        return {
+            'profile_detail': ('get', '/api/profile', None),
+            'categories_list': ('get', '/api/categories', None),
+            'set_password': ('post', '/api/profile/password', {'password': 'bench-password-42'}),
+            'set_avatar': ('post', '/api/profile/avatar', {'url': 'https://example.com/a.png'}),
+            'tags': ('get', '/api/tags', None),
+            'create_payment': ('post', '/api/payment', {'number': '9999999999999999', 'name': 'Bench',
+                                                        'month': '02', 'year': '2030', 'code': '123'}),
+            'catalog': ('get', '/api/catalog?sort=rating&sortType=dec&limit=20', None),
+            'catalog_wit_id': ('get', f'/api/catalog/{category.pk}?sort=price&sortType=inc', None),
+            'popular': ('get', '/api/products/popular', None),
+            'limited': ('get', '/api/products/limited', None),
+            'on_banners': ('get', '/api/banners', None),
+            'product_detail': ('get', f'/api/products/{product.pk}', None),
+            'product_reviews': ('get', f'/api/products/{product.pk}/reviews?limit=10', None),
+            'create_review': ('post', f'/api/product/{product.pk}/review', {'author': 'bench', 'rate': 5,
+                                                                            'email': 'b@example.com', 'text': 'ok'}),
+            'users_basket': ('get', '/api/basket', None),
+            'users_basket_batch': ('post', '/api/basket/batch', [{'id': product.pk, 'count': 1, 'op': 'add'},
+                                                                 {'id': basket_product, 'count': 1, 'op': 'remove'}]),
+            'sales_list': ('get', '/api/sales', None),
+            'order_list': ('get', '/api/orders', None),
+            'order_history': ('get', '/api/orders/history?limit=20', None),
+            'order_from_basket': ('post', '/api/orders/basket', {}),
+            'order_last_active_detail': ('get', '/api/orders/active', None),
+            'order_detail': ('get', f'/api/orders/{order.pk if order else 1}', None),
+            'metrics': ('get', '/api/_metrics', None),
+            'create_order': ('post', '/api/orders', order_data),
+        }
+
+    def request(self, client, method, path, data):
+        if method == 'get':
+            return client.get(path)
+        try:
+            with transaction.atomic():
+                response = getattr(client, method)(path, data, content_type='application/json')
+                raise Rollback(response)
+        except Rollback as rollback:
+            return rollback.args[0]
+
+    def run_route(self, client, method, path, data, count, warmup):
+        for _ in range(warmup):
+            self.request(client, method, path, data)
+        timings, queries, statuses = [], [], set()
+        started = time.perf_counter()
+        for _ in range(count):
+            with CaptureQueriesContext(connection) as captured:
+                request_started = time.perf_counter()
+                response = self.request(client, method, path, data)
+                timings.append((time.perf_counter() - request_started) * 1000)
+            queries.append(len(captured.captured_queries))
+            statuses.add(response.status_code)
+        total = time.perf_counter() - started
+        percentiles = statistics.quantiles(timings, n=100, method='inclusive') if len(timings) > 1 else timings * 99
+        return {
+            'method': method.upper(),
+            'path': path,
+            'status': sorted(statuses),
+            'p50_ms': round(percentiles[49], 3),
+            'p95_ms': round(percentiles[94], 3),
+            'p99_ms': round(percentiles[98], 3),
+            'mean_ms': round(statistics.mean(timings), 3),
+            'queries': round(statistics.mean(queries), 2),
+            'rps': round(count / total, 1),
+        }
+
+    def print_row(self, name, result):
+        self.stdout.write(f'{name:26} {result["method"]:5} p50 {result["p50_ms"]:9.2f} ms  '
+                          f'p95 {result["p95_ms"]:9.2f} ms  p99 {result["p99_ms"]:9.2f} ms  '
+                          f'queries {result["queries"]:7.1f}  rps {result["rps"]:8.1f}  status {result["status"]}')
+
+    def compare(self, before, after):
+        self.stdout.write('')
+        for name, result in after.items():
+            if name not in before:
+                continue
+            old = before[name]
+            change = (result['p50_ms'] - old['p50_ms']) / old['p50_ms'] * 100 if old['p50_ms'] else 0
+            self.stdout.write(f'{name:26} p50 {old["p50_ms"]:9.2f} -> {result["p50_ms"]:9.2f} ms ({change:+6.1f}%)  '
+                              f'queries {old["queries"]:7.1f} -> {result["queries"]:7.1f}')
+
+    def get_commit(self):
+        try:
+            return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                  check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
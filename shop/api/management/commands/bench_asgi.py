@@ -0,0 +1,155 @@
+import asyncio
+import io
+import json
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from api.models import Category, Product
+
+ALLOWED_HOST = 'localhost'
+
+
+def wsgi_request(handler, path):
+    path, _, query = path.partition('?')
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query, 'SERVER_NAME': ALLOWED_HOST,
+        'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1', 'HTTP_HOST': ALLOWED_HOST, 'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr, 'wsgi.url_scheme': 'http', 'wsgi.version': (1, 0), 'wsgi.multithread': True,
+        'wsgi.multiprocess': False, 'wsgi.run_once': False,
+    }
+    statuses = []
+    response = handler(environ, lambda status, headers, exc_info=None: statuses.append(status))
+    try:
+        b''.join(response)
+    finally:
+        # как у WSGI-сервера: close() шлет request_finished и закрывает соединение с БД
+        response.close()
+    return int(statuses[0].split()[0])
+
+
+async def asgi_request(handler, path):
+    path, _, query = path.partition('?')
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'query_string': query.encode(), 'root_path': '',
+        'headers': [(b'host', ALLOWED_HOST.encode())], 'client': ('127.0.0.1', 0), 'server': (ALLOWED_HOST, 80),
+    }
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    await handler(scope, receive, send)
+    return messages[0]['status']
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает read-only эндпоинты под WSGI (пул потоков, api/views.py) и под ASGI (один event loop, ' \
+           'api/async_views.py) при одинаковом числе одновременных запросов. Данные - generate_catalog. ' \
+           'Разница заметна на PostgreSQL, SQLite сериализует доступ к файлу.'
+
+    modes = ('wsgi', 'asgi', 'asgi_sync')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='запросов на маршрут и режим')
+        parser.add_argument('--concurrency', type=int, default=32)
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument('--route', action='append', dest='routes')
+        parser.add_argument('--mode', action='append', dest='modes', choices=self.modes,
+                            help='wsgi - api/views.py в потоках, asgi - api/async_views.py, '
+                                 'asgi_sync - api/views.py под ASGI')
+        parser.add_argument('--json', help='сохранить результат в файл')
+
+    def handle(self, *args, **options):
+        product = Product.objects.order_by('-review_count').first()
+        category = Category.objects.filter(products__isnull=False).first()
+        if product is None:
+            raise CommandError('no benchmark data, run generate_catalog first')
+        # пути относительно /api/ и /api/async/
+        routes = {
+            'categories': 'categories',
+            'tags': 'tags',
+            'catalog': 'catalog?sort=rating&sortType=dec&limit=20',
+            'catalog_page_5': 'catalog?sort=price&sortType=inc&page=5',
+            'catalog_wit_id': f'catalog/{category.pk}',
+            'popular': 'products/popular',
+            'limited': 'products/limited',
+            'on_banners': 'banners',
+            'product_detail': f'products/{product.pk}',
+            'sales': 'sales',
+        }
+        modes = options['modes'] or self.modes
+        results = {}
+        for name, path in routes.items():
+            if options['routes'] and name not in options['routes']:
+                continue
+            results[name] = {}
+            for mode in modes:
+                results[name][mode] = self.run_mode(mode, path, options['requests'], options['concurrency'],
+                                                    options['warmup'])
+            self.print_row(name, results[name])
+
+        if options['json']:
+            with open(options['json'], 'w') as file:
+                json.dump({'database': connection.vendor, 'requests': options['requests'],
+                           'concurrency': options['concurrency'], 'routes': results}, file, indent=2)
+
+    def run_mode(self, mode, path, count, concurrency, warmup):
+        if mode == 'wsgi':
+            timings, statuses, total = self.run_wsgi(f'/api/{path}', count, concurrency, warmup)
+        else:
+            prefix = '/api/async/' if mode == 'asgi' else '/api/'
+            timings, statuses, total = asyncio.run(self.run_asgi(prefix + path, count, concurrency, warmup))
+        percentiles = statistics.quantiles(timings, n=100, method='inclusive')
+        return {
+            'status': sorted(set(statuses)),
+            'p50_ms': round(percentiles[49], 3),
+            'p95_ms': round(percentiles[94], 3),
+            'rps': round(count / total, 1),
+        }
+
+    def run_wsgi(self, path, count, concurrency, warmup):
+        handler = WSGIHandler()
+
+        def timed():
+            started = time.perf_counter()
+            status = wsgi_request(handler, path)
+            return (time.perf_counter() - started) * 1000, status
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(lambda _: timed(), range(warmup)))
+            started = time.perf_counter()
+            results = list(pool.map(lambda _: timed(), range(count)))
+            total = time.perf_counter() - started
+        return [timing for timing, _ in results], [status for _, status in results], total
+
+    async def run_asgi(self, path, count, concurrency, warmup):
+        handler = ASGIHandler()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def timed():
+            async with semaphore:
+                started = time.perf_counter()
+                status = await asgi_request(handler, path)
+                return (time.perf_counter() - started) * 1000, status
+
+        await asyncio.gather(*[timed() for _ in range(warmup)])
+        started = time.perf_counter()
+        results = await asyncio.gather(*[timed() for _ in range(count)])
+        total = time.perf_counter() - started
+        return [timing for timing, _ in results], [status for _, status in results], total
+
+    def print_row(self, name, result):
+        columns = '  '.join(f'{mode} {data["rps"]:8.1f} rps p50 {data["p50_ms"]:8.2f} p95 {data["p95_ms"]:8.2f} '
+                            f'{data["status"]}' for mode, data in result.items())
+        self.stdout.write(f'{name:16} {columns}')
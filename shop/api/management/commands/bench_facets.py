@@ -0,0 +1,58 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from rest_framework.request import Request
+
+from api.facets import build_facets, get_facets
+from api.models import Category, ProductCard, Tag
+from api.views import ProductsCatalogViewSet, ProductsCatalogWithIdViewSet
+
+
+class Command(BaseCommand):
+    help = 'Время подсчета фасетов каталога (api/facets.py) без кэша и из кэша. ' \
+           'Данные - generate_catalog --products 200000'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        category = Category.objects.filter(products__isnull=False).first()
+        tags = list(Tag.objects.order_by('id').values_list('id', flat=True)[:2])
+        if category is None or not ProductCard.objects.exists():
+            raise CommandError('no benchmark data, run generate_catalog first')
+        tag_params = '&'.join(f'tags[]={tag}' for tag in tags)
+        cases = [
+            ('all', ProductsCatalogViewSet, '', {}),
+            ('category', ProductsCatalogWithIdViewSet, '', {'id': category.pk}),
+            ('price', ProductsCatalogViewSet, 'filter[minPrice]=100&filter[maxPrice]=500', {}),
+            ('flags', ProductsCatalogViewSet, 'filter[freeDelivery]=true&filter[available]=true', {}),
+            ('tags', ProductsCatalogViewSet, tag_params, {}),
+            ('search', ProductsCatalogViewSet, 'filter[name]=video', {}),
+            ('combined', ProductsCatalogWithIdViewSet,
+             f'filter[minPrice]=100&filter[available]=true&filter[minRating]=3&{tag_params}', {'id': category.pk}),
+        ]
+        factory = RequestFactory()
+        for name, view_class, query, kwargs in cases:
+            request = Request(factory.get(f'/api/catalog?{query}'))
+            view = view_class(request=request, args=(), kwargs=kwargs, format_kwarg=None)
+            queryset = view.filter_queryset(view.get_queryset())
+            timings = []
+            for _ in range(options['repeat']):
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    facets = build_facets(queryset)
+                    timings.append((time.perf_counter() - started) * 1000)
+            get_facets(view, queryset)
+            cached = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                get_facets(view, queryset)
+                cached.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            self.stdout.write(f'{name:10} total {facets["total"]:7}  queries {len(queries)}  '
+                              f'mean {statistics.mean(timings):8.2f} ms  p95 {timings[int(len(timings) * 0.95) - 1]:8.2f} ms'
+                              f'  cached {statistics.mean(cached):6.3f} ms')
@@ -0,0 +1,66 @@
+import random
+import re
+import statistics
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+
+from api.models import Product
+from api.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает время поиска по каталогу: icontains и выбранный поисковый бэкенд'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--limit', type=int, default=20, help='размер страницы выдачи')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--frequent', type=int, default=5,
+                            help='сколько самых частых слов каталога прогнать отдельно (большая выдача)')
+        parser.add_argument('--backend', action='append', dest='backends',
+                            help='можно указать несколько раз, по умолчанию icontains и бэкенд из настроек')
+
+    def handle(self, *args, **options):
+        titles = list(Product.objects.order_by('?').values_list('title', flat=True)[:1000])
+        counts = Counter(word.lower() for title in titles for word in re.findall(r'\w{3,}', title))
+        words = sorted(counts)
+        if not words:
+            self.stderr.write('no products to search, run generate_catalog first')
+            return
+        rnd = random.Random(options['seed'])
+        cases = {
+            'random': [rnd.sample(words, min(len(words), rnd.choice([1, 1, 2]))) for _ in range(options['queries'])],
+            # частые слова дают десятки тысяч совпадений: проверка, что ранжирование не растет квадратично
+            'frequent': [[word] for word, _ in counts.most_common(options['frequent'])],
+        }
+        backends = options['backends'] or ['api.search.IcontainsSearchBackend', None]
+        for path in backends:
+            backend = get_search_backend(path)
+            name = path or type(backend).__name__
+            for case, queries in cases.items():
+                if queries:
+                    self.report(f'{name} [{case}]', self.run_queries(backend, queries, options['limit']), queries)
+
+    def run_queries(self, backend, queries, limit):
+        timings, found = [], 0
+        for terms in queries:
+            queryset = Product.objects.only('id', 'title')
+            started = time.perf_counter()
+            queryset = backend.search(queryset, terms)
+            if 'search_rank' in queryset.query.annotations:
+                queryset = queryset.order_by('-search_rank', '-date')
+            else:
+                queryset = queryset.order_by('-date')
+            total = queryset.count()
+            list(queryset[:limit])
+            timings.append((time.perf_counter() - started) * 1000)
+            found += total
+        return sorted(timings), found
+
+    def report(self, name, result, queries):
+        timings, found = result
+        self.stdout.write(f'{name}: mean {statistics.mean(timings):.2f} ms, '
+                          f'p95 {timings[max(int(len(timings) * 0.95) - 1, 0)]:.2f} ms, '
+                          f'avg hits {found / len(queries):.1f}')
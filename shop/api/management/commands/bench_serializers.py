@@ -0,0 +1,53 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+
+from api.cards import card_products, with_card_price, render_card
+from api.fast_serializers import FastProductsSerializer, FastSalesSerializer, FastOrderSerializer
+from api.models import Product, Sales, Order
+from api.serializers import SalesSerializer, OrderSerializer
+
+
+class Command(BaseCommand):
+    help = 'Время на объект: ModelSerializer и быстрые сериализаторы (api/fast_serializers.py) на страницах ' \
+           'карточек, скидок и заказов, вместе с запросами к БД. Данные - generate_catalog'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--sizes', type=int, nargs='+', default=[20, 100])
+
+    def handle(self, *args, **options):
+        if not Sales.objects.exists() or not Order.objects.exists():
+            raise CommandError('no benchmark data, run generate_catalog first')
+        for size in options['sizes']:
+            ids = list(Product.objects.order_by('id').values_list('id', flat=True)[:size])
+            sales = Sales.objects.select_related('product').prefetch_related('product__images').order_by('-id')
+            orders = Order.objects.prefetch_related('products').order_by('orderId')
+            cases = [
+                ('cards', lambda: [render_card(with_card_price(product))
+                                   for product in card_products().filter(pk__in=ids)],
+                 lambda: FastProductsSerializer.render_json(
+                     FastProductsSerializer.values(Product.objects.filter(pk__in=ids)))),
+                ('sales', lambda: SalesSerializer(sales[:size], many=True).data,
+                 lambda: FastSalesSerializer.build(FastSalesSerializer.values(sales)[:size])),
+                ('orders', lambda: OrderSerializer(orders[:size], many=True).data,
+                 lambda: FastOrderSerializer.build(FastOrderSerializer.values(orders)[:size])),
+            ]
+            for name, slow, fast in cases:
+                data = slow()
+                if JSONRenderer().render(data) != JSONRenderer().render(fast()):
+                    raise CommandError(f'{name}: fast serializer output differs')
+                slow_time, fast_time = self.measure(slow, options['repeat']), self.measure(fast, options['repeat'])
+                count = len(data) or 1
+                self.stdout.write(f'{name:7} x{len(data):4}  drf {slow_time * 1000 / count:8.1f} us/obj  '
+                                  f'fast {fast_time * 1000 / count:8.1f} us/obj  x{slow_time / fast_time:5.1f}')
+
+    def measure(self, build, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            build()
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings)
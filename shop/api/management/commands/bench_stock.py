@@ -0,0 +1,90 @@
+import statistics
+import threading
+import time
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction, OperationalError
+from django.utils import timezone
+
+from api.models import Category, Product, Order
+from api.stock import OutOfStock, reserve
+
+ORDER_PREFIX = 'stock-bench-'
+
+
+class Command(BaseCommand):
+    help = 'Нагрузочный тест резервирования (api/stock.py): потоки одновременно оформляют заказы на один товар, ' \
+           'в конце проверяется, что продано не больше остатка. Созданные заказы и товар удаляются'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--orders', type=int, default=100, help='заказов на поток')
+        parser.add_argument('--stock', type=int, default=1000)
+        parser.add_argument('--lines', type=int, default=1, help='товаров в заказе')
+
+    def handle(self, *args, **options):
+        category = Category.objects.first()
+        if category is None:
+            raise CommandError('no categories, run generate_catalog first')
+        user, _ = User.objects.get_or_create(username=f'{ORDER_PREFIX}user')
+        products = [Product.objects.create(category=category, price=100, count=options['stock'],
+                                           date=timezone.now(), title=f'stock bench {i}')
+                    for i in range(options['lines'])]
+        results, retries, timings = [], [0], []
+        lock = threading.Lock()
+
+        def buy(count):
+            while True:
+                started = time.perf_counter()
+                try:
+                    with transaction.atomic():
+                        order = Order.objects.create(
+                            orderId=f'{ORDER_PREFIX}{uuid.uuid4().hex[:12]}', createdAt=timezone.now(), user=user,
+                            fullName='bench', email='bench@example.com', deliveryType='free', paymentType='online',
+                            totalCost=0, status='accepted', city='Moscow', address='red square 1')
+                        reserve(order, [(product.pk, count) for product in products])
+                    sold = count
+                except OutOfStock:
+                    sold = 0
+                except OperationalError:
+                    # SQLite: файл базы занят другим писателем дольше timeout
+                    with lock:
+                        retries[0] += 1
+                    continue
+                with lock:
+                    results.append(sold)
+                    timings.append((time.perf_counter() - started) * 1000)
+                return
+
+        def worker(index):
+            try:
+                for attempt in range(options['orders']):
+                    buy((index + attempt) % 3 + 1)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(index,)) for index in range(options['threads'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        try:
+            sold = sum(results)
+            left = [product.count for product in Product.objects.filter(pk__in=[p.pk for p in products])]
+            timings.sort()
+            self.stdout.write(f'{connection.vendor}: {len(results)} orders in {elapsed:.2f} s, '
+                              f'{len(results) / elapsed:.0f} orders/s, p50 {statistics.median(timings):.2f} ms, '
+                              f'p95 {timings[int(len(timings) * 0.95) - 1]:.2f} ms, retries {retries[0]}')
+            self.stdout.write(f'sold {sold} of {options["stock"]}, left {left}, '
+                              f'rejected {results.count(0)} orders')
+            if any(count != options['stock'] - sold for count in left):
+                raise CommandError('stock does not match sold items')
+        finally:
+            Order.objects.filter(orderId__startswith=ORDER_PREFIX).delete()
+            Product.objects.filter(pk__in=[product.pk for product in products]).delete()
+            user.delete()
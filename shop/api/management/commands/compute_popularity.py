@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from api.popularity import HALF_LIFE_DAYS, TOP_N, compute_popularity
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает ProductPopularity (отзывы, оценка и продажи с затуханием). Запускать по расписанию, ' \
+           'например раз в час из cron'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--half-life', type=float, default=HALF_LIFE_DAYS, help='период полураспада, дней')
+        parser.add_argument('--top', type=int, default=TOP_N, help='товаров на категорию')
+
+    def handle(self, *args, **options):
+        total = compute_popularity(half_life=options['half_life'], top_n=options['top'])
+        self.stdout.write(f'popular products stored: {total}')
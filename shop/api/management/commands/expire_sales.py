@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from api.sales import expire_sales, start_sales
+
+
+class Command(BaseCommand):
+    help = 'Удаляет закончившиеся скидки и применяет начавшиеся к карточкам каталога (запускать раз в сутки)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        expired = expire_sales(batch_size=options['batch_size'])
+        started = start_sales(batch_size=options['batch_size'])
+        self.stdout.write(f'expired sales: {expired}, started sales: {started}')
@@ -0,0 +1,35 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.catalog_io import FORMATS, WRITERS, export_records
+
+
+class Command(BaseCommand):
+    help = 'Потоковая выгрузка каталога в JSONL/CSV (api/catalog_io.py), формат тот же, что у import_catalog'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='файл или - для stdout')
+        parser.add_argument('--format', choices=FORMATS, help='по умолчанию - по расширению файла')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('csv' if path.endswith('.csv') else 'jsonl')
+        started = time.perf_counter()
+        count = 0
+
+        def counted(records):
+            nonlocal count
+            for count, record in enumerate(records, 1):
+                yield record
+
+        stream = sys.stdout if path == '-' else open(path, 'w', encoding='utf-8', newline='')
+        try:
+            WRITERS[file_format](stream, counted(export_records(options['chunk_size'])))
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
+        # в stdout идут данные, статистика - в stderr
+        self.stderr.write(f'products: {count}, {time.perf_counter() - started:.2f}s')
@@ -0,0 +1,169 @@
+import random
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.cache import bump_version
+from api.cards import rebuild_cards
+from api.category_tree import rebuild_category_tree
+from api.models import Profile, Category, Tag, Image, Product, Baskets, Review, Sales, Specification, Order, \
+    OrderProduct
+from api.popularity import compute_popularity
+from api.search import get_search_backend
+
+BASE_DATE = datetime(2023, 1, 1, tzinfo=timezone.utc)
+USERNAME_PREFIX = 'bench_user_'
+IMAGES = ['imgs/products/GF 210.jpg', 'imgs/products/GF 4090.jpg', 'imgs/products/RA.jpeg']
+WORDS = ['video', 'card', 'gaming', 'silent', 'turbo', 'mini', 'pro', 'ultra', 'white', 'black', 'apple', 'laptop',
+         'monitor', 'keyboard', 'mouse', 'cable', 'router', 'phone', 'tablet', 'camera', 'speaker', 'headset']
+
+
+class Command(BaseCommand):
+    help = 'Создает детерминированный синтетический каталог для нагрузочных тестов (bench_api, bench_search)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=10, help='корневых категорий')
+        parser.add_argument('--subcategories', type=int, default=5, help='подкатегорий в каждой корневой')
+        parser.add_argument('--products', type=int, default=10000)
+        parser.add_argument('--tags', type=int, default=30)
+        parser.add_argument('--images', type=int, default=2, help='картинок на товар')
+        parser.add_argument('--reviews', type=int, default=5, help='отзывов на товар в среднем')
+        parser.add_argument('--sales', type=float, default=0.05, help='доля товаров со скидкой')
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--basket', type=int, default=10, help='строк в корзине пользователя')
+        parser.add_argument('--orders', type=int, default=5, help='заказов на пользователя')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--clear', action='store_true', help='удалить данные каталога и пользователей bench_user_*')
+
+    def handle(self, *args, **options):
+        self.rnd = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        with transaction.atomic():
+            if options['clear']:
+                self.clear()
+            categories = self.create_categories(options['categories'], options['subcategories'])
+            rebuild_category_tree(self.batch_size)
+            tags = self.create_tags(options['tags'])
+            products = self.create_products(options['products'], categories, tags, options['images'],
+                                            options['reviews'], options['sales'])
+            users = self.create_users(options['users'])
+            self.create_baskets(users, products, options['basket'])
+            self.create_orders(users, products, options['orders'])
+        get_search_backend().rebuild_index()
+        rebuild_cards(self.batch_size)
+        compute_popularity(now=BASE_DATE + timedelta(days=options['orders']))
+        for name in ('categories', 'tags', 'product_lists'):
+            bump_version(name)
+        self.stdout.write(f'categories: {len(categories)}, tags: {len(tags)}, products: {len(products)}, '
+                          f'users: {len(users)}')
+
+    def bulk_create(self, model, objects):
+        return model.objects.bulk_create(objects, batch_size=self.batch_size)
+
+    def clear(self):
+        OrderProduct.objects.all().delete()
+        Order.objects.all().delete()
+        Baskets.objects.all().delete()
+        Review.objects.all().delete()
+        Sales.objects.all().delete()
+        Specification.objects.all().delete()
+        Image.objects.filter(content_type=ContentType.objects.get_for_model(Product)).delete()
+        Product.objects.all().delete()
+        Category.objects.filter(maincategories__isnull=False).delete()
+        Category.objects.all().delete()
+        Tag.objects.all().delete()
+        User.objects.filter(username__startswith=USERNAME_PREFIX).delete()
+
+    def create_categories(self, roots, children):
+        image = {'src': '/3.svg', 'alt': 'category'}
+        parents = self.bulk_create(Category, [Category(title=f'category {i}', image=image) for i in range(roots)])
+        subcategories = self.bulk_create(Category, [Category(title=f'{parent.title}.{j}', image=image,
+                                                             maincategories=parent)
+                                                    for parent in parents for j in range(children)])
+        return subcategories or parents
+
+    def create_tags(self, count):
+        return self.bulk_create(Tag, [Tag(id=f'tag-{i}', name=f'Tag {i}') for i in range(count)])
+
+    def create_products(self, count, categories, tags, images, reviews, sales):
+        rnd = self.rnd
+        products, review_rows = [], []
+        for i in range(count):
+            rates = [rnd.randint(1, 5) for _ in range(rnd.randint(0, reviews * 2))]
+            words = rnd.sample(WORDS, 3)
+            product = Product(category=rnd.choice(categories), price=Decimal(rnd.randint(100, 200000)) / 100,
+                              count=rnd.randint(0, 500), date=BASE_DATE + timedelta(minutes=i),
+                              title=f'{" ".join(words).capitalize()} {i}', description=f'{words[0]} {words[1]}',
+                              fullDescription=' '.join(rnd.choices(WORDS, k=30)), freeDelivery=rnd.random() < 0.5,
+                              limited=rnd.random() < 0.05, on_banner=rnd.random() < 0.001,
+                              review_count=len(rates), rating_sum=sum(rates),
+                              **{f'rate_{rate}': rates.count(rate) for rate in range(1, 6)})
+            if rates:
+                product.rating = (Decimal(sum(rates)) / len(rates)).quantize(Decimal('0.01'), ROUND_HALF_UP)
+            products.append(product)
+            review_rows.append(rates)
+        products = self.bulk_create(Product, products)
+
+        content_type = ContentType.objects.get_for_model(Product)
+        through = Product.tags.through
+        self.bulk_create(Image, [Image(image=IMAGES[(product.pk + j) % len(IMAGES)], content_type=content_type,
+                                       object_id=product.pk)
+                                 for product in products for j in range(images)])
+        self.bulk_create(through, [through(product_id=product.pk, tag_id=tag.pk)
+                                   for product in products for tag in rnd.sample(tags, min(len(tags), 3))])
+        self.bulk_create(Review, [Review(product_id=product.pk, author=f'author {j}', email=f'author{j}@example.com',
+                                         text='synthetic review', rate=rate)
+                                  for product, rates in zip(products, review_rows) for j, rate in enumerate(rates)])
+        self.bulk_create(Sales, [Sales(product_id=product.pk, salePrice=(product.price * Decimal('0.8')).
+                                       quantize(Decimal('0.01')), dateFrom=BASE_DATE.date())
+                                 for product in products if rnd.random() < sales])
+        specifications = self.bulk_create(Specification, [Specification(name=f'spec {i}', value=str(i))
+                                                          for i in range(20)])
+        spec_through = Specification.product.through
+        self.bulk_create(spec_through, [spec_through(specification_id=spec.pk, product_id=product.pk)
+                                        for product in products for spec in rnd.sample(specifications, 2)])
+        return products
+
+    def create_users(self, count):
+        password = make_password('password')
+        users = self.bulk_create(User, [User(username=f'{USERNAME_PREFIX}{i}', email=f'user{i}@example.com',
+                                             password=password) for i in range(count)])
+        self.bulk_create(Profile, [Profile(user=user, fullName=f'Bench User {i}', phone='89000000000')
+                                   for i, user in enumerate(users)])
+        return users
+
+    def create_baskets(self, users, products, lines):
+        rows = []
+        for user in users:
+            for product in self.rnd.sample(products, min(len(products), lines)):
+                count = self.rnd.randint(1, 5)
+                rows.append(Baskets(user=user, product=product, prod_count=count,
+                                    price_mult_count=product.price * count))
+        self.bulk_create(Baskets, rows)
+
+    def create_orders(self, users, products, per_user):
+        orders, lines = [], []
+        for user in users:
+            for i in range(per_user):
+                order = Order(orderId=f'{user.pk}{i:04d}', createdAt=BASE_DATE + timedelta(days=i), user=user,
+                              fullName=user.username, email=user.email, phone='89000000000', deliveryType='free',
+                              paymentType='online', totalCost=0, status='accepted', city='Moscow',
+                              address='red square 1', active=i == per_user - 1)
+                for number, product in enumerate(self.rnd.sample(products, min(len(products), 3)), 1):
+                    order.totalCost += product.price
+                    lines.append(OrderProduct(id=f'{order.orderId}-{number}', order=order,
+                                              category=str(product.category_id), price=product.price, count=1,
+                                              date=str(product.date), title=product.title,
+                                              description=product.description, href=f'/catalog/{product.pk}',
+                                              product=product,
+                                              freeDelivery=product.freeDelivery, images=[], tags=[],
+                                              reviews=product.review_count, rating=product.rating))
+                orders.append(order)
+        self.bulk_create(Order, orders)
+        self.bulk_create(OrderProduct, lines)
@@ -0,0 +1,38 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.cache import bump_version
+from api.catalog_io import FORMATS, READERS, CatalogImporter, CatalogImportError
+
+
+class Command(BaseCommand):
+    help = 'Потоковый импорт каталога из JSONL/CSV (api/catalog_io.py): upsert товаров по id, теги, картинки и ' \
+           'характеристики приводятся к файлу. Повторный запуск с тем же файлом ничего не меняет'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='файл или - для stdin')
+        parser.add_argument('--format', choices=FORMATS, help='по умолчанию - по расширению файла')
+        parser.add_argument('--batch-size', type=int, default=2000, help='товаров в одной транзакции')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('csv' if path.endswith('.csv') else 'jsonl')
+        importer = CatalogImporter(options['batch_size'])
+        started = time.perf_counter()
+        stream = sys.stdin if path == '-' else open(path, encoding='utf-8', newline='')
+        try:
+            importer.import_records(READERS[file_format](stream))
+        except CatalogImportError as exc:
+            raise CommandError(f'{exc} (imported before the error: {importer.products})')
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+            if importer.products:
+                # новые теги создаются bulk_create без сигналов
+                bump_version('tags')
+                bump_version('product_lists')
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f'products: {importer.products}, {elapsed:.2f}s, '
+                          f'{importer.products / elapsed if elapsed else 0:.0f} products/s')
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from api.cache import bump_version
+from api.category_tree import rebuild_category_tree
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает таблицу иерархии категорий CategoryClosure (нужно после массовых изменений без сигналов)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        total = rebuild_category_tree(options['batch_size'])
+        bump_version('product_lists')
+        self.stdout.write(f'category links rebuilt: {total}')
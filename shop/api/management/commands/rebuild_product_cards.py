@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from api.cache import bump_version
+from api.cards import rebuild_cards
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает карточки товаров ProductCard (нужно после миграции 0020 и массовых изменений без сигналов)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        total = rebuild_cards(options['batch_size'])
+        bump_version('product_lists')
+        self.stdout.write(f'product cards rebuilt: {total}')
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from api.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает поисковый индекс товаров (после bulk_create/update, которые не вызывают сигналы)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backend', help='путь к классу бэкенда, по умолчанию из REST_FRAMEWORK')
+
+    def handle(self, *args, **options):
+        get_search_backend(options['backend']).rebuild_index()
+        self.stdout.write('search index rebuilt')
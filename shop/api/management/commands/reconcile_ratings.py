@@ -0,0 +1,55 @@
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Sum, Max, Q
+
+from api.cards import refresh_cards_on_commit
+from api.models import Product, Review, RATES
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает rating, review_count, rating_sum и гистограмму оценок товаров по таблице отзывов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--dry-run', action='store_true', help='только посчитать расхождения')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = Product.objects.aggregate(Max('id'))['id__max'] or 0
+        checked = fixed = 0
+        histogram = [f'rate_{rate}' for rate in RATES]
+        for start in range(0, last_id, batch_size):
+            with transaction.atomic():
+                products = Product.objects.filter(id__gt=start, id__lte=start + batch_size).\
+                    only('id', 'rating', 'review_count', 'rating_sum', *histogram)
+                if not options['dry_run']:
+                    products = products.select_for_update()
+                stats = {row['product']: row for row in Review.objects.
+                         filter(product__gt=start, product__lte=start + batch_size).
+                         values('product').annotate(count=Count('id'), total=Sum('rate'),
+                                                    **{f'rate_{rate}': Count('id', filter=Q(rate=rate))
+                                                       for rate in RATES})}
+                changed = []
+                for product in products:
+                    checked += 1
+                    row = stats.get(product.id, {'count': 0, 'total': 0, **dict.fromkeys(histogram, 0)})
+                    rating = Decimal(0)
+                    if row['count']:
+                        rating = (Decimal(row['total']) / row['count']).quantize(Decimal('0.01'), ROUND_HALF_UP)
+                    counts = [row[field] for field in histogram]
+                    if (product.review_count, product.rating_sum, product.rating) != (row['count'], row['total'], rating) \
+                            or [getattr(product, field) for field in histogram] != counts:
+                        product.review_count = row['count']
+                        product.rating_sum = row['total']
+                        product.rating = rating
+                        for field, count in zip(histogram, counts):
+                            setattr(product, field, count)
+                        changed.append(product)
+                if changed and not options['dry_run']:
+                    Product.objects.bulk_update(changed, ['review_count', 'rating_sum', 'rating', *histogram])
+                    Product.touch([product.pk for product in changed])
+                    refresh_cards_on_commit(product.pk for product in changed)
+                fixed += len(changed)
+        self.stdout.write(f'checked: {checked}, out of sync: {fixed}' + (' (dry run)' if options['dry_run'] else ''))
@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.product_cache import top_product_ids, warm_products
+
+
+class Command(BaseCommand):
+    help = 'Заполняет кэш ответов /api/products/<pk> (api/product_cache.py) для N самых популярных товаров. ' \
+           'Запускать после деплоя и compute_popularity'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=100)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        product_ids = top_product_ids(options['top'])
+        warmed = warm_products(product_ids)
+        self.stdout.write(f'products: {len(product_ids)}, warmed: {warmed}, already cached: {len(product_ids) - warmed}, '
+                          f'{time.perf_counter() - started:.2f}s')
@@ -0,0 +1,195 @@
+import asyncio
+import random
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpResponse, HttpResponseForbidden
+
+# доля запросов, для которых снимаются метрики: 1.0 - все, 0.05 - каждый двадцатый в среднем
+SAMPLE_RATE = getattr(settings, 'API_METRICS_SAMPLE_RATE', 1.0)
+# /api/_metrics открыт staff-пользователям и адресам из списка (REMOTE_ADDR), например сборщику Prometheus
+ALLOWED_IPS = getattr(settings, 'API_METRICS_ALLOWED_IPS', ())
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    metrics = (
+        ('api_request_duration_seconds', 'Wall time of the request', DURATION_BUCKETS),
+        ('api_request_queries', 'Number of SQL queries per request', QUERY_BUCKETS),
+        ('api_request_sql_duration_seconds', 'Time spent in SQL per request', DURATION_BUCKETS),
+    )
+
+    counters = (
+        ('api_cache_requests_total', 'Cache lookups by cache and result (hit, miss)'),
+        ('api_local_cache_evictions_total', 'Entries evicted from the in-process cache by its size limit'),
+        ('api_local_cache_invalidations_total', 'In-process cache flushes after a cache generation change'),
+    )
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+        self.counts = defaultdict(int)
+
+    def observe(self, view, duration, queries, sql_duration):
+        with self.lock:
+            histograms = self.views.get(view)
+            if histograms is None:
+                histograms = self.views[view] = [Histogram(buckets) for _, _, buckets in self.metrics]
+            for histogram, value in zip(histograms, (duration, queries, sql_duration)):
+                if value is not None:
+                    histogram.observe(value)
+
+    def inc(self, name, value=1, **labels):
+        with self.lock:
+            self.counts[name, tuple(sorted(labels.items()))] += value
+
+    def get_count(self, name, **labels):
+        with self.lock:
+            return self.counts.get((name, tuple(sorted(labels.items()))), 0)
+
+    def reset(self):
+        with self.lock:
+            self.views = {}
+            self.counts = defaultdict(int)
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for index, (name, description, buckets) in enumerate(self.metrics):
+                lines.append(f'# HELP {name} {description}')
+                lines.append(f'# TYPE {name} histogram')
+                for view, histograms in sorted(self.views.items()):
+                    histogram = histograms[index]
+                    cumulative = 0
+                    for bound, count in zip(buckets + ('+Inf',), histogram.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{{view="{view}",le="{bound}"}} {cumulative}')
+                    lines.append(f'{name}_sum{{view="{view}"}} {histogram.sum:.6f}')
+                    lines.append(f'{name}_count{{view="{view}"}} {histogram.count}')
+            for name, description in self.counters:
+                lines.append(f'# HELP {name} {description}')
+                lines.append(f'# TYPE {name} counter')
+                for (counter, labels), value in sorted(self.counts.items()):
+                    if counter == name:
+                        label_text = ','.join(f'{label}="{label_value}"' for label, label_value in labels)
+                        lines.append(f'{name}{{{label_text}}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+class QueryRecorder:
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+
+
+current_recorder = ContextVar('current_recorder', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    recorder = current_recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+def install_recorder(connection):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@receiver(connection_created)
+def install_recorder_on_connect(sender, connection, **kwargs):
+    # async ORM выполняет запросы в потоках sync_to_async со своими соединениями. Обертка стоит на каждом
+    # соединении, а запрос, к которому относится SQL, берется из contextvar: asgiref переносит его в поток
+    install_recorder(connection)
+
+
+class RequestMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # как в django.utils.deprecation.MiddlewareMixin: под ASGI с async-цепочкой не занимаем поток
+        self._is_coroutine = asyncio.coroutines._is_coroutine if asyncio.iscoroutinefunction(get_response) else None
+        # соединения, открытые до загрузки middleware
+        for connection in connections.all():
+            install_recorder(connection)
+
+    def __call__(self, request):
+        if self._is_coroutine:
+            return self.__acall__(request)
+        if SAMPLE_RATE < 1 and random.random() >= SAMPLE_RATE:
+            return self.get_response(request)
+
+        for connection in connections.all():
+            install_recorder(connection)
+        recorder = QueryRecorder()
+        token = current_recorder.set(recorder)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_recorder.reset(token)
+        self.observe(request, time.perf_counter() - started, recorder.count, recorder.duration)
+        return response
+
+    async def __acall__(self, request):
+        if SAMPLE_RATE < 1 and random.random() >= SAMPLE_RATE:
+            return await self.get_response(request)
+
+        recorder = QueryRecorder()
+        token = current_recorder.set(recorder)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_recorder.reset(token)
+        self.observe(request, time.perf_counter() - started, recorder.count, recorder.duration)
+        return response
+
+    def observe(self, request, duration, queries, sql_duration):
+        match = getattr(request, 'resolver_match', None)
+        if match is not None and match.url_name:
+            registry.observe(match.url_name, duration, queries, sql_duration)
+
+
+def metrics_view(request):
+    if not (request.user.is_staff or request.META.get('REMOTE_ADDR') in ALLOWED_IPS):
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
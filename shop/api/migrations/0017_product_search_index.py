@@ -0,0 +1,58 @@
+from django.db import migrations
+
+POSTGRES_FORWARD = [
+    'ALTER TABLE api_product ADD COLUMN search_vector tsvector',
+    '''
+    CREATE FUNCTION api_product_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('simple', coalesce(NEW.title, '')), 'A') ||
+            setweight(to_tsvector('simple', coalesce(NEW.description, '')), 'B') ||
+            setweight(to_tsvector('simple', coalesce(NEW."fullDescription", '')), 'C');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    ''',
+    '''
+    CREATE TRIGGER api_product_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF title, description, "fullDescription" ON api_product
+    FOR EACH ROW EXECUTE FUNCTION api_product_search_vector_update()
+    ''',
+    'UPDATE api_product SET title = title',
+    'CREATE INDEX api_product_search_vector_idx ON api_product USING gin (search_vector)',
+]
+
+POSTGRES_BACKWARD = [
+    'DROP TRIGGER IF EXISTS api_product_search_vector_trigger ON api_product',
+    'DROP FUNCTION IF EXISTS api_product_search_vector_update()',
+    'ALTER TABLE api_product DROP COLUMN IF EXISTS search_vector',
+]
+
+SQLITE_FORWARD = [
+    'CREATE VIRTUAL TABLE api_product_fts USING fts5(title, description, fullDescription)',
+    'INSERT INTO api_product_fts (rowid, title, description, fullDescription) '
+    'SELECT id, title, description, fullDescription FROM api_product',
+]
+
+SQLITE_BACKWARD = [
+    'DROP TABLE IF EXISTS api_product_fts',
+]
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_product_rating_review_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(run({'postgresql': POSTGRES_FORWARD, 'sqlite': SQLITE_FORWARD}),
+                             run({'postgresql': POSTGRES_BACKWARD, 'sqlite': SQLITE_BACKWARD})),
+    ]
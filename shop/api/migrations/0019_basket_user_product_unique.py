@@ -0,0 +1,32 @@
+# Generated by Django 4.1.7 on 2026-10-18 14:46
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def merge_duplicates(apps, schema_editor):
+    Baskets = apps.get_model('api', 'Baskets')
+    duplicates = Baskets.objects.values('user', 'product').annotate(rows=Count('id'), total=Sum('prod_count')).\
+        filter(rows__gt=1)
+    for row in duplicates:
+        lines = Baskets.objects.filter(user=row['user'], product=row['product']).select_related('product').order_by('id')
+        first = lines[0]
+        first.prod_count = row['total']
+        first.price_mult_count = row['total'] * first.product.price
+        first.save(update_fields=['prod_count', 'price_mult_count'])
+        lines.exclude(pk=first.pk).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_product_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='baskets',
+            constraint=models.UniqueConstraint(fields=('user', 'product'), name='basket_user_product_unique'),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 4.1.7 on 2026-10-18 14:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_basket_user_product_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductCard',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='card', serialize=False, to='api.product')),
+                ('title', models.CharField(max_length=150)),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('date', models.DateTimeField()),
+                ('rating', models.DecimalField(decimal_places=2, max_digits=3)),
+                ('review_count', models.PositiveIntegerField()),
+                ('limited', models.BooleanField()),
+                ('on_banner', models.BooleanField()),
+                ('data', models.JSONField()),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.category')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='productcard',
+            index=models.Index(fields=['-review_count', '-rating'], name='card_popular_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productcard',
+            index=models.Index(fields=['rating', 'product'], name='card_rating_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productcard',
+            index=models.Index(fields=['review_count', 'product'], name='card_review_count_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productcard',
+            index=models.Index(fields=['price', 'product'], name='card_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productcard',
+            index=models.Index(fields=['date', 'product'], name='card_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productcard',
+            index=models.Index(fields=['category', 'date'], name='card_category_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productcard',
+            index=models.Index(condition=models.Q(('limited', True)), fields=['limited'], name='card_limited_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productcard',
+            index=models.Index(condition=models.Q(('on_banner', True)), fields=['on_banner'], name='card_on_banner_idx'),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 4.1.7 on 2026-10-18 15:01
+
+import re
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+HREF_RE = re.compile(r'catalog/(\d+)$')
+
+
+def link_order_lines(apps, schema_editor):
+    # href строки заказа - catalog/<id товара>; в старых заказах id строки тоже равен id товара
+    OrderProduct = apps.get_model('api', 'OrderProduct')
+    Product = apps.get_model('api', 'Product')
+    existing = set(Product.objects.values_list('id', flat=True))
+    batch = []
+    for line in OrderProduct.objects.only('id', 'href').iterator(chunk_size=2000):
+        match = HREF_RE.search(line.href)
+        product_id = int(match.group(1)) if match else int(line.id) if line.id.isdigit() else None
+        if product_id in existing:
+            line.product_id = product_id
+            batch.append(line)
+        if len(batch) >= 2000:
+            OrderProduct.objects.bulk_update(batch, ['product'])
+            batch = []
+    OrderProduct.objects.bulk_update(batch, ['product'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0021_product_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderproduct',
+            name='product',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='order_lines', to='api.product'),
+        ),
+        migrations.RunPython(link_order_lines, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='ProductPopularity',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='popularity', serialize=False, to='api.product')),
+                ('score', models.FloatField()),
+                ('rank', models.PositiveIntegerField()),
+                ('computed_at', models.DateTimeField()),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.category')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='productpopularity',
+            index=models.Index(fields=['category', 'rank'], name='popularity_category_rank_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productpopularity',
+            index=models.Index(fields=['-score', 'product'], name='popularity_score_idx'),
+        ),
+    ]
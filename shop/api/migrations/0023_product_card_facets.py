@@ -0,0 +1,35 @@
+# Generated by Django 4.1.7 on 2026-10-18 15:20
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def copy_from_products(apps, schema_editor):
+    Product = apps.get_model('api', 'Product')
+    ProductCard = apps.get_model('api', 'ProductCard')
+    product = Product.objects.filter(pk=OuterRef('product'))
+    ProductCard.objects.update(freeDelivery=Subquery(product.values('freeDelivery')),
+                               count=Subquery(product.values('count')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0022_product_popularity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productcard',
+            name='count',
+            field=models.PositiveIntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='productcard',
+            name='freeDelivery',
+            field=models.BooleanField(default=True),
+            preserve_default=False,
+        ),
+        migrations.RunPython(copy_from_products, migrations.RunPython.noop),
+    ]
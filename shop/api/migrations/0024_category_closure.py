@@ -0,0 +1,42 @@
+# Generated by Django 4.1.7 on 2026-10-18 15:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_closure(apps, schema_editor):
+    Category = apps.get_model('api', 'Category')
+    CategoryClosure = apps.get_model('api', 'CategoryClosure')
+    parents = dict(Category.objects.values_list('id', 'maincategories'))
+    links = []
+    for category_id in parents:
+        ancestor, depth, seen = category_id, 0, set()
+        while ancestor is not None and ancestor not in seen:
+            seen.add(ancestor)
+            links.append(CategoryClosure(ancestor_id=ancestor, descendant_id=category_id, depth=depth))
+            ancestor, depth = parents.get(ancestor), depth + 1
+    CategoryClosure.objects.bulk_create(links, batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0023_product_card_facets'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryClosure',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveIntegerField()),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_links', to='api.category')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_links', to='api.category')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='categoryclosure',
+            constraint=models.UniqueConstraint(fields=('ancestor', 'descendant'), name='category_closure_unique'),
+        ),
+        migrations.RunPython(build_closure, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.1.7 on 2026-10-18 15:15
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def open_existing_sales(apps, schema_editor):
+    # dateTo заполнялся датой создания (auto_now_add) и окончания не означал: старые скидки остаются без срока
+    apps.get_model('api', 'Sales').objects.update(dateTo=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0025_stock_reservation'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='sales',
+            name='dateFrom',
+            field=models.DateField(default=django.utils.timezone.localdate),
+        ),
+        migrations.AlterField(
+            model_name='sales',
+            name='dateTo',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='sales',
+            index=models.Index(fields=['dateFrom', 'dateTo'], name='sales_window_idx'),
+        ),
+        migrations.RunPython(open_existing_sales, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.1.7 on 2026-10-18 15:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0026_sales_window'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', '-createdAt', '-orderId'], name='order_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('active', True)), fields=['user', '-createdAt'], name='order_user_active_idx'),
+        ),
+    ]
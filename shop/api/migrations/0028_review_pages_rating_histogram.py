@@ -0,0 +1,56 @@
+# Generated by Django 4.1.7 on 2026-10-18 15:24
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_rates(apps, schema_editor):
+    Product = apps.get_model('api', 'Product')
+    Review = apps.get_model('api', 'Review')
+    counts = {}
+    for rate in range(1, 6):
+        reviews = Review.objects.filter(product=OuterRef('pk'), rate=rate).order_by().values('product').\
+            annotate(total=Count('pk')).values('total')
+        counts[f'rate_{rate}'] = Coalesce(Subquery(reviews), 0)
+    Product.objects.update(**counts)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0027_order_history_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='rate_1',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rate_2',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rate_3',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rate_4',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rate_5',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['product', '-date', '-id'], name='review_product_date_idx'),
+        ),
+        migrations.RunPython(count_rates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.1.7 on 2026-10-18 16:04
+
+import api.search
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0028_review_pages_rating_histogram'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchIndex',
+            fields=[
+                ('product', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_index', serialize=False, to='api.product')),
+                ('document', api.search.SearchDocumentField(db_column='api_product_fts')),
+            ],
+            options={
+                'db_table': 'api_product_fts',
+                'managed': False,
+            },
+        ),
+    ]
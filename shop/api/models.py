@@ -1,12 +1,23 @@
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.validators import MinLengthValidator, MinValueValidator, MaxValueValidator, RegexValidator
-from django.db import models
+from django.db import models, transaction
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey, GenericRelation
-from django.db.models import Avg
+from django.db.models import F, Q, FloatField, DecimalField, Case, When, Value, Subquery, OuterRef, \
+    ExpressionWrapper, FilteredRelation
+from django.db.models.functions import Cast, Round, Greatest, Coalesce
+from django.utils import timezone
 import zoneinfo
 from dateutil import tz
 
+from api.search import SearchDocumentField
+
+# сколько последних отзывов отдает /api/products/<pk>
+LATEST_REVIEWS = getattr(settings, 'API_PRODUCT_LATEST_REVIEWS', 10)
+RATES = range(1, 6)
+
+
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     fullName = models.CharField(max_length=200, blank=False, db_column='fullName')
@@ -24,6 +35,26 @@ class Category(models.Model):
     def __str__(self):
         return str(self.id)
 
+    def clean(self):
+        # перенос внутрь своего поддерева; при save() то же проверяет сигнал pre_save
+        from api.category_tree import check_move
+
+        if self.pk is not None:
+            check_move(self.pk, self.maincategories_id)
+
+
+class CategoryClosure(models.Model):
+    # иерархия категорий: строка на каждую пару (предок, потомок), включая саму категорию с depth=0.
+    # Поддерживается сигналами (api/category_tree.py), полная пересборка - manage.py rebuild_category_tree
+    ancestor = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='descendant_links')
+    descendant = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='ancestor_links')
+    depth = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['ancestor', 'descendant'], name='category_closure_unique'),
+        ]
+
 
 class Tag(models.Model):
     id = models.CharField(max_length=30, blank=False, unique=True, primary_key=True)
@@ -69,19 +100,144 @@ class Product(models.Model):
     images = GenericRelation(Image)
     tags = models.ManyToManyField(Tag, related_name='products')
     basket = models.ManyToManyField(User, through="Baskets", related_name='products')
-    # href, rating создаем в anotate иногда
+    # rating, review_count, rating_sum обновляются при создании отзыва, сверка - manage.py reconcile_ratings
+    rating = models.DecimalField(default=0, max_digits=3, decimal_places=2)
+    review_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    # гистограмма оценок: число отзывов с 1..5 звездами, обновляется вместе с rating
+    rate_1 = models.PositiveIntegerField(default=0)
+    rate_2 = models.PositiveIntegerField(default=0)
+    rate_3 = models.PositiveIntegerField(default=0)
+    rate_4 = models.PositiveIntegerField(default=0)
+    rate_5 = models.PositiveIntegerField(default=0)
+    # для ETag/Last-Modified карточки товара: растут при изменении товара, отзывов, картинок,
+    # характеристик, тегов и скидок (api/signals.py)
+    version = models.PositiveIntegerField(default=1)
+    updated_at = models.DateTimeField(default=timezone.now)
+    # href создаем в anotate иногда
+
+    # меняются только через UPDATE с F-выражениями (отзывы - add_review_rate, версия - touch), а экземпляр
+    # держит прочитанные раньше значения. Поэтому обычный save() их не пишет, иначе устаревший экземпляр откатил
+    # бы чужие изменения; записать явно - save(update_fields=[...]). count сюда не входит: остаток правят вручную
+    # (админка, staff), а заказы меняют его условными UPDATE в api/stock.py
+    SERVER_FIELDS = ('rating', 'review_count', 'rating_sum', *(f'rate_{rate}' for rate in RATES), 'version',
+                     'updated_at')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-review_count', '-rating'], name='product_popular_idx'),
+            models.Index(fields=['rating', 'id'], name='product_rating_idx'),
+            models.Index(fields=['review_count', 'id'], name='product_review_count_idx'),
+            models.Index(fields=['price', 'id'], name='product_price_idx'),
+            models.Index(fields=['date', 'id'], name='product_date_idx'),
+        ]
+
+    def save(self, *args, update_fields=None, **kwargs):
+        if update_fields is None and not self._state.adding and not kwargs.get('force_insert'):
+            update_fields = [field.name for field in self._meta.concrete_fields
+                             if not field.primary_key and field.name not in self.SERVER_FIELDS]
+        super().save(*args, update_fields=update_fields, **kwargs)
 
     def get_href(self):
         return f'catalog/{self.id}'
 
     def get_rating(self):
-        rating = self.reviews.all().aggregate(Avg('rate'))['rate__avg']
-        if not rating:
-            rating = 0
-        return round(rating, 2)
+        return self.rating
 
     def get_rev_count(self):
-        return self.reviews.all().count()
+        return self.review_count
+
+    def latest_reviews(self):
+        # в карточке товара только последние отзывы, все - /api/products/<pk>/reviews
+        return self.reviews.order_by('-date', '-id')[:LATEST_REVIEWS]
+
+    def rating_histogram(self):
+        return {str(rate): getattr(self, f'rate_{rate}') for rate in RATES}
+
+    @classmethod
+    def add_review_rate(cls, product_id, rate):
+        return cls.objects.filter(pk=product_id).update(
+            review_count=F('review_count') + 1,
+            rating_sum=F('rating_sum') + rate,
+            **{f'rate_{rate}': F(f'rate_{rate}') + 1},
+            rating=Round(Cast(Cast(F('rating_sum') + rate, FloatField()) / (F('review_count') + 1),
+                              DecimalField(max_digits=3, decimal_places=2)), 2))
+
+    @classmethod
+    def touch(cls, product_ids):
+        return cls.objects.filter(pk__in=product_ids).update(version=F('version') + 1, updated_at=timezone.now())
+
+    @classmethod
+    def with_effective_price(cls, queryset=None, today=None):
+        # effective_price - цена со скидкой, если скидка действует сегодня, иначе обычная; один LEFT JOIN
+        queryset = cls.objects.all() if queryset is None else queryset
+        return queryset.annotate(
+            active_sale=FilteredRelation('sale', condition=Sales.active_condition(today, prefix='sale__')),
+            effective_price=Coalesce('active_sale__salePrice', 'price'),
+        )
+
+    @classmethod
+    def effective_prices(cls, product_ids, today=None):
+        return dict(cls.with_effective_price(cls.objects.filter(pk__in=product_ids), today).
+                    values_list('pk', 'effective_price'))
+
+
+class ProductSearchIndex(models.Model):
+    # виртуальная таблица FTS5 из миграции 0017 (только SQLite), нужна для JOIN в SQLiteSearchBackend.
+    # document - скрытая колонка с именем таблицы, по ней MATCH и bm25
+    product = models.OneToOneField(Product, on_delete=models.DO_NOTHING, primary_key=True, db_column='rowid',
+                                   db_constraint=False, related_name='search_index')
+    document = SearchDocumentField(db_column='api_product_fts')
+
+    class Meta:
+        managed = False
+        db_table = 'api_product_fts'
+
+
+class ProductCard(models.Model):
+    # готовая карточка товара для списков (каталог, популярные, ограниченные, баннеры).
+    # Колонки дублируют поля Product для фильтров и сортировок, data - ответ ProductsSerializer.
+    # Обновляется сигналами (api/cards.py), полная пересборка - manage.py rebuild_product_cards
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='card')
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='+')
+    title = models.CharField(max_length=150)
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    date = models.DateTimeField()
+    rating = models.DecimalField(max_digits=3, decimal_places=2)
+    review_count = models.PositiveIntegerField()
+    limited = models.BooleanField()
+    on_banner = models.BooleanField()
+    freeDelivery = models.BooleanField()
+    count = models.PositiveIntegerField()
+    data = models.JSONField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-review_count', '-rating'], name='card_popular_idx'),
+            models.Index(fields=['rating', 'product'], name='card_rating_idx'),
+            models.Index(fields=['review_count', 'product'], name='card_review_count_idx'),
+            models.Index(fields=['price', 'product'], name='card_price_idx'),
+            models.Index(fields=['date', 'product'], name='card_date_idx'),
+            models.Index(fields=['category', 'date'], name='card_category_date_idx'),
+            models.Index(fields=['limited'], name='card_limited_idx', condition=Q(limited=True)),
+            models.Index(fields=['on_banner'], name='card_on_banner_idx', condition=Q(on_banner=True)),
+        ]
+
+
+class ProductPopularity(models.Model):
+    # рейтинг популярности: лучшие N товаров каждой категории по отзывам, оценке и продажам
+    # с затуханием по времени. Пересчитывается manage.py compute_popularity (api/popularity.py)
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='popularity')
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField()
+    rank = models.PositiveIntegerField()
+    computed_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['category', 'rank'], name='popularity_category_rank_idx'),
+            models.Index(fields=['-score', 'product'], name='popularity_score_idx'),
+        ]
 
 
 class Baskets(models.Model):
@@ -91,6 +247,56 @@ class Baskets(models.Model):
     price_mult_count = models.DecimalField(default=0, max_digits=12, decimal_places=2,
                                            validators=[MinValueValidator(0)])
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'product'], name='basket_user_product_unique'),
+        ]
+
+    @classmethod
+    def for_user(cls, user):
+        # число запросов не зависит от размера корзины: строки с товаром и категорией, картинки, теги
+        return cls.objects.filter(user=user).select_related('product__category').\
+            prefetch_related('product__images', 'product__tags').order_by('id')
+
+    @classmethod
+    def apply_operations(cls, user, operations):
+        # operations - список (product_id, count, op), op: add | remove | set.
+        # Операции по одному товару сворачиваются по порядку в прибавку или новое значение,
+        # дальше весь набор применяется тремя запросами без чтения корзины
+        changes = {}
+        for product_id, count, op in operations:
+            kind, value = changes.get(product_id, ('add', 0))
+            if op == 'set':
+                changes[product_id] = ('set', count)
+            else:
+                changes[product_id] = (kind, value + (count if op == 'add' else -count))
+        if not changes:
+            return
+
+        with transaction.atomic():
+            cls.objects.bulk_create([cls(user=user, product_id=product_id, prod_count=0)
+                                     for product_id, (kind, value) in changes.items() if value > 0],
+                                    ignore_conflicts=True)
+            new_count = Case(*[When(product_id=product_id,
+                                    then=Value(value) if kind == 'set' else Greatest(F('prod_count') + value, 0))
+                               for product_id, (kind, value) in changes.items()],
+                             output_field=models.PositiveIntegerField())
+            rows = cls.objects.filter(user=user, product_id__in=changes)
+            rows.update(prod_count=new_count, price_mult_count=cls.line_price(new_count))
+            rows.filter(prod_count=0).delete()
+
+    @classmethod
+    def line_price(cls, count):
+        # count * цена товара строки на сегодня (со скидкой), для UPDATE
+        price = Subquery(Product.with_effective_price(Product.objects.filter(pk=OuterRef('product_id'))).
+                         values('effective_price')[:1])
+        return ExpressionWrapper(count * price, output_field=cls.price_mult_count.field)
+
+    @classmethod
+    def reprice(cls, product_ids):
+        # скидка началась, закончилась или изменилась: строки корзин с этими товарами одним UPDATE
+        return cls.objects.filter(product_id__in=product_ids).update(price_mult_count=cls.line_price(F('prod_count')))
+
 
 class Review(models.Model):
     author = models.CharField(max_length=250, blank=False)
@@ -100,14 +306,37 @@ class Review(models.Model):
     date = models.DateTimeField(auto_now_add=True)
     product = models.ForeignKey(Product, blank=False, null=False, on_delete=models.CASCADE, related_name='reviews')
 
+    class Meta:
+        indexes = [
+            # отзывы товара по страницам, новые первыми (ключ пагинации - date, id)
+            models.Index(fields=['product', '-date', '-id'], name='review_product_date_idx'),
+        ]
+
 
 class Sales(models.Model):
     salePrice = models.DecimalField(default=0, max_digits=10, decimal_places=2, validators=[MinValueValidator(0)])
-    dateFrom = models.DateField(auto_now_add=True)
-    dateTo = models.DateField(auto_now_add=True)
+    # скидка действует с dateFrom по dateTo включительно, dateTo = null - без срока.
+    # Закончившиеся удаляет manage.py expire_sales
+    dateFrom = models.DateField(default=timezone.localdate)
+    dateTo = models.DateField(null=True, blank=True)
     product = models.OneToOneField(Product, blank=False, null=False, on_delete=models.CASCADE, related_name='sale')
     # много полей вытаскиваем через product
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['dateFrom', 'dateTo'], name='sales_window_idx'),
+        ]
+
+    @classmethod
+    def active_condition(cls, today=None, prefix=''):
+        today = today or timezone.localdate()
+        return Q(**{f'{prefix}dateFrom__lte': today}) & \
+            (Q(**{f'{prefix}dateTo__gte': today}) | Q(**{f'{prefix}dateTo__isnull': True}))
+
+    @classmethod
+    def active(cls, today=None):
+        return cls.objects.filter(cls.active_condition(today))
+
 
 class Specification(models.Model):
     name = models.CharField(max_length=30)
@@ -130,6 +359,14 @@ class Order(models.Model):
     active = models.BooleanField(default=True)
     user = models.ForeignKey(User, on_delete=models.PROTECT, related_name='orders')
 
+    class Meta:
+        indexes = [
+            # история заказов пользователя по ключу (createdAt, orderId), новые первыми
+            models.Index(fields=['user', '-createdAt', '-orderId'], name='order_user_created_idx'),
+            # последний активный заказ: частичный индекс только по неоплаченным
+            models.Index(fields=['user', '-createdAt'], name='order_user_active_idx', condition=Q(active=True)),
+        ]
+
 
 class OrderProduct(models.Model):
     id = models.CharField(max_length=30, primary_key=True)
@@ -145,4 +382,19 @@ class OrderProduct(models.Model):
     tags = models.JSONField()
     reviews = models.PositiveIntegerField()
     rating = models.DecimalField(max_digits=3, decimal_places=2, validators=[MinValueValidator(0)])
-    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='products')
\ No newline at end of file
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='products')
+    # ссылка на товар для статистики продаж (ProductPopularity), в ответ API не попадает
+    product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True, blank=True, related_name='order_lines')
+
+class StockReservation(models.Model):
+    # остаток, списанный под неоплаченный заказ. Оплата удаляет резерв (списание остается), истекший резерв
+    # возвращает на склад manage.py release_reservations (api/stock.py)
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='reservations')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reservations')
+    count = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['expires_at'], name='reservation_expires_idx'),
+        ]
\ No newline at end of file
@@ -0,0 +1,123 @@
+import base64
+import binascii
+import datetime
+import json
+import operator
+from decimal import Decimal
+from functools import reduce
+
+from django.core.paginator import InvalidPage
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+
+
+def _cursor_default(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f'{type(value).__name__} is not cursor serializable')
+
+
+# Пагинация по ключу (seek): следующая страница выбирается условием по значениям сортировки
+# последней строки, а не OFFSET, и без COUNT(*). Сортировка берется из queryset, pk добавляется
+# последним полем, чтобы порядок был однозначным.
+class KeysetPaginationMixin:
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_keyset_ordering(self, queryset):
+        ordering = list(queryset.query.order_by or queryset.model._meta.ordering or ['-pk'])
+        result = []
+        for field in ordering:
+            desc = field.startswith('-')
+            result.append((field.lstrip('-'), desc))
+        if not any(field in ('pk', 'id', queryset.model._meta.pk.name) for field, _ in result):
+            result.append(('pk', result[0][1]))
+        return result
+
+    def encode_cursor(self, values, page, reverse):
+        data = json.dumps({'v': values, 'p': page, 'r': reverse}, default=_cursor_default, separators=(',', ':'))
+        return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            data = json.loads(base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4)))
+            return {'v': list(data['v']), 'p': int(data['p']), 'r': bool(data['r'])}
+        except (TypeError, ValueError, KeyError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_keyset_condition(self, ordering, values):
+        if len(values) != len(ordering):
+            raise NotFound(self.invalid_cursor_message)
+        clauses, equal = [], {}
+        for (field, desc), value in zip(ordering, values):
+            clauses.append(Q(**equal, **{f'{field}__{"lt" if desc else "gt"}': value}))
+            equal[field] = value
+        field, desc = ordering[0]
+        # избыточное условие по первому полю дает индексу диапазон для сканирования
+        return Q(**{f'{field}__{"lte" if desc else "gte"}': values[0]}) & reduce(operator.or_, clauses)
+
+    def get_keyset_queryset(self, queryset, request):
+        self.request = request
+        self.keyset_cursor = cursor = self.decode_cursor(request)
+        reverse = bool(cursor and cursor['r'])
+        ordering = [(field, desc != reverse) for field, desc in self.get_keyset_ordering(queryset)]
+        self.keyset_ordering = ordering
+
+        queryset = queryset.order_by(*[('-' if desc else '') + field for field, desc in ordering])
+        if cursor:
+            queryset = queryset.filter(self.get_keyset_condition(ordering, cursor['v']))
+        return queryset[:self.get_page_size(request) + 1]
+
+    def get_keyset_page(self, results):
+        cursor, ordering = self.keyset_cursor, self.keyset_ordering
+        reverse = bool(cursor and cursor['r'])
+        page_size = self.get_page_size(self.request)
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if reverse:
+            results.reverse()
+
+        def values(obj):
+            # модели или строки .values() (api/fast_serializers.py)
+            if isinstance(obj, dict):
+                return [obj[field] for field, _ in ordering]
+            return [getattr(obj, field) for field, _ in ordering]
+
+        self.current_page = cursor['p'] if cursor else 1
+        has_next = has_more if not reverse else True
+        has_previous = has_more if reverse else cursor is not None
+        self.next_cursor = self.previous_cursor = None
+        if results and has_next:
+            self.next_cursor = self.encode_cursor(values(results[-1]), self.current_page + 1, False)
+        if results and has_previous:
+            self.previous_cursor = self.encode_cursor(values(results[0]), self.current_page - 1, True)
+        return results
+
+    def paginate_keyset(self, queryset, request, view=None):
+        return self.get_keyset_page(list(self.get_keyset_queryset(queryset, request)))
+
+    async def apaginate_keyset(self, queryset, request, view=None):
+        return self.get_keyset_page([obj async for obj in self.get_keyset_queryset(queryset, request).aiterator()])
+
+    def is_keyset_request(self, request):
+        return self.cursor_query_param in request.query_params
+
+
+# PageNumberPagination для api/async_views.py: COUNT и выборка страницы через async ORM
+class AsyncPageNumberMixin:
+
+    async def apaginate_page(self, queryset, request):
+        self.request = request
+        paginator = self.django_paginator_class(queryset, self.get_page_size(request))
+        paginator.count = await queryset.acount()
+        page_number = self.get_page_number(request, paginator)
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(page_number=page_number, message=str(exc)))
+        return [obj async for obj in self.page.object_list.aiterator()]
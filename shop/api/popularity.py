@@ -0,0 +1,74 @@
+import heapq
+import math
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.functions import TruncDay
+from django.utils import timezone
+
+from api.cache import bump_version_on_commit
+from api.models import Product, OrderProduct, ProductPopularity
+
+# продажа N дней назад весит 0.5 ** (N / HALF_LIFE_DAYS)
+HALF_LIFE_DAYS = getattr(settings, 'API_POPULARITY_HALF_LIFE_DAYS', 14)
+# сколько товаров каждой категории хранится и отдается в /api/products/popular
+TOP_N = getattr(settings, 'API_POPULARITY_TOP_N', 20)
+WEIGHTS = getattr(settings, 'API_POPULARITY_WEIGHTS', {'reviews': 1.0, 'rating': 1.0, 'sales': 2.0})
+# продажи старше HORIZON периодов полураспада весят меньше 0.1% и не читаются
+HORIZON = 10
+# у товара с парой отзывов оценка сглаживается к средней по каталогу, как будто есть еще столько отзывов
+RATING_PRIOR_REVIEWS = 5
+
+
+def decayed_sales(now, half_life):
+    # продажи сгруппированы по товару и дню в БД, затухание считается по дню
+    rows = OrderProduct.objects.filter(product__isnull=False,
+                                       order__createdAt__gte=now - timedelta(days=half_life * HORIZON)).\
+        values('product', day=TruncDay('order__createdAt')).annotate(count=Sum('count')).\
+        values_list('product', 'day', 'count')
+    sales = defaultdict(float)
+    for product_id, day, count in rows.iterator(chunk_size=5000):
+        age = max((now - day).total_seconds() / 86400, 0)
+        sales[product_id] += count * 0.5 ** (age / half_life)
+    return sales
+
+
+def mean_rating():
+    totals = Product.objects.aggregate(rates=Sum('rating_sum'), reviews=Sum('review_count'))
+    return totals['rates'] / totals['reviews'] if totals['reviews'] else 0
+
+
+def popularity_score(review_count, rating, sales, prior, weights=WEIGHTS):
+    smoothed = (rating * review_count + prior * RATING_PRIOR_REVIEWS) / (review_count + RATING_PRIOR_REVIEWS)
+    return weights['reviews'] * math.log1p(review_count) + weights['rating'] * smoothed / 5 + \
+        weights['sales'] * math.log1p(sales)
+
+
+def compute_popularity(now=None, half_life=HALF_LIFE_DAYS, top_n=TOP_N, weights=WEIGHTS):
+    now = now or timezone.now()
+    sales = decayed_sales(now, half_life)
+    prior = mean_rating()
+
+    # в памяти только top_n лучших каждой категории; при равенстве выше товар с меньшим id
+    top = defaultdict(list)
+    products = Product.objects.values_list('id', 'category', 'review_count', 'rating')
+    for pk, category_id, review_count, rating in products.iterator(chunk_size=5000):
+        item = (popularity_score(review_count, float(rating), sales.get(pk, 0), prior, weights), -pk)
+        heap = top[category_id]
+        if len(heap) < top_n:
+            heapq.heappush(heap, item)
+        else:
+            heapq.heappushpop(heap, item)
+
+    rows = [ProductPopularity(product_id=-negative_pk, category_id=category_id, score=score, rank=rank,
+                              computed_at=now)
+            for category_id, heap in top.items()
+            for rank, (score, negative_pk) in enumerate(sorted(heap, reverse=True), 1)]
+    with transaction.atomic():
+        ProductPopularity.objects.all().delete()
+        ProductPopularity.objects.bulk_create(rows, batch_size=2000)
+        bump_version_on_commit('product_lists')
+    return len(rows)
@@ -0,0 +1,78 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Value, CharField
+from django.db.models.functions import Concat
+
+from api.metrics import registry
+from api.models import Product, ProductPopularity
+from api.serializers import ProductSerializer
+
+# Готовый ответ /api/products/<pk> по ключу (pk, Product.version). Версию в той же транзакции меняет любое изменение
+# товара, его отзывов, характеристик, картинок, тегов, скидки и остатка (api/signals.py, Product.touch), поэтому
+# сбрасывается только измененный товар, а прежние версии вытесняются по таймауту. updated_at в ключе - на случай
+# повторного pk после отката транзакции (SQLite).
+PRODUCT_CACHE_TIMEOUT = getattr(settings, 'API_PRODUCT_CACHE_TIMEOUT', 60 * 60)
+CACHE_NAME = 'product'
+
+
+def product_queryset():
+    return Product.objects.select_related('category').\
+        annotate(href=Concat(Value('/catalog/'), 'id', output_field=CharField()))
+
+
+def product_key(pk, version, updated_at):
+    return f'api:product:{pk}:{version}:{updated_at.timestamp()}'
+
+
+def build_product_data(pk):
+    return dict(ProductSerializer(product_queryset().get(pk=pk)).data)
+
+
+def count_lookup(hit):
+    registry.inc('api_cache_requests_total', cache=CACHE_NAME, result='hit' if hit else 'miss')
+
+
+def hit_ratio():
+    hits = registry.get_count('api_cache_requests_total', cache=CACHE_NAME, result='hit')
+    total = hits + registry.get_count('api_cache_requests_total', cache=CACHE_NAME, result='miss')
+    return hits / total if total else None
+
+
+def get_product_data(pk, version, updated_at, build=None):
+    key = product_key(pk, version, updated_at)
+    data = cache.get(key)
+    count_lookup(data is not None)
+    if data is None:
+        data = build() if build else build_product_data(pk)
+        cache.set(key, data, PRODUCT_CACHE_TIMEOUT)
+    return data
+
+
+async def aget_product_data(pk, version, updated_at, build):
+    # build - корутинная функция (api/async_views.py)
+    key = product_key(pk, version, updated_at)
+    data = await cache.aget(key)
+    count_lookup(data is not None)
+    if data is None:
+        data = await build()
+        await cache.aset(key, data, PRODUCT_CACHE_TIMEOUT)
+    return data
+
+
+def top_product_ids(limit):
+    # самые популярные (manage.py compute_popularity), если рейтинг не посчитан - по числу отзывов и оценке
+    ids = list(ProductPopularity.objects.order_by('-score', 'product').values_list('product', flat=True)[:limit])
+    if not ids:
+        ids = list(Product.objects.order_by('-review_count', '-rating').values_list('pk', flat=True)[:limit])
+    return ids
+
+
+def warm_products(product_ids):
+    warmed = 0
+    for pk, version, updated_at in Product.objects.filter(pk__in=product_ids).\
+            values_list('pk', 'version', 'updated_at'):
+        key = product_key(pk, version, updated_at)
+        if cache.get(key) is None:
+            cache.set(key, build_product_data(pk), PRODUCT_CACHE_TIMEOUT)
+            warmed += 1
+    return warmed
@@ -0,0 +1,44 @@
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from api.cache import bump_version_on_commit
+from api.cards import refresh_cards_on_commit
+from api.models import Baskets, Product, Sales
+
+
+def sales_changed(product_ids):
+    Product.touch(product_ids)
+    Baskets.reprice(product_ids)
+    refresh_cards_on_commit(product_ids)
+    bump_version_on_commit('product_lists')
+
+
+def expire_sales(today=None, batch_size=1000):
+    # закончившиеся скидки удаляются пачками. Сигналы post_delete Sales намеренно пропускаются (обычный
+    # DELETE вместо QuerySet.delete()): версии товаров, корзины, карточки и кэш списков обновляются один раз
+    # на пачку в sales_changed, а не запросами на каждую строку
+    today = today or timezone.localdate()
+    expired = 0
+    while True:
+        with transaction.atomic():
+            batch = list(Sales.objects.filter(dateTo__lt=today).order_by('dateTo', 'pk').
+                         select_for_update(skip_locked=True).values_list('pk', 'product')[:batch_size])
+            if not batch:
+                return expired
+            placeholders = ', '.join(['%s'] * len(batch))
+            with connection.cursor() as cursor:
+                cursor.execute(f'DELETE FROM {Sales._meta.db_table} WHERE id IN ({placeholders})',
+                               [pk for pk, _ in batch])
+            sales_changed([product_id for _, product_id in batch])
+        expired += len(batch)
+
+
+def start_sales(today=None, batch_size=1000):
+    # скидки, начавшиеся с прошлого запуска: карточка еще показывает обычную цену
+    product_ids = list(Sales.active(today).exclude(product__card__price=F('salePrice')).
+                       values_list('product', flat=True))
+    for start in range(0, len(product_ids), batch_size):
+        with transaction.atomic():
+            sales_changed(product_ids[start:start + batch_size])
+    return len(product_ids)
@@ -0,0 +1,169 @@
+import operator
+import re
+from functools import reduce
+
+from django.conf import settings
+from django.db import connection, models
+from django.db.models import Q, F, Func, FloatField, Lookup
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+# конфигурация должна совпадать с той, что использует триггер из миграции 0017
+SEARCH_CONFIG = 'simple'
+DEFAULT_BACKEND = 'api.search.DatabaseSearchBackend'
+
+
+def search_tokens(terms):
+    return [token.lower() for term in terms for token in re.findall(r'\w+', term)]
+
+
+class CorrelatedRank(Func):
+    # ранг из подзапроса по id товара; pk внешнего запроса подставляется компилятором,
+    # поэтому работает и для Product, и для ProductCard (pk = product_id), и внутри подзапросов
+    output_field = FloatField()
+
+    def __init__(self, sql, params):
+        super().__init__(F('pk'))
+        self.rank_sql, self.rank_params = sql, params
+
+    def as_sql(self, compiler, connection, **extra_context):
+        pk_sql, pk_params = compiler.compile(self.source_expressions[0])
+        return self.rank_sql.format(pk=pk_sql), (*self.rank_params, *pk_params)
+
+
+class Match(Lookup):
+    # FTS5: слева скрытая колонка с именем таблицы (ProductSearchIndex.document), справа запрос
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs_sql, lhs_params = self.process_lhs(compiler, connection)
+        rhs_sql, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs_sql} MATCH {rhs_sql}', (*lhs_params, *rhs_params)
+
+
+class SearchDocumentField(models.TextField):
+    pass
+
+
+SearchDocumentField.register_lookup(Match)
+
+
+class BaseSearchBackend:
+
+    def search(self, queryset, terms):
+        raise NotImplementedError
+
+    def update_index(self, product):
+        pass
+
+    def update_index_many(self, product_ids):
+        # после массовой загрузки без сигналов (api/catalog_io.py)
+        pass
+
+    def remove_from_index(self, product_id):
+        pass
+
+    def rebuild_index(self):
+        pass
+
+
+class IcontainsSearchBackend(BaseSearchBackend):
+    fields = ['title']
+
+    def search(self, queryset, terms):
+        for term in terms:
+            queryset = queryset.filter(reduce(operator.or_, [Q(**{f'{field}__icontains': term})
+                                                             for field in self.fields]))
+        return queryset
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    # колонку search_vector поддерживает триггер api_product_search_vector_trigger
+
+    def search(self, queryset, terms):
+        tokens = search_tokens(terms)
+        if not tokens:
+            return queryset.none()
+        query = ' & '.join(f'{token}:*' for token in tokens)
+        return queryset.filter(
+            pk__in=RawSQL('SELECT id FROM api_product WHERE search_vector @@ to_tsquery(%s, %s)',
+                          (SEARCH_CONFIG, query))
+        ).annotate(search_rank=CorrelatedRank('(SELECT ts_rank_cd(ranked.search_vector, to_tsquery(%s, %s)) '
+                                              'FROM api_product ranked WHERE ranked.id = {pk})',
+                                              (SEARCH_CONFIG, query)))
+
+    def rebuild_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute('UPDATE api_product SET title = title')
+
+
+class SQLiteSearchBackend(BaseSearchBackend):
+    # индекс api_product_fts синхронизируется сигналами, см. api/signals.py
+
+    def search(self, queryset, terms):
+        tokens = search_tokens(terms)
+        if not tokens:
+            return queryset.none()
+        from api.models import Product
+        query = ' AND '.join(f'"{token}"*' for token in tokens)
+        # один INNER JOIN с api_product_fts: MATCH выполняется один раз, bm25 берется из той же строки индекса.
+        # Ранг через подзапрос на каждую строку повторял бы MATCH для каждого найденного товара
+        document = 'search_index__document' if queryset.model is Product else 'product__search_index__document'
+        return queryset.filter(**{f'{document}__match': query}).annotate(
+            search_rank=-Func(F(document), 10.0, 5.0, 1.0, function='bm25', output_field=FloatField()))
+
+    def update_index(self, product):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM api_product_fts WHERE rowid = %s', [product.pk])
+            cursor.execute('INSERT INTO api_product_fts (rowid, title, description, fullDescription) '
+                           'VALUES (%s, %s, %s, %s)',
+                           [product.pk, product.title, product.description, product.fullDescription])
+
+    def update_index_many(self, product_ids):
+        product_ids = list(product_ids)
+        placeholders = ', '.join(['%s'] * len(product_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM api_product_fts WHERE rowid IN ({placeholders})', product_ids)
+            cursor.execute('INSERT INTO api_product_fts (rowid, title, description, fullDescription) '
+                           f'SELECT id, title, description, fullDescription FROM api_product WHERE id IN ({placeholders})',
+                           product_ids)
+
+    def remove_from_index(self, product_id):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM api_product_fts WHERE rowid = %s', [product_id])
+
+    def rebuild_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM api_product_fts')
+            cursor.execute('INSERT INTO api_product_fts (rowid, title, description, fullDescription) '
+                           'SELECT id, title, description, fullDescription FROM api_product')
+
+
+class DatabaseSearchBackend(BaseSearchBackend):
+    backends = {
+        'postgresql': PostgresSearchBackend,
+        'sqlite': SQLiteSearchBackend,
+    }
+
+    def __init__(self):
+        self.backend = self.backends.get(connection.vendor, IcontainsSearchBackend)()
+
+    def search(self, queryset, terms):
+        return self.backend.search(queryset, terms)
+
+    def update_index(self, product):
+        self.backend.update_index(product)
+
+    def update_index_many(self, product_ids):
+        self.backend.update_index_many(product_ids)
+
+    def remove_from_index(self, product_id):
+        self.backend.remove_from_index(product_id)
+
+    def rebuild_index(self):
+        self.backend.rebuild_index()
+
+
+def get_search_backend(path=None):
+    path = path or settings.REST_FRAMEWORK.get('PRODUCT_SEARCH_BACKEND', DEFAULT_BACKEND)
+    return import_string(path)()
@@ -1,10 +1,12 @@
+import uuid
+
 from rest_framework import serializers
 from api.models import Profile, Category, Tag, Payment, Product, Image, Review, Specification, Baskets, Sales, \
     OrderProduct, Order
-from django.db.models import Value,  CharField
-from django.db.models.functions import Concat
+from django.db import transaction
 from django.contrib.auth.password_validation import validate_password
-from django.core.validators import MinValueValidator
+from django.core.validators import MinValueValidator, MinLengthValidator
+from django.utils import timezone
 
 
 class ProfileSerializer(serializers.ModelSerializer):
@@ -50,16 +52,8 @@ class ForSubCategorySerializer(serializers.ModelSerializer):
         fields = ('id', 'title', 'image', 'href')
 
 
-class SubCategoriesSerializer(serializers.ModelSerializer):
-    def to_representation(self, value):
-        value = Category.objects.filter(pk=value.pk).\
-            annotate(href=Concat(Value('/catalog/'), 'id', output_field=CharField())).get()
-        serializer = ForSubCategorySerializer(value, context=self.context)
-        return serializer.data
-
-
 class CategorySerializer(serializers.ModelSerializer):
-    subcategories = SubCategoriesSerializer(many=True)
+    subcategories = ForSubCategorySerializer(many=True)
     href = serializers.CharField()
 
     class Meta:
@@ -103,8 +97,8 @@ class ProductsSerializer(serializers.ModelSerializer):
     href = serializers.CharField()
     id = serializers.CharField()
     category = serializers.StringRelatedField()
-    rating = serializers.FloatField()
-    reviews = serializers.IntegerField(source='reviews.count', read_only=True)
+    rating = serializers.DecimalField(max_digits=2, decimal_places=1, read_only=True)
+    reviews = serializers.IntegerField(source='review_count', read_only=True)
     date = serializers.DateTimeField(format="%a %b %d %m %Y %H:%M:%S GMT%z")
 
     class Meta:
@@ -113,6 +107,13 @@ class ProductsSerializer(serializers.ModelSerializer):
                   'tags', 'reviews', 'rating']
 
 
+class ProductCardSerializer(serializers.BaseSerializer):
+    # карточка уже отрендерена ProductsSerializer при обновлении ProductCard
+
+    def to_representation(self, instance):
+        return instance.data
+
+
 class ReviewSerializer(serializers.ModelSerializer):
     class Meta:
         model = Review
@@ -120,7 +121,10 @@ class ReviewSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         validated_data['product_id'] = self.context['view'].kwargs['pk']
-        return Review.objects.create(**validated_data)
+        with transaction.atomic():
+            review = Review.objects.create(**validated_data)
+            Product.add_review_rate(review.product_id, review.rate)
+        return review
 
 
 class SpecificationSerializer(serializers.ModelSerializer):
@@ -134,14 +138,19 @@ class ProductSerializer(serializers.ModelSerializer):
     href = serializers.CharField()
     id = serializers.CharField()
     category = serializers.StringRelatedField()
-    rating = serializers.FloatField()
-    reviews = ReviewSerializer(many=True, read_only=True)
+    rating = serializers.DecimalField(max_digits=2, decimal_places=1, read_only=True)
+    # только последние отзывы, все - /api/products/<pk>/reviews
+    reviews = ReviewSerializer(source='latest_reviews', many=True, read_only=True)
+    reviewsCount = serializers.IntegerField(source='review_count', read_only=True)
+    ratingHistogram = serializers.DictField(source='rating_histogram', child=serializers.IntegerField(),
+                                            read_only=True)
     specifications = SpecificationSerializer(many=True, read_only=True)
 
     class Meta:
         model = Product
         fields = ['id', 'category', 'price', 'count', 'date', 'title', 'description', 'fullDescription', 'href',
-                  'freeDelivery', 'images', 'tags', 'reviews', 'specifications', 'rating']
+                  'freeDelivery', 'images', 'tags', 'reviews', 'specifications', 'rating', 'reviewsCount',
+                  'ratingHistogram']
 
 
 class BasketProductsSerializer(serializers.ModelSerializer):
@@ -171,6 +180,17 @@ class BasketChangesSerializer(serializers.Serializer):
     count = serializers.IntegerField(validators=[MinValueValidator(1)])
 
 
+class BasketOperationSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    count = serializers.IntegerField(validators=[MinValueValidator(0)])
+    op = serializers.ChoiceField(choices=['add', 'remove', 'set'], default='add')
+
+    def validate(self, attrs):
+        if attrs['op'] != 'set' and attrs['count'] < 1:
+            raise serializers.ValidationError({'count': 'Ensure this value is greater than or equal to 1.'})
+        return attrs
+
+
 class JustBasketSerializer(serializers.ModelSerializer):
     class Meta:
         model = Baskets
@@ -193,7 +213,18 @@ class OrderProductSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = OrderProduct
-        exclude = ['order']
+        exclude = ['order', 'product']
+
+
+def reserve_stock(order, lines):
+    # api.stock импортирует api.cards, а тот - этот модуль
+    from api.stock import reserve, OutOfStock
+
+    try:
+        reserve(order, lines)
+    except OutOfStock as exc:
+        raise serializers.ValidationError({'products': [f'Not enough stock for product {product_id}'
+                                                        for product_id in exc.product_ids]})
 
 
 class OrderSerializer(serializers.ModelSerializer):
@@ -209,8 +240,71 @@ class OrderSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         user = self.context['request'].user
         products = validated_data.pop('products')
-        order = Order.objects.create(user=user, **validated_data)
-        for product in products:
-            OrderProduct.objects.create(order=order,  **product)
+        # id строки от клиента - id товара из корзины (BasketProductsSerializer)
+        existing = {str(pk) for pk in Product.objects.filter(
+            pk__in=[product['id'] for product in products if product['id'].isdigit()]).values_list('id', flat=True)}
+        with transaction.atomic():
+            order = Order.objects.create(user=user, **validated_data)
+            OrderProduct.objects.bulk_create([
+                OrderProduct(order=order, product_id=product['id'] if product['id'] in existing else None, **product)
+                for product in products
+            ])
+            reserve_stock(order, [(product['id'], product['count']) for product in products
+                                  if product['id'] in existing])
+
+        return order
+
+
+class OrderSummarySerializer(serializers.ModelSerializer):
+    # строка истории заказов: без снимка товаров (OrderProduct)
+    createdAt = serializers.DateTimeField(format="%Y-%m-%d %H:%M")
+
+    class Meta:
+        model = Order
+        fields = ["orderId", "createdAt", "deliveryType", "paymentType", "totalCost", "status", "city", "address"]
+
+
+class OrderFromBasketSerializer(serializers.ModelSerializer):
+    # заказ из корзины пользователя: состав и цены берутся на сервере, клиент передает только данные доставки
+    fullName = serializers.CharField(required=False)
+    email = serializers.EmailField(required=False)
+    phone = serializers.CharField(required=False, allow_blank=True, validators=[MinLengthValidator(11)])
+    deliveryType = serializers.CharField(required=False, allow_blank=True, default='')
+    paymentType = serializers.CharField(required=False, allow_blank=True, default='')
+    status = serializers.CharField(required=False, default='accepted')
+    city = serializers.CharField(required=False, allow_blank=True, default='')
+    address = serializers.CharField(required=False, allow_blank=True, default='')
+
+    class Meta:
+        model = Order
+        fields = ["fullName", "email", "phone", "deliveryType", "paymentType", "status", "city", "address"]
+
+    def get_order_id(self):
+        return str(uuid.uuid4().int % 10 ** 18)
+
+    def create(self, validated_data):
+        user = self.context['request'].user
+        profile = Profile.objects.filter(user=user).first()
+        validated_data.setdefault('fullName', profile.fullName if profile else user.get_full_name())
+        validated_data.setdefault('email', user.email)
+        validated_data.setdefault('phone', profile.phone if profile else '')
+
+        with transaction.atomic():
+            lines = list(Baskets.for_user(user).select_for_update(of=('self',)))
+            if not lines:
+                raise serializers.ValidationError({'products': ['Basket is empty']})
+            # цены на момент заказа, со скидками, действующими сегодня
+            prices = Product.effective_prices([line.product_id for line in lines])
+            for line in lines:
+                line.price_mult_count = prices[line.product_id] * line.prod_count
+            order = Order.objects.create(orderId=self.get_order_id(), createdAt=timezone.now(), user=user,
+                                         totalCost=sum(line.price_mult_count for line in lines), **validated_data)
+            snapshot = BasketProductsSerializer(lines, many=True).data
+            OrderProduct.objects.bulk_create([
+                OrderProduct(order=order, product_id=line.product_id, **dict(product, id=f'{order.orderId}-{number}'))
+                for number, (line, product) in enumerate(zip(lines, snapshot), 1)
+            ])
+            reserve_stock(order, [(line.product_id, line.prod_count) for line in lines])
+            Baskets.objects.filter(pk__in=[line.pk for line in lines]).delete()
 
         return order
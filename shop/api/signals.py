@@ -0,0 +1,143 @@
+from django.db.models.signals import pre_save, post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+
+from api.cache import bump_version_on_commit
+from api.cards import refresh_cards_on_commit, product_content_type
+from api.category_tree import add_category, check_move, move_category
+from api.models import Baskets, Category, Product, Review, Sales, Image, Tag, Specification, Order
+from api.search import get_search_backend
+from api.stock import release_order
+
+
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_category_tree(sender, **kwargs):
+    bump_version_on_commit('categories')
+
+
+@receiver([post_save, post_delete], sender=Tag)
+def invalidate_tags(sender, **kwargs):
+    bump_version_on_commit('tags')
+
+
+@receiver(pre_save, sender=Category)
+def remember_category_parent(sender, instance, **kwargs):
+    # прежний родитель нужен post_save, чтобы понять, переносится ли поддерево
+    saved = [] if instance.pk is None else \
+        list(Category.objects.filter(pk=instance.pk).values_list('maincategories', flat=True))
+    if saved and saved[0] != instance.maincategories_id:
+        check_move(instance.pk, instance.maincategories_id)
+    instance._saved_parent = saved
+
+
+@receiver(post_save, sender=Category)
+def update_category_tree(sender, instance, created, **kwargs):
+    saved = getattr(instance, '_saved_parent', [])
+    if created:
+        add_category(instance)
+    elif saved and saved[0] != instance.maincategories_id:
+        move_category(instance.pk, instance.maincategories_id)
+        bump_version_on_commit('product_lists')
+
+
+@receiver(pre_delete, sender=Category)
+def detach_subcategories(sender, instance, **kwargs):
+    # у подкатегорий maincategories обнулится через SET_NULL без сигналов, их поддеревья становятся корнями
+    for child_id in instance.subcategories.values_list('pk', flat=True):
+        move_category(child_id, None)
+    bump_version_on_commit('product_lists')
+
+
+@receiver(post_save, sender=Product)
+def update_search_index(sender, instance, **kwargs):
+    get_search_backend().update_index(instance)
+
+
+@receiver(post_delete, sender=Product)
+def remove_from_search_index(sender, instance, **kwargs):
+    get_search_backend().remove_from_index(instance.pk)
+
+
+def product_changed(product_ids, card=True):
+    # версия (ETag) меняется в той же транзакции, карточка пересобирается после коммита
+    product_ids = list(product_ids)
+    if product_ids:
+        Product.touch(product_ids)
+        if card:
+            refresh_cards_on_commit(product_ids)
+
+
+@receiver(post_save, sender=Product)
+def refresh_product(sender, instance, created, raw, **kwargs):
+    if created or raw:
+        refresh_cards_on_commit([instance.pk])
+    else:
+        product_changed([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=Review)
+@receiver([post_save, post_delete], sender=Sales)
+def refresh_related_product(sender, instance, **kwargs):
+    product_changed([instance.product_id])
+
+
+@receiver([post_save, post_delete], sender=Sales)
+def reprice_baskets(sender, instance, **kwargs):
+    Baskets.reprice([instance.product_id])
+
+
+@receiver([post_save, post_delete], sender=Image)
+def refresh_image_product(sender, instance, **kwargs):
+    if instance.content_type_id == product_content_type().pk:
+        product_changed([instance.object_id])
+
+
+@receiver(m2m_changed, sender=Product.tags.through)
+def refresh_tagged_products(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action.startswith('post_'):
+            product_changed([instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        product_changed(pk_set)
+    elif action == 'pre_clear':
+        product_changed(instance.products.values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=Tag)
+def refresh_tag_products(sender, instance, **kwargs):
+    product_changed(instance.products.values_list('pk', flat=True))
+
+
+# характеристик нет в карточке списка, меняется только версия для карточки товара
+@receiver(post_save, sender=Specification)
+@receiver(pre_delete, sender=Specification)
+def touch_specification_products(sender, instance, **kwargs):
+    if instance.pk:
+        product_changed(instance.product.values_list('pk', flat=True), card=False)
+
+
+@receiver(m2m_changed, sender=Specification.product.through)
+def touch_specified_products(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse:
+        if action.startswith('post_'):
+            product_changed([instance.pk], card=False)
+    elif action in ('post_add', 'post_remove'):
+        product_changed(pk_set, card=False)
+    elif action == 'pre_clear':
+        product_changed(instance.product.values_list('pk', flat=True), card=False)
+
+
+# после обновления карточек, иначе параллельный запрос закэширует старые карточки под новой версией
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=Review)
+@receiver([post_save, post_delete], sender=Sales)
+@receiver([post_save, post_delete], sender=Image)
+@receiver(m2m_changed, sender=Product.tags.through)
+@receiver(pre_delete, sender=Tag)
+def invalidate_product_lists(sender, **kwargs):
+    bump_version_on_commit('product_lists')
+
+
+@receiver(pre_delete, sender=Order)
+def release_order_stock(sender, instance, **kwargs):
+    # резерв удалится каскадом, товар возвращается на склад
+    release_order(instance)
@@ -0,0 +1,103 @@
+import operator
+from collections import Counter
+from datetime import timedelta
+from functools import reduce
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q, Case, When
+from django.utils import timezone
+
+from api.cache import bump_version_on_commit
+from api.cards import refresh_cards_on_commit
+from api.models import Product, Order, StockReservation
+
+# сколько минут неоплаченный заказ держит товар
+RESERVATION_MINUTES = getattr(settings, 'API_STOCK_RESERVATION_MINUTES', 15)
+EXPIRED_STATUS = 'expired'
+
+
+class OutOfStock(Exception):
+
+    def __init__(self, product_ids):
+        super().__init__(f'Not enough stock for products {product_ids}')
+        self.product_ids = product_ids
+
+
+def change_stock(counts, sign):
+    # counts - {product_id: n}, все строки одним UPDATE. Списание условное (WHERE count >= n), поэтому
+    # параллельные заказы не уводят остаток в минус и не держат блокировку дольше одного запроса.
+    # Версия товара (ETag) меняется тем же запросом
+    rows = Product.objects.filter(pk__in=counts)
+    if sign < 0:
+        rows = rows.filter(reduce(operator.or_, [Q(pk=pk, count__gte=count) for pk, count in counts.items()]))
+    return rows.update(count=Case(*[When(pk=pk, then=F('count') + sign * count) for pk, count in counts.items()]),
+                       version=F('version') + 1, updated_at=timezone.now())
+
+
+def stock_changed(product_ids, lists=False):
+    # карточки пересобираются после коммита; кэш списков сбрасывается, только если поменялось наличие,
+    # иначе каждый заказ горячего товара обнулял бы кэш каталога
+    refresh_cards_on_commit(product_ids)
+    if lists or Product.objects.filter(pk__in=product_ids, count=0).exists():
+        bump_version_on_commit('product_lists')
+
+
+def reserve(order, lines, now=None):
+    # lines - пары (product_id, count), строки одного товара складываются
+    counts = Counter()
+    for product_id, count in lines:
+        counts[int(product_id)] += count
+    counts = {pk: count for pk, count in counts.items() if count > 0}
+    if not counts:
+        return []
+    expires_at = (now or timezone.now()) + timedelta(minutes=RESERVATION_MINUTES)
+    try:
+        with transaction.atomic():
+            if change_stock(counts, -1) < len(counts):
+                raise OutOfStock([])
+            reservations = StockReservation.objects.bulk_create([
+                StockReservation(order=order, product_id=pk, count=count, expires_at=expires_at)
+                for pk, count in counts.items()])
+    except OutOfStock:
+        available = dict(Product.objects.filter(pk__in=counts).values_list('pk', 'count'))
+        raise OutOfStock(sorted(pk for pk, count in counts.items() if available.get(pk, 0) < count))
+    stock_changed(counts)
+    return reservations
+
+
+def release(reservations):
+    # вернуть на склад; reservations - список (pk, product_id, count)
+    counts = Counter()
+    for _, product_id, count in reservations:
+        counts[product_id] += count
+    StockReservation.objects.filter(pk__in=[pk for pk, _, _ in reservations]).delete()
+    change_stock(counts, 1)
+    stock_changed(counts, lists=True)
+
+
+def release_order(order):
+    with transaction.atomic():
+        release(list(order.reservations.select_for_update().values_list('pk', 'product', 'count')))
+
+
+def confirm_order(order):
+    # оплачено: резерв больше не истекает, остаток уже списан
+    return order.reservations.all().delete()[0]
+
+
+def release_expired(now=None, batch_size=1000):
+    # reaper: пачками по batch_size, параллельные запуски на PostgreSQL/MySQL берут разные строки (SKIP LOCKED)
+    now = now or timezone.now()
+    released = 0
+    while True:
+        with transaction.atomic():
+            batch = list(StockReservation.objects.filter(expires_at__lte=now).order_by('expires_at', 'pk').
+                         select_for_update(skip_locked=True).values_list('pk', 'order', 'product', 'count')
+                         [:batch_size])
+            if not batch:
+                return released
+            release([(pk, product_id, count) for pk, _, product_id, count in batch])
+            Order.objects.filter(pk__in={order_id for _, order_id, _, _ in batch}, reservations__isnull=True).\
+                update(status=EXPIRED_STATUS, active=False)
+        released += len(batch)
@@ -1,7 +1,1405 @@
+import json
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, connections, transaction, OperationalError
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from api import urls
+from api.cache import bump_version, get_or_build, get_version
+from api.cards import CARD_FIELDS, fast_cards, model_cards, rebuild_cards
+from api.category_tree import rebuild_category_tree
+from api.db_routing import STICKY_COOKIE
+from api.fast_serializers import FastSalesSerializer, FastOrderSerializer
+from api.models import Profile, Category, CategoryClosure, Tag, Product, Image, Baskets, Specification, Order, \
+    OrderProduct, ProductCard, ProductPopularity, StockReservation, Sales, Review, LATEST_REVIEWS
+from api.local_cache import LocalCache, local_cache
+from api.management.commands.bench_api import Command as BenchApiCommand
+from api.metrics import registry
+from api.popularity import compute_popularity
+from api.product_cache import build_product_data, hit_ratio
+from api.sales import expire_sales, start_sales
+from api.search import IcontainsSearchBackend, SQLiteSearchBackend
+from api.serializers import SalesSerializer
+from api.stock import OutOfStock, reserve, release_expired
+from api.views import SalesViewSet
+
+
+class BasketQueryCountTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer', password='password')
+        category = Category.objects.create(title='video card', image={'src': '/3.svg', 'alt': 'string'})
+        tags = [Tag.objects.create(id='gaming', name='Gaming'), Tag.objects.create(id='work', name='For work')]
+        cls.products = []
+        for i in range(30):
+            product = Product.objects.create(category=category, price=100 + i, count=10, date=timezone.now(),
+                                             title=f'GF {i}', description='video card')
+            product.tags.set(tags)
+            Image.objects.create(image=f'imgs/products/{i}.jpg', content_object=product)
+            Image.objects.create(image=f'imgs/products/{i}_back.jpg', content_object=product)
+            cls.products.append(product)
+
+    def setUp(self):
+        ContentType.objects.get_for_model(Product)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def fill_basket(self, size):
+        Baskets.objects.filter(user=self.user).delete()
+        Baskets.objects.bulk_create([Baskets(user=self.user, product=product, prod_count=2,
+                                             price_mult_count=product.price * 2)
+                                     for product in self.products[:size]])
+
+    def get_basket(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/basket')
+        self.assertEqual(response.status_code, 200)
+        # SAVEPOINT от ATOMIC_REQUESTS не считаем
+        return response, len([query for query in queries if query['sql'].startswith('SELECT')])
+
+    def test_query_count_does_not_depend_on_basket_size(self):
+        self.fill_basket(1)
+        _, small = self.get_basket()
+        self.fill_basket(30)
+        response, large = self.get_basket()
+
+        self.assertEqual(len(response.data), 30)
+        self.assertEqual(small, large)
+
+    def test_basket_renders_in_three_queries(self):
+        self.fill_basket(30)
+        response, count = self.get_basket()
+
+        self.assertEqual(count, 3)
+        line = response.data[0]
+        self.assertEqual(line['count'], 2)
+        self.assertEqual(len(line['images']), 2)
+        self.assertEqual(line['tags'], ['gaming', 'work'])
+
+
+class BasketBatchTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer', password='password')
+        category = Category.objects.create(title='video card', image={'src': '/3.svg', 'alt': 'string'})
+        cls.products = [Product.objects.create(category=category, price=100 * (i + 1), count=10, date=timezone.now(),
+                                               title=f'GF {i}') for i in range(3)]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def batch(self, operations):
+        return self.client.post('/api/basket/batch', operations, format='json')
+
+    def basket(self):
+        return {product: (count, float(price)) for product, count, price in
+                Baskets.objects.filter(user=self.user).values_list('product', 'prod_count', 'price_mult_count')}
+
+    def test_add_set_remove_in_one_request(self):
+        first, second, third = self.products
+        Baskets.objects.create(user=self.user, product=second, prod_count=4, price_mult_count=800)
+        response = self.batch([{'id': first.pk, 'count': 2}, {'id': first.pk, 'count': 1, 'op': 'remove'},
+                               {'id': second.pk, 'count': 1, 'op': 'add'}, {'id': second.pk, 'count': 3, 'op': 'set'},
+                               {'id': third.pk, 'count': 5, 'op': 'set'}, {'id': third.pk, 'count': 2, 'op': 'remove'}])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(line['id'], line['count']) for line in response.data],
+                         [(str(second.pk), 3), (str(first.pk), 1), (str(third.pk), 3)])
+        self.assertEqual(self.basket(), {first.pk: (1, 100), second.pk: (3, 600), third.pk: (3, 900)})
+
+    def test_add_to_existing_line(self):
+        # строка уже есть: bulk_create с ignore_conflicts не дублирует ее, количество прибавляется
+        Baskets.objects.create(user=self.user, product=self.products[0], prod_count=2, price_mult_count=200)
+        self.assertEqual(self.batch([{'id': self.products[0].pk, 'count': 3}]).status_code, 200)
+        self.assertEqual(self.basket(), {self.products[0].pk: (5, 500)})
+
+    def test_lines_reaching_zero_are_deleted(self):
+        Baskets.objects.create(user=self.user, product=self.products[0], prod_count=2, price_mult_count=200)
+        Baskets.objects.create(user=self.user, product=self.products[1], prod_count=2, price_mult_count=400)
+        response = self.batch([{'id': self.products[0].pk, 'count': 5, 'op': 'remove'},
+                               {'id': self.products[1].pk, 'count': 0, 'op': 'set'},
+                               {'id': self.products[2].pk, 'count': 0, 'op': 'set'}])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, [])
+        self.assertEqual(self.basket(), {})
+
+    def test_invalid_products_change_nothing(self):
+        Baskets.objects.create(user=self.user, product=self.products[0], prod_count=2, price_mult_count=200)
+        response = self.batch([{'id': self.products[0].pk, 'count': 1}, {'id': self.products[1].pk, 'count': 1},
+                               {'id': 999, 'count': 1}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {'id': ['Product 999 does not exist']})
+
+        response = self.batch([{'id': self.products[1].pk, 'count': 1}, {'id': self.products[0].pk, 'count': 0}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.basket(), {self.products[0].pk: (2, 200)})
+
+
+class ProductCountersTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='video card', image={'src': '/3.svg', 'alt': 'string'})
+        cls.product = Product.objects.create(category=category, price=100, count=10, date=timezone.now(),
+                                             title='GF 210')
+
+    def post_review(self, rate):
+        response = APIClient().post(f'/api/product/{self.product.pk}/review',
+                                    {'author': 'author', 'email': 'a@example.com', 'text': 'text', 'rate': rate})
+        self.assertEqual(response.status_code, 201)
+
+    def test_review_updates_rating(self):
+        self.post_review(5)
+        self.post_review(2)
+        product = Product.objects.get(pk=self.product.pk)
+        self.assertEqual((product.review_count, product.rating_sum, product.rating), (2, 7, Decimal('3.50')))
+        self.assertEqual(product.rating_histogram(), {'1': 0, '2': 1, '3': 0, '4': 0, '5': 1})
+
+    def test_stale_save_keeps_counters(self):
+        # два экземпляра прочитаны до отзыва, затем оба сохраняются целиком
+        first, second = Product.objects.get(pk=self.product.pk), Product.objects.get(pk=self.product.pk)
+        self.post_review(4)
+        first.title = 'GF 220'
+        first.save()
+        second.price = 150
+        second.save()
+
+        product = Product.objects.get(pk=self.product.pk)
+        self.assertEqual((product.title, product.price), ('GF 210', 150))
+        self.assertEqual((product.review_count, product.rating_sum, product.rating, product.rate_4),
+                         (1, 4, Decimal('4.00'), 1))
+
+    def test_counters_saved_when_listed(self):
+        product = Product.objects.get(pk=self.product.pk)
+        product.review_count = 50
+        product.title = 'GF 220'
+        product.save(update_fields=['review_count'])
+        product = Product.objects.get(pk=self.product.pk)
+        self.assertEqual((product.review_count, product.title), (50, 'GF 210'))
+
+    def test_save_keeps_edited_count(self):
+        # остаток правят вручную обычным save()
+        product = Product.objects.get(pk=self.product.pk)
+        product.count = 99
+        product.save()
+        self.assertEqual(Product.objects.get(pk=self.product.pk).count, 99)
+
+
+class SearchTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(title='video card', image={'src': '/3.svg', 'alt': 'string'})
+        cls.in_description = Product.objects.create(category=cls.category, price=100, count=1, date=timezone.now(),
+                                                    title='GF 210', description='nebula edition')
+        cls.in_title = Product.objects.create(category=cls.category, price=200, count=1, date=timezone.now(),
+                                              title='Nebula GF 220', description='video card')
+        Product.objects.create(category=cls.category, price=300, count=1, date=timezone.now(),
+                               title='GF 230', description='video card')
+        rebuild_cards()
+
+    def search(self, terms, backend=SQLiteSearchBackend):
+        queryset = backend().search(Product.objects.all(), terms)
+        if 'search_rank' in queryset.query.annotations:
+            queryset = queryset.order_by('-search_rank')
+        return list(queryset.values_list('pk', flat=True))
+
+    def test_index_follows_save_and_delete(self):
+        product = Product.objects.create(category=self.category, price=100, count=1, date=timezone.now(),
+                                         title='Quasar 3000')
+        self.assertEqual(self.search(['quas']), [product.pk])
+
+        product.title = 'Pulsar 3000'
+        product.save()
+        self.assertEqual(self.search(['quasar']), [])
+        self.assertEqual(self.search(['pulsar', '3000']), [product.pk])
+
+        product.delete()
+        self.assertEqual(self.search(['pulsar']), [])
+
+    def test_title_match_ranks_first(self):
+        self.assertEqual(self.search(['nebula']), [self.in_title.pk, self.in_description.pk])
+        self.assertEqual(sorted(self.search(['nebula'], IcontainsSearchBackend)), [self.in_title.pk])
+
+    def test_catalog_search_with_facets(self):
+        response = APIClient().get('/api/catalog?filter=nebula')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item[0]['id'] for item in response.data['items']],
+                         [str(self.in_title.pk), str(self.in_description.pk)])
+        self.assertEqual(response.data['facets']['total'], 2)
+        self.assertEqual(response.data['facets']['price'], {'min': 100.0, 'max': 200.0})
+
+
+class ResponseCacheTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        local_cache.clear()
+
+    def test_stale_value_while_rebuilding(self):
+        self.assertEqual(get_or_build('demo', 'demo', lambda: 'v1'), 'v1')
+        bump_version('demo')
+        # новую версию уже пересчитывает другой запрос
+        cache.add(f'api:demo:{get_version("demo")}:lock', 1)
+        build = mock.Mock(return_value='v2')
+        self.assertEqual(get_or_build('demo', 'demo', build), 'v1')
+        build.assert_not_called()
+
+    def test_single_build_under_contention(self):
+        calls, results = [], []
+        barrier = threading.Barrier(8)
+
+        def build():
+            calls.append(1)
+            time.sleep(0.2)
+            return 'v1'
+
+        def request():
+            barrier.wait()
+            results.append(get_or_build('demo', 'demo', build))
+
+        threads = [threading.Thread(target=request) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # прошлой версии нет: остальные запросы ждут результат, а не считают сами
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['v1'] * 8)
+
+
+class CachedListTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='video card', image={'src': '/3.svg', 'alt': 'string'})
+        cls.products = [Product.objects.create(category=category, price=100, count=10, date=timezone.now(),
+                                               title=f'GF {i}', limited=True) for i in range(2)]
+        rebuild_cards()
+
+    def setUp(self):
+        cache.clear()
+        local_cache.clear()
+        self.client = APIClient()
+
+    def titles(self):
+        return sorted(item['title'] for item in self.client.get('/api/products/limited').data)
+
+    def test_second_request_served_from_cache(self):
+        first = self.client.get('/api/products/limited')
+        self.assertEqual(first.status_code, 200)
+        with self.assertNumQueries(0):
+            second = self.client.get('/api/products/limited')
+        self.assertEqual(second.data, first.data)
+
+    def test_product_change_invalidates_after_commit(self):
+        self.assertEqual(self.titles(), ['GF 0', 'GF 1'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products[0].title = 'GF new'
+            self.products[0].save()
+            # версия product_lists меняется только после коммита
+            self.assertEqual(self.titles(), ['GF 0', 'GF 1'])
+        self.assertEqual(self.titles(), ['GF 1', 'GF new'])
+
+    def categories(self):
+        return [(category['title'], [sub['title'] for sub in category['subcategories']])
+                for category in self.client.get('/api/categories').data]
+
+    def test_categories_served_from_cache(self):
+        first = self.client.get('/api/categories')
+        self.assertEqual(first.status_code, 200)
+        with self.assertNumQueries(0):
+            second = self.client.get('/api/categories')
+        self.assertEqual(second.data, first.data)
+
+    def test_category_change_invalidates_after_commit(self):
+        self.assertEqual(self.categories(), [('video card', [])])
+        with self.captureOnCommitCallbacks(execute=True):
+            category = Category.objects.create(title='monitor', image={'src': '/4.svg', 'alt': 'string'})
+        self.assertEqual(self.categories(), [('video card', []), ('monitor', [])])
+        with self.captureOnCommitCallbacks(execute=True):
+            category.title = 'display'
+            category.maincategories = self.products[0].category
+            category.save()
+        self.assertEqual(self.categories(), [('video card', ['display'])])
+        with self.captureOnCommitCallbacks(execute=True):
+            category.delete()
+        self.assertEqual(self.categories(), [('video card', [])])
+
+
+class ProductCardSignalTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(title='video card', image={'src': '/3.svg', 'alt': 'string'})
+        cls.tag = Tag.objects.create(id='gaming', name='Gaming')
+
+    def setUp(self):
+        ContentType.objects.get_for_model(Product)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product = Product.objects.create(category=self.category, price=100, count=10, date=timezone.now(),
+                                                  title='GF 210')
+
+    def card(self):
+        return ProductCard.objects.get(product=self.product)
+
+    def test_card_follows_product_and_reviews(self):
+        self.assertEqual(self.card().data['title'], 'GF 210')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.title = 'GF 220'
+            self.product.save()
+        self.assertEqual((self.card().title, self.card().data['title']), ('GF 220', 'GF 220'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            APIClient().post(f'/api/product/{self.product.pk}/review',
+                             {'author': 'author', 'email': 'a@example.com', 'text': 'text', 'rate': 4})
+        card = self.card()
+        self.assertEqual((card.review_count, card.rating, card.data['reviews']), (1, Decimal('4.00'), 1))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.delete()
+        self.assertFalse(ProductCard.objects.exists())
+
+    def test_card_follows_tags_and_images(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.tags.add(self.tag)
+        self.assertEqual(self.card().data['tags'], ['gaming'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tag.delete()
+        self.assertEqual(self.card().data['tags'], [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            image = Image.objects.create(image='imgs/products/1.jpg', content_object=self.product)
+        self.assertEqual(self.card().data['images'], ['/media/imgs/products/1.jpg'])
+        with self.captureOnCommitCallbacks(execute=True):
+            image.delete()
+        self.assertEqual(self.card().data['images'], [])
+
+    def test_card_follows_sales(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            sale = Sales.objects.create(product=self.product, salePrice=80, dateFrom=timezone.localdate())
+        self.assertEqual((self.card().price, self.card().data['price']), (Decimal('80.00'), 80))
+        with self.captureOnCommitCallbacks(execute=True):
+            sale.delete()
+        self.assertEqual((self.card().price, self.card().data['price']), (Decimal('100.00'), 100))
+
+
+class CatalogCursorTest(TestCase):
+    SORT_FIELDS = {'rating': 'rating', 'price': 'price', 'reviews': 'review_count', 'date': 'date'}
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='video card', image={'src': '/3.svg', 'alt': 'string'})
+        date = timezone.now()
+        # повторы цены, оценки, числа отзывов и даты: порядок внутри них задает id
+        for i in range(7):
+            product = Product.objects.create(category=category, price=100 + i % 3 * 10, count=1,
+                                             date=date - timedelta(days=i % 2), title=f'GF {i}')
+            Product.objects.filter(pk=product.pk).update(rating=Decimal(i % 4), review_count=i % 3)
+        rebuild_cards()
+
+    def walk(self, url, key):
+        pages = []
+        while url:
+            data = self.client.get(url).json()
+            pages.append(data)
+            url = data[key] and f'{url.split("&cursor=")[0]}&cursor={data[key]}'
+        return pages
+
+    def ids(self, page):
+        return [int(item['id']) for item, in page['items']]
+
+    def test_pages_match_offset_pages(self):
+        cards = {card.pk: card for card in ProductCard.objects.all()}
+        for sort, field in self.SORT_FIELDS.items():
+            for sort_type in ('inc', 'dec'):
+                query = f'/api/catalog?sort={sort}&sortType={sort_type}&limit=3'
+                forward = self.walk(f'{query}&cursor=', 'nextCursor')
+                offset = [self.client.get(f'{query}&page={page}').json() for page in range(1, 4)]
+                with self.subTest(sort=sort, sortType=sort_type):
+                    ids = [pk for page in forward for pk in self.ids(page)]
+                    self.assertEqual(ids, sorted(cards, key=lambda pk: (getattr(cards[pk], field), pk),
+                                                 reverse=sort_type == 'dec'))
+                    self.assertEqual([page['currentPage'] for page in forward], [1, 2, 3])
+                    self.assertEqual([page['lastPage'] for page in forward], [2, 3, 3])
+                    # на страницах те же значения сортировки, что и у OFFSET, без повторов и пропусков
+                    self.assertEqual([[getattr(cards[pk], field) for pk in self.ids(page)] for page in forward],
+                                     [[getattr(cards[pk], field) for pk in self.ids(page)] for page in offset])
+                    self.assertEqual(set(ids), {pk for page in offset for pk in self.ids(page)})
+                    self.assertEqual(list(forward[0]), ['items', 'currentPage', 'lastPage', 'nextCursor',
+                                                        'previousCursor', 'facets'])
+                    self.assertEqual(list(offset[0]), ['items', 'currentPage', 'lastPage', 'facets'])
+
+                    backward = self.walk(f'{query}&cursor={forward[-1]["previousCursor"]}', 'previousCursor')
+                    self.assertEqual([self.ids(page) for page in backward],
+                                     [self.ids(page) for page in reversed(forward[:-1])])
+                    self.assertEqual([page['currentPage'] for page in backward], [2, 1])
+                    self.assertIsNone(backward[-1]['previousCursor'])
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get('/api/catalog?cursor=garbage').status_code, 404)
+
+
+class ConditionalGetTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='video card', image={'src': '/3.svg', 'alt': 'string'})
+        cls.product = Product.objects.create(category=category, price=100, count=10, date=timezone.now(),
+                                             title='GF 210', description='video card')
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_product_detail_not_modified(self):
+        response = self.client.get(f'/api/products/{self.product.pk}')
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/api/products/{self.product.pk}', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('SELECT')]), 1)
+
+        response = self.client.get(f'/api/products/{self.product.pk}',
+                                   HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_product_detail_changes_etag(self):
+        etag = self.client.get(f'/api/products/{self.product.pk}')['ETag']
+        specification = Specification.objects.create(name='memory', value='8 GB')
+        specification.product.add(self.product)
+
+        response = self.client.get(f'/api/products/{self.product.pk}', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data['specifications'], [{'name': 'memory', 'value': '8 GB'}])
+
+    def test_every_save_changes_etag(self):
+        etags = [self.client.get(f'/api/products/{self.product.pk}')['ETag']]
+        for title in ('GF 220', 'GF 230'):
+            # save() устаревшего экземпляра не возвращает версию, записанную touch
+            self.product.title = title
+            self.product.save()
+            etags.append(self.client.get(f'/api/products/{self.product.pk}')['ETag'])
+
+        self.assertEqual(len(set(etags)), 3)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).version, 3)
+
+    def test_catalog_not_modified_until_products_change(self):
+        etag = self.client.get('/api/catalog?sort=price')['ETag']
+        self.assertEqual(self.client.get('/api/catalog?sort=price', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get('/api/catalog?sort=date', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.title = 'GF 220'
+            self.product.save()
+        response = self.client.get('/api/catalog?sort=price', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['items'][0][0]['title'], 'GF 220')
+
+
+class AsyncViewsTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='video card', image={'src': '/3.svg', 'alt': 'string'})
+        tag = Tag.objects.create(id='gaming', name='Gaming')
+        cls.products = []
+        for i in range(5):
+            product = Product.objects.create(category=category, price=100 + i, count=10, date=timezone.now(),
+                                             title=f'GF {i}', description='video card', limited=i % 2 == 0)
+            product.tags.add(tag)
+            Image.objects.create(image=f'imgs/products/{i}.jpg', content_object=product)
+            cls.products.append(product)
+        specification = Specification.objects.create(name='memory', value='8 GB')
+        specification.product.add(cls.products[0])
+        for product in cls.products[1:4]:
+            Sales.objects.create(product=product, salePrice=50)
+        rebuild_cards()
+
+    async def test_async_responses_match_sync(self):
+        paths = ['categories', 'tags', 'catalog', 'catalog?sort=price&sortType=inc&limit=2&page=2',
+                 'catalog?cursor=&sort=price&limit=2', f'catalog/{self.products[0].category_id}',
+                 'products/popular', 'products/limited', 'banners', f'products/{self.products[0].pk}', 'sales',
+                 'sales?limit=2&page=2', 'sales?page=3']
+        for path in paths:
+            expected = await sync_to_async(self.client.get)(f'/api/{path}')
+            response = await self.async_client.get(f'/api/async/{path}')
+            self.assertEqual(response.status_code, expected.status_code, path)
+            self.assertEqual(response.content, expected.content, path)
+
+    async def test_home_blocks(self):
+        response = await self.async_client.get('/api/async/home')
+        self.assertEqual(list(response.json()), ['banners', 'popular', 'limited', 'sales', 'categories'])
+        self.assertEqual(len(response.json()['limited']), 3)
+
+
+class PopularityTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer', password='password')
+        cls.categories = [Category.objects.create(title=f'category {i}', image={'src': '/3.svg', 'alt': 'string'})
+                          for i in range(2)]
+        cls.products = [Product.objects.create(category=cls.categories[i % 2], price=100, count=10,
+                                               date=timezone.now(), title=f'GF {i}') for i in range(6)]
+        rebuild_cards()
+
+    def sell(self, product, count, days_ago):
+        order = Order.objects.create(orderId=f'{product.pk}-{days_ago}', createdAt=timezone.now() - timedelta(days_ago),
+                                     user=self.user, fullName='buyer', email='b@example.com', deliveryType='free',
+                                     paymentType='online', totalCost=0, status='accepted', city='Moscow',
+                                     address='red square 1')
+        OrderProduct.objects.create(id=order.orderId, order=order, product=product, category='', price=100,
+                                    count=count, date='', title=product.title, href=f'catalog/{product.pk}',
+                                    freeDelivery=True, images=[], tags=[], reviews=0, rating=0)
+
+    def test_recent_sales_outrank_old_ones(self):
+        old, recent = self.products[0], self.products[2]
+        self.sell(old, 10, days_ago=60)
+        self.sell(recent, 3, days_ago=1)
+
+        compute_popularity(half_life=7, top_n=2)
+
+        self.assertEqual(ProductPopularity.objects.count(), 4)
+        ranked = list(ProductPopularity.objects.filter(category=self.categories[0]).order_by('rank').
+                      values_list('product', flat=True))
+        self.assertEqual(ranked, [recent.pk, old.pk])
+
+    def test_popular_endpoint_reads_top_n(self):
+        self.sell(self.products[3], 5, days_ago=0)
+        with self.captureOnCommitCallbacks(execute=True):
+            compute_popularity(top_n=2)
+
+        response = APIClient().get('/api/products/popular')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['id'] for item in response.data][0], str(self.products[3].pk))
+        self.assertEqual(len(response.data), 4)
+
+        response = APIClient().get(f'/api/products/popular?category={self.categories[0].pk}')
+        self.assertEqual(len(response.data), 2)
+        self.assertTrue(all(item['category'] == str(self.categories[0].pk) for item in response.data))
+
+
+class FacetTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='video card', image={'src': '/3.svg', 'alt': 'string'})
+        cls.tags = [Tag.objects.create(id='gaming', name='Gaming'), Tag.objects.create(id='silent', name='Silent')]
+        cls.products = []
+        for i in range(6):
+            product = Product.objects.create(category=category, price=100 * (i + 1), count=i % 3, date=timezone.now(),
+                                             title=f'GF {i}', freeDelivery=i % 2 == 0, limited=i == 5,
+                                             rating=i % 5 + 0.5)
+            product.tags.add(cls.tags[i % 2])
+            cls.products.append(product)
+        rebuild_cards()
+
+    def test_filters_and_facets(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = APIClient().get('/api/catalog?filter[minPrice]=200&filter[available]=true&tags[]=gaming')
+        self.assertEqual(response.status_code, 200)
+        # товары 2 и 4: цена от 200, count > 0, тег gaming
+        self.assertEqual([item[0]['id'] for item in response.data['items']],
+                         [str(self.products[4].pk), str(self.products[2].pk)])
+        self.assertEqual(response.data['facets'], {
+            'total': 2, 'price': {'min': 300.0, 'max': 500.0}, 'freeDelivery': 2, 'available': 2, 'limited': 0,
+            'rating': [{'minRating': 4, 'count': 1}, {'minRating': 3, 'count': 1}, {'minRating': 2, 'count': 2},
+                       {'minRating': 1, 'count': 2}],
+            'tags': [{'id': 'gaming', 'name': 'Gaming', 'count': 2}],
+        })
+        # COUNT и страница, фасеты - один GROUP BY и один запрос по тегам
+        self.assertEqual(len([query for query in queries.captured_queries
+                              if query['sql'].startswith('SELECT')]), 4)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = APIClient().get('/api/catalog?filter[available]=true&tags[]=gaming&filter[minPrice]=200&page=1')
+        self.assertEqual(response.data['facets']['total'], 2)
+        self.assertFalse(any('GROUP BY' in query['sql'] for query in queries.captured_queries))
+
+    def test_facets_follow_product_changes(self):
+        url = '/api/catalog?filter[limited]=true'
+        self.assertEqual(APIClient().get(url).data['facets']['total'], 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products[0].limited = True
+            self.products[0].save()
+        self.assertEqual(APIClient().get(url).data['facets']['total'], 2)
+
+    def test_invalid_number(self):
+        response = APIClient().get('/api/catalog?filter[maxPrice]=cheap')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('filter[maxPrice]', response.data)
+
+
+class CategoryTreeTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        image = {'src': '/3.svg', 'alt': 'string'}
+        cls.computers = Category.objects.create(title='computers', image=image)
+        cls.parts = Category.objects.create(title='parts', image=image, maincategories=cls.computers)
+        cls.video = Category.objects.create(title='video cards', image=image, maincategories=cls.parts)
+        cls.phones = Category.objects.create(title='phones', image=image)
+        cls.products = {category.title: Product.objects.create(category=category, price=100, count=1,
+                                                               date=timezone.now(), title=category.title)
+                        for category in (cls.computers, cls.parts, cls.video, cls.phones)}
+        rebuild_cards()
+
+    def catalog(self, url):
+        response = APIClient().get(url)
+        self.assertEqual(response.status_code, 200)
+        return sorted(item[0]['title'] for item in response.data['items'])
+
+    def links(self):
+        return set(CategoryClosure.objects.values_list('ancestor', 'descendant', 'depth'))
+
+    def test_catalog_returns_subtree(self):
+        self.assertEqual(self.catalog(f'/api/catalog/{self.computers.pk}'), ['computers', 'parts', 'video cards'])
+        self.assertEqual(self.catalog(f'/api/catalog/{self.parts.pk}'), ['parts', 'video cards'])
+        self.assertEqual(self.catalog(f'/api/catalog?category={self.video.pk}'), ['video cards'])
+        self.assertEqual(APIClient().get('/api/catalog?category=video').status_code, 400)
+
+    def test_move_and_delete_keep_closure(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.parts.maincategories = self.phones
+            self.parts.save()
+        self.assertEqual(self.catalog(f'/api/catalog/{self.phones.pk}'), ['parts', 'phones', 'video cards'])
+        self.assertEqual(self.catalog(f'/api/catalog/{self.computers.pk}'), ['computers'])
+
+        self.phones.maincategories = self.video
+        with self.assertRaises(ValidationError) as error:
+            self.phones.full_clean()
+        self.assertIn('maincategories', error.exception.message_dict)
+        with self.assertRaises(ValidationError):
+            self.phones.save()
+        self.phones.maincategories = None
+
+        self.products['parts'].delete()
+        self.parts.delete()
+        expected = self.links()
+        rebuild_category_tree()
+        self.assertEqual(self.links(), expected)
+        self.assertIn((self.video.pk, self.video.pk, 0), expected)
+        self.assertFalse(CategoryClosure.objects.filter(descendant=self.video, depth__gt=0).exists())
+
+
+def create_order(user, order_id, **kwargs):
+    kwargs.setdefault('totalCost', 0)
+    return Order.objects.create(orderId=order_id, createdAt=timezone.now(), user=user, fullName='buyer',
+                                email='b@example.com', deliveryType='free', paymentType='online',
+                                status='accepted', city='Moscow', address='red square 1', **kwargs)
+
+
+class StockReservationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer', password='password')
+        category = Category.objects.create(title='video card', image={'src': '/3.svg', 'alt': 'string'})
+        cls.products = [Product.objects.create(category=category, price=100, count=5, date=timezone.now(),
+                                               title=f'GF {i}') for i in range(2)]
+        rebuild_cards()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def stock(self):
+        return [product.count for product in Product.objects.order_by('pk')]
+
+    def fill_basket(self, counts):
+        Baskets.objects.bulk_create([Baskets(user=self.user, product=product, prod_count=count,
+                                             price_mult_count=product.price * count)
+                                     for product, count in zip(self.products, counts)])
+
+    def test_order_from_basket_reserves_all_lines_or_none(self):
+        self.fill_basket([2, 6])
+        response = self.client.post('/api/orders/basket', {}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['products'], [f'Not enough stock for product {self.products[1].pk}'])
+        self.assertEqual(self.stock(), [5, 5])
+        self.assertEqual(Order.objects.count(), 0)
+
+        Baskets.objects.filter(product=self.products[1]).update(prod_count=5)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/orders/basket', {}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.stock(), [3, 0])
+        self.assertEqual(StockReservation.objects.filter(order=response.data['orderId']).count(), 2)
+        # карточка пересобрана после UPDATE, версия товара (ETag) сменилась
+        self.assertEqual(ProductCard.objects.get(pk=self.products[1].pk).count, 0)
+        self.assertGreater(Product.objects.get(pk=self.products[1].pk).version, self.products[1].version)
+
+    def test_expired_reservations_are_released(self):
+        order = create_order(self.user, 'expiring')
+        reserve(order, [(self.products[0].pk, 2), (self.products[0].pk, 1)], now=timezone.now() - timedelta(days=1))
+        paid = create_order(self.user, 'paid')
+        reserve(paid, [(self.products[0].pk, 1)], now=timezone.now() - timedelta(days=1))
+        self.client.post('/api/payment', {'number': '1234567890123', 'name': 'buyer', 'month': '01', 'year': '2030',
+                                          'code': '123'}, format='json')
+        self.assertFalse(StockReservation.objects.filter(order=paid).exists())
+        self.assertEqual(self.stock(), [1, 5])
+
+        self.assertEqual(release_expired(), 1)
+        self.assertEqual(self.stock(), [4, 5])
+        order.refresh_from_db()
+        self.assertEqual((order.status, order.active), ('expired', False))
+
+    def test_out_of_stock_names_short_products(self):
+        with self.assertRaises(OutOfStock) as error:
+            reserve(create_order(self.user, 'big'), [(self.products[0].pk, 1), (self.products[1].pk, 6)])
+        self.assertEqual(error.exception.product_ids, [self.products[1].pk])
+        self.assertEqual(self.stock(), [5, 5])
+
+
+class OrderFromBasketTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer', password='password', email='buyer@example.com')
+        Profile.objects.create(user=cls.user, fullName='Ivan Buyer', phone='79990000000')
+        category = Category.objects.create(title='video card', image={'src': '/3.svg', 'alt': 'string'})
+        cls.products = [Product.objects.create(category=category, price=price, count=5, date=timezone.now(),
+                                               title=f'GF {price}') for price in (100, 250)]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_order_built_from_basket(self):
+        # цены в корзине и в запросе устарели или подделаны: заказ считается по ценам товаров
+        Baskets.objects.bulk_create([Baskets(user=self.user, product=product, prod_count=count, price_mult_count=1)
+                                     for product, count in zip(self.products, (2, 1))])
+        response = self.client.post('/api/orders/basket', {'city': 'Moscow', 'totalCost': 1,
+                                                           'products': [{'id': self.products[0].pk, 'price': 1}]},
+                                    format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(float(response.data['totalCost']), 450)
+        self.assertEqual([(float(line['price']), line['count']) for line in response.data['products']],
+                         [(200, 2), (250, 1)])
+        order = Order.objects.get(pk=response.data['orderId'])
+        self.assertEqual((order.user, order.fullName, order.email, order.phone, order.city),
+                         (self.user, 'Ivan Buyer', 'buyer@example.com', '79990000000', 'Moscow'))
+        self.assertFalse(Baskets.objects.filter(user=self.user).exists())
+
+    def test_empty_basket(self):
+        response = self.client.post('/api/orders/basket', {}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['products'], ['Basket is empty'])
+
+    def test_anonymous_rejected(self):
+        response = APIClient().post('/api/orders/basket', {}, format='json')
+        self.assertIn(response.status_code, (401, 403))
+        self.assertEqual(Order.objects.count(), 0)
+
+
+class StockStressTest(TransactionTestCase):
+    threads = 8
+    attempts = 25
+    stock = 100
+    # повторы на "table is locked" в SQLite; исчерпаны - тест падает, а не висит
+    retries = 500
+
+    def setUp(self):
+        self.user = User.objects.create_user('buyer', password='password')
+        category = Category.objects.create(title='video card', image={'src': '/3.svg', 'alt': 'string'})
+        self.product = Product.objects.create(category=category, price=100, count=self.stock, date=timezone.now(),
+                                              title='GF hot')
+
+    def buy(self, number, count, results, errors):
+        order_id = f'stress-{number}'
+        for retry in range(self.retries):
+            try:
+                # SQLite отвечает "table is locked" и после коммита, в on_commit (пересборка карточки),
+                # поэтому перед повтором проверяем, не прошла ли прошлая попытка
+                if not Order.objects.filter(orderId=order_id).exists():
+                    with transaction.atomic():
+                        reserve(create_order(self.user, order_id), [(self.product.pk, count)])
+                results.append(count)
+                return
+            except OutOfStock:
+                return
+            except OperationalError as exc:
+                # только SQLite: таблица занята другим писателем
+                error = exc
+                time.sleep(0.001)
+        errors.append(f'{order_id}: {error}')
+
+    def worker(self, index, results, errors):
+        try:
+            for attempt in range(self.attempts):
+                self.buy(index * self.attempts + attempt, attempt % 3 + 1, results, errors)
+        finally:
+            connection.close()
+
+    def test_concurrent_orders_never_oversell(self):
+        results, errors = [], []
+        threads = [threading.Thread(target=self.worker, args=(index, results, errors))
+                   for index in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.product.refresh_from_db()
+        reserved = sum(StockReservation.objects.values_list('count', flat=True))
+        # спрос (8 * 25 * 2 = 400) больше остатка: продано ровно столько, сколько было
+        self.assertEqual(sum(results), self.stock)
+        self.assertEqual(reserved, self.stock)
+        self.assertEqual(self.product.count, 0)
+        self.assertEqual(Order.objects.count(), len(results))
+
+
+class SalesTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer', password='password')
+        category = Category.objects.create(title='video card', image={'src': '/3.svg', 'alt': 'string'})
+        cls.products = [Product.objects.create(category=category, price=100, count=10, date=timezone.now(),
+                                               title=f'GF {i}') for i in range(4)]
+        today = timezone.localdate()
+        cls.active = Sales.objects.create(product=cls.products[0], salePrice=80, dateFrom=today - timedelta(3),
+                                          dateTo=today + timedelta(3))
+        cls.open = Sales.objects.create(product=cls.products[1], salePrice=70, dateFrom=today - timedelta(1))
+        cls.future = Sales.objects.create(product=cls.products[2], salePrice=60, dateFrom=today + timedelta(2))
+        cls.past = Sales.objects.create(product=cls.products[3], salePrice=50, dateFrom=today - timedelta(9),
+                                        dateTo=today - timedelta(1))
+        rebuild_cards()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def card_prices(self):
+        return [float(price) for price in ProductCard.objects.order_by('pk').values_list('price', flat=True)]
+
+    def test_active_sales_are_paginated(self):
+        response = self.client.get('/api/sales')
+        self.assertEqual([item['id'] for item in response.data['items']],
+                         [str(self.products[1].pk), str(self.products[0].pk)])
+        self.assertEqual(response.data['items'][1]['salePrice'], 80)
+        response = self.client.get('/api/sales?limit=1&page=2')
+        self.assertEqual((response.data['currentPage'], response.data['lastPage']), (2, 2))
+        self.assertEqual([item['id'] for item in response.data['items']], [str(self.products[0].pk)])
+
+    def test_effective_price_in_catalog_basket_and_order(self):
+        self.assertEqual(self.card_prices(), [80, 70, 100, 100])
+        self.client.post('/api/basket/batch', [{'id': self.products[0].pk, 'count': 2},
+                                               {'id': self.products[2].pk, 'count': 1}], format='json')
+        self.assertEqual(list(Baskets.objects.order_by('product').values_list('price_mult_count', flat=True)),
+                         [160, 100])
+        # скидка началась, пока товар лежал в корзине: в заказ идет цена на сегодня
+        Sales.objects.filter(pk=self.future.pk).update(dateFrom=timezone.localdate())
+        response = self.client.post('/api/orders/basket', {}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(float(response.data['totalCost']), 220)
+        self.assertEqual([float(line['price']) for line in response.data['products']], [160, 60])
+
+    def test_expire_and_start_sales(self):
+        self.assertEqual(expire_sales(batch_size=1), 1)
+        self.assertFalse(Sales.objects.filter(pk=self.past.pk).exists())
+
+        # наступили даты: update() без сигналов, как течение времени
+        today = timezone.localdate()
+        Sales.objects.filter(pk=self.future.pk).update(dateFrom=today)
+        Sales.objects.filter(pk=self.active.pk).update(dateTo=today - timedelta(1))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(expire_sales(), 1)
+            self.assertEqual(start_sales(), 1)
+        self.assertEqual(self.card_prices(), [100, 70, 60, 100])
+
+    def basket_prices(self):
+        return [float(line['price']) for line in self.client.get('/api/basket').data]
+
+    def test_baskets_follow_sales(self):
+        self.client.post('/api/basket/batch', [{'id': product.pk, 'count': 2} for product in self.products],
+                         format='json')
+        self.assertEqual(self.basket_prices(), [160, 140, 200, 200])
+
+        today = timezone.localdate()
+        Sales.objects.filter(pk=self.future.pk).update(dateFrom=today)
+        Sales.objects.filter(pk=self.active.pk).update(dateTo=today - timedelta(1))
+        expire_sales()
+        start_sales()
+        self.assertEqual(self.basket_prices(), [200, 140, 120, 200])
+
+        # изменение скидки через модель - сигналом
+        self.past.dateTo = None
+        self.past.save()
+        self.open.delete()
+        self.assertEqual(self.basket_prices(), [200, 200, 120, 100])
+
+
+class FastSerializerTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer', password='password')
+        category = Category.objects.create(title='video card', image={'src': '/3.svg', 'alt': 'string'})
+        tags = [Tag.objects.create(id=f'tag-{i}', name=f'Tag {i}') for i in range(3)]
+        cls.products = []
+        for i in range(6):
+            product = Product.objects.create(category=category, price=f'{100 + i}.{i}5', count=i, title=f'GF {i}',
+                                             date=timezone.now() - timedelta(days=i, microseconds=i),
+                                             description='video card', freeDelivery=i % 2 == 0, limited=i == 3,
+                                             review_count=i, rating=f'{i % 5}.{i}6')
+            product.tags.add(*tags[i % 3:])
+            for j in range(i % 3):
+                Image.objects.create(image=f'imgs/products/GF {i}-{j}.jpg', content_object=product)
+            cls.products.append(product)
+        today = timezone.localdate()
+        Sales.objects.create(product=cls.products[0], salePrice='80.5', dateFrom=today - timedelta(3),
+                             dateTo=today + timedelta(3))
+        Sales.objects.create(product=cls.products[1], salePrice=70, dateFrom=today)
+        for i in range(3):
+            order = create_order(cls.user, f'10{i}', totalCost=f'{i}99.99')
+            for number, product in enumerate(cls.products[i:i + 2], 1):
+                OrderProduct.objects.create(id=f'{order.pk}-{number}', order=order, product=product, category='1',
+                                            price=product.price, count=number, date=str(product.date),
+                                            title=product.title, description='', href=f'/catalog/{product.pk}',
+                                            freeDelivery=True, images=['/media/1.jpg'], tags=['tag-0'], reviews=1,
+                                            rating='4.50')
+        create_order(cls.user, '200')
+
+    def render(self, data):
+        return JSONRenderer().render(data)
+
+    def test_cards_match_products_serializer(self):
+        ids = [product.pk for product in self.products]
+        for tz in ('UTC', 'Europe/Moscow'):
+            with timezone.override(tz):
+                expected = {card.product_id: card for card in model_cards(ids)}
+                cards = fast_cards(ids)
+                self.assertEqual(len(cards), len(expected))
+                for card in cards:
+                    self.assertEqual(self.render(card.data), self.render(expected[card.product_id].data))
+                    for field in CARD_FIELDS:
+                        self.assertEqual(getattr(card, f'{field}_id' if field == 'category' else field),
+                                         getattr(expected[card.product_id], field if field != 'category'
+                                                 else 'category_id'), field)
+
+    def test_sales_match_sales_serializer(self):
+        queryset = SalesViewSet().get_queryset()
+        expected = self.render(SalesSerializer(queryset, many=True).data)
+        self.assertEqual(self.render(FastSalesSerializer(FastSalesSerializer.values(queryset), many=True).data),
+                         expected)
+
+    def test_orders_match_order_serializer(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with mock.patch('api.fast_serializers.FAST_SERIALIZERS', False):
+            expected = client.get('/api/orders')
+        with mock.patch.object(FastOrderSerializer, 'render', wraps=FastOrderSerializer.render) as render:
+            response = client.get('/api/orders')
+        render.assert_called_once()
+        self.assertEqual(response.content, expected.content)
+        self.assertEqual(len(response.json()), 4)
+
+
+class OrderHistoryTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer', password='password')
+        other = User.objects.create_user('other', password='password')
+        created = timezone.now()
+        # по два заказа на одно время: порядок внутри решает orderId
+        for i in range(45):
+            order = create_order(cls.user, f'5{i:03d}', active=i % 10 == 0)
+            Order.objects.filter(pk=order.pk).update(createdAt=created - timedelta(hours=i // 2))
+            OrderProduct.objects.create(id=f'{order.pk}-1', order=order, category='1', price=10, count=1, date='',
+                                        title='GF', description='', href='/catalog/1', freeDelivery=True, images=[],
+                                        tags=[], reviews=0, rating=0)
+        create_order(other, '9000')
+        cls.expected = list(Order.objects.filter(user=cls.user).order_by('-createdAt', '-orderId').
+                            values_list('orderId', flat=True))
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get_pages(self, query=''):
+        pages, url = [], f'/api/orders/history?limit=20{query}'
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                data = self.client.get(url).data
+            # одна выборка на страницу, без COUNT(*)
+            self.assertEqual(len([query for query in queries if 'FROM "api_order"' in query['sql']]), 1)
+            pages.append(data)
+            url = data['nextCursor'] and f'/api/orders/history?limit=20{query}&cursor={data["nextCursor"]}'
+        return pages
+
+    def test_cursor_pages_cover_history(self):
+        pages = self.get_pages()
+        self.assertEqual([len(page['items']) for page in pages], [20, 20, 5])
+        self.assertEqual([item['orderId'] for page in pages for item in page['items']], self.expected)
+        self.assertNotIn('products', pages[0]['items'][0])
+        response = self.client.get(f'/api/orders/history?limit=20&cursor={pages[2]["previousCursor"]}')
+        self.assertEqual(response.data['items'], pages[1]['items'])
+
+    def test_products_snapshot_on_request(self):
+        pages, summary = self.get_pages('&products=true'), self.get_pages()
+        self.assertEqual(pages[0]['items'][0]['products'][0]['id'], f'{self.expected[0]}-1')
+        with mock.patch('api.fast_serializers.FAST_SERIALIZERS', False):
+            self.assertEqual(self.get_pages('&products=true'), pages)
+            self.assertEqual(self.get_pages(), summary)
+
+    def test_orders_are_per_user(self):
+        self.assertEqual([order['orderId'] for order in self.client.get('/api/orders').data], self.expected)
+        self.assertEqual(self.client.get('/api/orders/active').data['orderId'], '5000')
+        self.assertEqual(APIClient().get('/api/orders/history').data['items'], [])
+
+
+class ProductReviewsTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='video card', image={'src': '/3.svg', 'alt': 'string'})
+        cls.product = Product.objects.create(category=category, price=100, count=10, date=timezone.now(),
+                                             title='GF')
+        client = APIClient()
+        for i in range(25):
+            client.post(f'/api/product/{cls.product.pk}/review', {'author': f'author {i}', 'email': 'a@example.com',
+                                                                   'text': 'text', 'rate': i % 5 + 1 if i < 20 else 5})
+        # по два отзыва на одно время: порядок внутри решает id
+        created = timezone.now()
+        for i, review in enumerate(Review.objects.order_by('id')):
+            Review.objects.filter(pk=review.pk).update(date=created - timedelta(minutes=(25 - i) // 2))
+        cls.expected = list(Review.objects.order_by('-date', '-id').values_list('author', flat=True))
+
+    def test_detail_has_latest_reviews_and_histogram(self):
+        data = self.client.get(f'/api/products/{self.product.pk}').json()
+        self.assertEqual([review['author'] for review in data['reviews']], self.expected[:LATEST_REVIEWS])
+        self.assertEqual(data['reviewsCount'], 25)
+        self.assertEqual(data['ratingHistogram'], {'1': 4, '2': 4, '3': 4, '4': 4, '5': 9})
+
+    def test_reviews_pages(self):
+        authors, url = [], f'/api/products/{self.product.pk}/reviews?limit=10'
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                data = self.client.get(url).data
+            self.assertEqual(len([query for query in queries if 'FROM "api_review"' in query['sql']]), 1)
+            authors += [review['author'] for review in data['items']]
+            url = data['nextCursor'] and f'/api/products/{self.product.pk}/reviews?limit=10&cursor={data["nextCursor"]}'
+        self.assertEqual(authors, self.expected)
+        self.assertEqual(self.client.get('/api/products/999/reviews').status_code, 404)
+
+    def test_reconcile_histogram(self):
+        Product.objects.filter(pk=self.product.pk).update(rate_5=0, rate_1=7)
+        call_command('reconcile_ratings', stdout=StringIO())
+        self.assertEqual(Product.objects.get(pk=self.product.pk).rating_histogram(),
+                         {'1': 4, '2': 4, '3': 4, '4': 4, '5': 9})
+
+
+class ProductCacheTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='video card', image={'src': '/3.svg', 'alt': 'string'})
+        cls.products = [Product.objects.create(category=category, price=100, count=10, date=timezone.now(),
+                                               title=f'GF {i}', review_count=i) for i in range(3)]
+
+    def setUp(self):
+        cache.clear()
+        registry.reset()
+
+    def get(self, product):
+        return self.client.get(f'/api/products/{product.pk}')
+
+    def lookups(self):
+        return [registry.get_count('api_cache_requests_total', cache='product', result=result)
+                for result in ('hit', 'miss')]
+
+    def test_cached_until_product_changes(self):
+        first = self.get(self.products[0])
+        with CaptureQueriesContext(connection) as queries:
+            second = self.get(self.products[0])
+        self.assertEqual(second.content, first.content)
+        # только версия товара
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('SELECT')]), 1)
+        self.get(self.products[1])
+        self.assertEqual(self.lookups(), [1, 2])
+
+        Review.objects.create(product=self.products[0], author='author', email='a@example.com', text='text', rate=5)
+        response = self.get(self.products[0])
+        self.assertEqual([review['author'] for review in response.json()['reviews']], ['author'])
+        self.get(self.products[1])
+        self.assertEqual(self.lookups(), [2, 3])
+        self.assertAlmostEqual(hit_ratio(), 0.4)
+        self.assertIn('api_cache_requests_total{cache="product",result="hit"} 2', registry.render())
+
+    def test_warm_top_products(self):
+        out = StringIO()
+        call_command('warm_product_cache', '--top', '2', stdout=out)
+        self.assertIn('warmed: 2', out.getvalue())
+        expected = build_product_data(self.products[2].pk)
+        self.assertEqual(self.get(self.products[2]).json(), json.loads(JSONRenderer().render(expected)))
+        self.get(self.products[0])
+        self.assertEqual(self.lookups(), [1, 1])
+
+
+class CatalogImportExportTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(title='video card', image={'src': '/3.svg', 'alt': 'string'})
+        Tag.objects.create(id='gaming', name='Gaming')
+
+    def record(self, pk, **fields):
+        return {'id': pk, 'category': self.category.pk, 'title': f'GF {pk}', 'price': '10.50', 'count': 3,
+                'date': '2023-01-01T10:00:00+00:00', 'tags': ['gaming', 'new'], 'images': ['imgs/1.jpg'],
+                'specifications': [{'name': 'memory', 'value': '8 GB'}], **fields}
+
+    def import_jsonl(self, records, *args):
+        path = f'{self.tmp}/catalog.jsonl'
+        with open(path, 'w') as stream:
+            stream.writelines(json.dumps(record) + '\n' for record in records)
+        call_command('import_catalog', path, *args, stdout=StringIO())
+
+    def export(self, name):
+        call_command('export_catalog', f'{self.tmp}/{name}', stderr=StringIO())
+        with open(f'{self.tmp}/{name}') as stream:
+            return stream.read()
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.tmp = directory.name
+
+    def test_import_is_idempotent_upsert(self):
+        self.import_jsonl([self.record(pk) for pk in (10, 11, 12)], '--batch-size', '2')
+        product = Product.objects.get(pk=11)
+        self.assertEqual((product.title, product.price, product.version), ('GF 11', Decimal('10.50'), 2))
+        self.assertEqual(sorted(product.tags.values_list('id', flat=True)), ['gaming', 'new'])
+        self.assertEqual(list(product.images.values_list('image', flat=True)), ['imgs/1.jpg'])
+        self.assertEqual(ProductCard.objects.get(product=11).title, 'GF 11')
+        exported = self.export('first.jsonl')
+
+        self.import_jsonl([self.record(pk) for pk in (10, 11, 12)])
+        self.assertEqual(self.export('second.jsonl'), exported)
+        self.assertEqual((Product.objects.count(), Image.objects.count(), Specification.objects.count()), (3, 3, 1))
+
+        # связи приводятся к файлу, отсутствующий ключ их не трогает
+        self.import_jsonl([self.record(11, title='GF new', tags=['new'], images=['imgs/2.jpg', 'imgs/1.jpg'],
+                                       specifications=[]),
+                           {key: value for key, value in self.record(12, price='5').items() if key != 'tags'}])
+        product = Product.objects.get(pk=11)
+        self.assertEqual((product.title, list(product.tags.values_list('id', flat=True))), ('GF new', ['new']))
+        self.assertEqual(sorted(product.images.values_list('image', flat=True)), ['imgs/1.jpg', 'imgs/2.jpg'])
+        self.assertFalse(product.specifications.exists())
+        self.assertEqual(Product.objects.get(pk=12).tags.count(), 2)
+        self.assertEqual(ProductCard.objects.get(product=12).price, Decimal('5'))
+
+        self.import_jsonl([self.record(11, images=['imgs/2.jpg'])])
+        self.assertEqual(list(Product.objects.get(pk=11).images.values_list('image', flat=True)), ['imgs/2.jpg'])
+
+    def test_csv_round_trip(self):
+        self.import_jsonl([self.record(pk) for pk in (1, 2)])
+        exported = self.export('catalog.csv')
+        Product.objects.all().delete()
+        call_command('import_catalog', f'{self.tmp}/catalog.csv', stdout=StringIO())
+        self.assertEqual(self.export('again.csv'), exported)
+        self.assertEqual(Product.objects.get(pk=2).specifications.get().value, '8 GB')
+
+    def test_invalid_record_reports_line(self):
+        with self.assertRaisesMessage(CommandError, 'line 2: unknown category 999'):
+            self.import_jsonl([self.record(1), self.record(2, category=999)])
+        with self.assertRaisesMessage(CommandError, 'line 1: missing fields: price'):
+            self.import_jsonl([self.record(3, price=None)])
+        with self.assertRaisesMessage(CommandError, 'line 1: id: '):
+            self.import_jsonl([self.record('x')])
+        self.assertFalse(Product.objects.exists())
+
+
+@override_settings(API_READ_REPLICA='replica')
+class ReplicaRoutingTest(TransactionTestCase):
+    # replica в тестах - зеркало default (settings.py): те же данные, но свое соединение
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        self.user = User.objects.create_user('buyer', password='password')
+        category = Category.objects.create(title='video card', image={'src': '/3.svg', 'alt': 'string'})
+        self.product = Product.objects.create(category=category, price=100, count=10, date=timezone.now(),
+                                              title='GF')
+
+    def request(self, method, url, **kwargs):
+        # возвращает базы, в которые ушли SELECT запроса
+        cache.clear()
+        local_cache.clear()
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['replica']) as replica:
+            response = getattr(self.client, method)(url, **kwargs)
+        return response, {alias for alias, queries in (('default', primary), ('replica', replica))
+                          if any(query['sql'].startswith('SELECT') for query in queries)}
+
+    def test_reads_of_read_only_views_go_to_replica(self):
+        response, aliases = self.request('get', f'/api/products/{self.product.pk}')
+        self.assertEqual((response.status_code, aliases), (200, {'replica'}))
+        self.client.force_login(self.user)
+        self.assertEqual(self.request('get', '/api/basket')[1], {'default'})
+        with override_settings(API_READ_REPLICA=None):
+            self.assertEqual(self.request('get', f'/api/products/{self.product.pk}')[1], {'default'})
+
+    def test_cached_data_built_from_primary(self):
+        # версия кэша меняется после коммита в default, отставшая реплика не должна попасть под новую версию
+        for url in ('/api/tags', '/api/categories', '/api/products/limited', '/api/async/tags',
+                    '/api/async/categories', '/api/async/products/limited'):
+            response, aliases = self.request('get', url)
+            self.assertEqual((response.status_code, aliases), (200, {'default'}), url)
+        # страница каталога с реплики, фасеты - с default
+        with CaptureQueriesContext(connections['default']) as primary:
+            response, aliases = self.request('get', '/api/catalog')
+        self.assertEqual(aliases, {'default', 'replica'})
+        self.assertTrue(all('COUNT' in query['sql'] for query in primary
+                            if query['sql'].startswith('SELECT')))
+        self.assertEqual(response.data['facets']['total'], 1)
+
+    def test_reads_stick_to_primary_after_write(self):
+        response, _ = self.request('post', f'/api/product/{self.product.pk}/review',
+                                   data={'author': 'author', 'email': 'a@example.com', 'text': 'text', 'rate': 5})
+        self.assertEqual(response.status_code, 201)
+        self.assertIn(STICKY_COOKIE, response.cookies)
+        self.assertEqual(self.request('get', f'/api/products/{self.product.pk}')[1], {'default'})
+
+        self.client.cookies[STICKY_COOKIE] = str(time.time() - 1)
+        response, aliases = self.request('get', f'/api/products/{self.product.pk}')
+        self.assertEqual(aliases, {'replica'})
+        self.assertEqual(response.data['reviewsCount'], 1)
+
+    def test_read_views_are_not_atomic(self):
+        self.assertIn('default', resolve('/api/catalog').func._non_atomic_requests)
+        self.assertIn('default', resolve('/api/async/tags').func._non_atomic_requests)
+        self.assertFalse(hasattr(resolve('/api/basket').func, '_non_atomic_requests'))
+
+
+class MetricsTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('admin', password='password', is_staff=True)
+        Tag.objects.create(id='gaming', name='Gaming')
+
+    def setUp(self):
+        cache.clear()
+        local_cache.clear()
+        registry.reset()
+
+    def histogram(self, view, name):
+        index = [metric for metric, _, _ in registry.metrics].index(name)
+        return registry.views[view][index]
+
+    def test_sync_request_counts_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/tags')
+        count = len(queries)
+        histogram = self.histogram('tags', 'api_request_queries')
+        self.assertGreater(count, 0)
+        self.assertEqual((histogram.count, histogram.sum), (1, count))
+        self.assertEqual(self.histogram('tags', 'api_request_duration_seconds').count, 1)
+
+        # из кэша: запрос учтен, SQL нет
+        self.client.get('/api/tags')
+        self.assertEqual((histogram.count, histogram.sum), (2, count))
+
+    async def test_async_request_counts_queries(self):
+        response = await self.async_client.get('/api/async/tags')
+        self.assertEqual(response.json(), [{'id': 'gaming', 'name': 'Gaming'}])
+        histogram = self.histogram('async_tags', 'api_request_queries')
+        self.assertEqual(histogram.count, 1)
+        self.assertGreater(histogram.sum, 0)
+
+    def test_metrics_endpoint_is_restricted(self):
+        self.client.get('/api/tags')
+        self.assertEqual(self.client.get('/api/_metrics').status_code, 403)
+        with mock.patch('api.metrics.ALLOWED_IPS', ['127.0.0.1']):
+            self.assertEqual(self.client.get('/api/_metrics').status_code, 200)
+
+        self.client.force_login(self.staff)
+        response = self.client.get('/api/_metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('api_request_queries_count{view="tags"} 1', response.content.decode())
+
+
+class BenchApiTest(TestCase):
+
+    def test_every_route_has_scenario(self):
+        user = User.objects.create_user('bench_user_1', password='password')
+        category = Category.objects.create(title='video card', image={'src': '/3.svg', 'alt': 'string'})
+        product = Product.objects.create(category=category, price=100, count=10, date=timezone.now(), title='GF')
+        scenarios = BenchApiCommand().get_scenarios(user, product, category, None)
+        self.assertEqual({pattern.name for pattern in urls.urlpatterns} - set(scenarios), set())
+
+
+class LocalCacheTest(TestCase):
 
-from api.models import Product
+    def setUp(self):
+        cache.clear()
+        registry.reset()
+        local_cache.clear()
+        self.now = 0
+        # два воркера с общим кэшем Django
+        self.workers = [LocalCache(maxsize=2, ttl=10, check_interval=1, clock=lambda: self.now) for _ in range(2)]
 
+    def test_lru_and_ttl(self):
+        worker = self.workers[0]
+        for key in ('a', 'b'):
+            worker.set(key, key.upper(), None)
+        self.assertEqual(worker.get('a'), 'A')
+        worker.set('c', 'C', None)
+        self.assertEqual(list(worker.entries), ['a', 'c'])
+        cache.set('a', 'changed')
+        self.assertEqual(worker.get('a'), 'A')
+        self.now = 11
+        self.assertEqual(worker.get('a'), 'changed')
+        self.assertEqual(worker.stats(), {'size': 2, 'maxsize': 2, 'hits': 2, 'misses': 1, 'evictions': 1,
+                                          'invalidations': 0})
 
+    def test_generation_invalidates_other_workers(self):
+        first, second = self.workers
+        cache.set('api:version:tags', 1)
+        self.assertEqual([first.get('api:version:tags'), second.get('api:version:tags')], [1, 1])
+        cache.set('api:version:tags', 2)
+        first.invalidate()
+        self.assertEqual(first.get('api:version:tags'), 2)
+        # второй воркер сверяет поколение не чаще раза в check_interval
+        self.now = 0.5
+        self.assertEqual(second.get('api:version:tags'), 1)
+        self.now = 1
+        self.assertEqual(second.get('api:version:tags'), 2)
+        self.assertEqual(registry.get_count('api_local_cache_invalidations_total'), 2)
 
-print(ContentType.objects.get(Product.objects.get(pk=1)).id)
\ No newline at end of file
+    def test_tags_served_from_local_cache(self):
+        Tag.objects.create(id='gaming', name='Gaming')
+        self.assertEqual(self.client.get('/api/tags').json(), [{'id': 'gaming', 'name': 'Gaming'}])
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get('/api/tags').json(), [{'id': 'gaming', 'name': 'Gaming'}])
+        self.assertEqual(len(queries), 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.create(id='work', name='For work')
+        self.assertEqual(len(self.client.get('/api/tags').json()), 2)
+        self.assertIn('api_cache_requests_total{cache="local",result="hit"}', registry.render())
@@ -1,9 +1,12 @@
 from django.urls import path, re_path
 
+from api.metrics import metrics_view
+
 from api.views import ProfileList, CategoryList, SetNewPassword, SetAvatar, TagViewSet, CreatePaymentViewSet,\
     ProductsCatalogViewSet, ProductsCatalogWithIdViewSet, ProductsPopularViewSet, ProductsLimitedViewSet,\
     ProductsBannersViewSet, ProductViewSet, CreateReviewViewSet, BasketView, SalesViewSet, OrderViewSet,\
-    OrderListViewSet, LastActiveOrderViewSet
+    OrderListViewSet, LastActiveOrderViewSet, BasketBatchView, OrderFromBasketView, OrderHistoryViewSet, \
+    ProductReviewsViewSet
 
 urlpatterns = [
     re_path(r'^profile/?$', ProfileList.as_view(), name='profile_detail'),
@@ -18,11 +21,16 @@ urlpatterns = [
     re_path(r'products/limited/?$', ProductsLimitedViewSet.as_view({'get': 'list'}), name='limited'),
     re_path(r'banners/?$', ProductsBannersViewSet.as_view({'get': 'list'}), name='on_banners'),
     path('products/<int:pk>', ProductViewSet.as_view({'get': 'retrieve'}), name='product_detail'),
+    path('products/<int:pk>/reviews', ProductReviewsViewSet.as_view(), name='product_reviews'),
     path('product/<int:pk>/review', CreateReviewViewSet.as_view({'post': 'create'}), name='create_review'),
     path('basket', BasketView.as_view(), name='users_basket'),
+    path('basket/batch', BasketBatchView.as_view(), name='users_basket_batch'),
     path('sales', SalesViewSet.as_view({'get': 'list'}), name='sales_list'),
     path('orders', OrderListViewSet.as_view(), name='order_list'),
+    path('orders/basket', OrderFromBasketView.as_view(), name='order_from_basket'),
     path('orders/active', LastActiveOrderViewSet.as_view(), name='order_last_active_detail'),
+    path('orders/history', OrderHistoryViewSet.as_view(), name='order_history'),
     path('orders/<int:pk>', OrderViewSet.as_view(), name='order_detail'),
+    path('_metrics', metrics_view, name='metrics'),
 
 ]
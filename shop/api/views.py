@@ -1,27 +1,40 @@
+import hashlib
 import operator
-from datetime import timezone
 from functools import reduce
 from django.http import Http404
 from django.contrib.contenttypes.models import ContentType
-from django.db.models.constants import LOOKUP_SEP
 from rest_framework import status
-from rest_framework.compat import distinct
-from rest_framework.generics import RetrieveAPIView, ListAPIView, CreateAPIView
+from rest_framework.exceptions import ValidationError
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils import timezone
+from django.utils.http import http_date, quote_etag
+from rest_framework.generics import RetrieveAPIView, ListAPIView, CreateAPIView, get_object_or_404
 from rest_framework.mixins import CreateModelMixin
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.viewsets import ReadOnlyModelViewSet, GenericViewSet
-from api.serializers import ProfileSerializer, CategorySerializer, AvatarSerializer, PasswordSerializer, TagSerializer,\
-    Paymenterializer, ProductsSerializer, ProductSerializer, ReviewSerializer, BasketProductsSerializer,\
-    BasketChangesSerializer, SalesSerializer, OrderSerializer
-from django.db.models import Value, CharField, Count, Avg
-from django.db.models.functions import Concat, Round, Coalesce
-from django.db.models import Q
+from api.serializers import ProfileSerializer, AvatarSerializer, PasswordSerializer, TagSerializer,\
+    Paymenterializer, ProductCardSerializer, ProductSerializer, ReviewSerializer, BasketProductsSerializer,\
+    BasketChangesSerializer, BasketOperationSerializer, SalesSerializer, OrderSerializer, \
+    OrderFromBasketSerializer, OrderSummarySerializer
 from rest_framework.filters import SearchFilter, OrderingFilter
 from rest_framework.request import Request
 from rest_framework.utils.serializer_helpers import ReturnList
-from api.models import Profile, Category, Tag, Payment, Product, Review, Baskets, Sales, Order
+from api.cache import get_category_tree, get_tags, get_or_build, get_version_info
+from api.category_tree import subtree_condition
+from api.db_routing import ReadOnlyViewMixin
+from api.facets import get_facets, get_filter_conditions, get_filter_params, is_true
+from api.fast_serializers import FastListMixin, FastSalesSerializer, FastOrderSerializer, \
+    FastOrderSummarySerializer
+from api.pagination import AsyncPageNumberMixin, KeysetPaginationMixin
+from api.popularity import TOP_N as POPULARITY_TOP_N
+from api.product_cache import get_product_data, product_queryset
+from api.search import get_search_backend
+from api.stock import confirm_order
+from api.models import Profile, Category, Tag, Payment, Product, ProductCard, ProductPopularity, Review, Baskets, \
+    Sales, Order
 
 
 class ProfileList(APIView):
@@ -61,23 +74,35 @@ class SetNewPassword(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class CategoryList(APIView):
+class CategoryList(ReadOnlyViewMixin, APIView):
+    # меню не зависит от пользователя, поэтому без аутентификации и с прогретым кэшем запросов в БД нет
+    authentication_classes = []
 
     def get(self, request):
-        category = Category.objects.filter(maincategories=None).annotate(href=Concat(Value('/catalog/'), 'id', output_field=CharField()))
-        serializer = CategorySerializer(category, many=True)
-        return Response(serializer.data)
+        return Response(get_category_tree())
 
 
-class TagViewSet(ReadOnlyModelViewSet):
+class TagViewSet(ReadOnlyViewMixin, ReadOnlyModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
 
+    def list(self, request, *args, **kwargs):
+        # список тегов общий для всех, берется из кэша (api/cache.py) до изменения тегов
+        return Response(get_tags())
+
 
 class CreatePaymentViewSet(CreateModelMixin, GenericViewSet):
     queryset = Payment.objects.all()
     serializer_class = Paymenterializer
 
+    def perform_create(self, serializer):
+        # оплачивается последний активный заказ (как /api/orders/active), его резерв больше не истекает
+        super().perform_create(serializer)
+        if self.request.user.is_authenticated:
+            order = Order.objects.filter(user=self.request.user, active=True).order_by('-createdAt').first()
+            if order is not None:
+                confirm_order(order)
+
 
 def myf(num):
     if num is None:
@@ -86,13 +111,36 @@ def myf(num):
         return num
 
 
-class PaginationProduct(PageNumberPagination):
+class PaginationProduct(AsyncPageNumberMixin, KeysetPaginationMixin, PageNumberPagination):
+    # ?cursor= включает пагинацию по ключу: без OFFSET и COUNT(*), lastPage известен только на шаг вперед
     page_size = 20
     page_size_query_param = 'limit'
+    keyset = False
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = self.is_keyset_request(request)
+        if self.keyset:
+            return self.paginate_keyset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        # то же самое для api/async_views.py
+        self.keyset = self.is_keyset_request(request)
+        if self.keyset:
+            return await self.apaginate_keyset(queryset, request, view)
+        return await self.apaginate_page(queryset, request)
 
     def get_paginated_response(self, data: ReturnList):
         data = [[d] for d in data]
 
+        if self.keyset:
+            return Response({
+                'items': data,
+                'currentPage': self.current_page,
+                'lastPage': self.current_page + 1 if self.next_cursor else self.current_page,
+                'nextCursor': self.next_cursor,
+                'previousCursor': self.previous_cursor,
+            })
         return Response({
             'items': data,
             'currentPage': self.page.number,
@@ -100,11 +148,80 @@ class PaginationProduct(PageNumberPagination):
         })
 
 
-class ProductsViewSet(ReadOnlyModelViewSet):
-    queryset = Product.objects.prefetch_related('reviews').all().\
-        annotate(href=Concat(Value('/catalog/'), 'id', output_field=CharField()),
-                 rating=Coalesce(Round(Avg('reviews__rate'), 1), 0.0))
-    serializer_class = ProductsSerializer
+class PaginationKeyset(KeysetPaginationMixin, PageNumberPagination):
+    # всегда по ключу сортировки queryset: без OFFSET и COUNT(*), любая страница стоит одинаково
+    page_size = 20
+    page_size_query_param = 'limit'
+    max_page_size = 100
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.paginate_keyset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'items': data,
+            'currentPage': self.current_page,
+            'nextCursor': self.next_cursor,
+            'previousCursor': self.previous_cursor,
+        })
+
+
+def set_validators(response, etag, last_modified):
+    if response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        patch_cache_control(response, no_cache=True)
+    return response
+
+
+def conditional_response(request, etag, last_modified, build):
+    # If-None-Match/If-Modified-Since проверяются до build(), на 304 сериализации нет
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    return set_validators(response if response is not None else build(), etag, last_modified)
+
+
+def list_etag(request, version, modified, format='json'):
+    key = f'{version}:{modified}:{request.get_full_path()}:{format}'
+    return quote_etag(hashlib.md5(key.encode()).hexdigest())
+
+
+def product_etag(pk, version, format='json'):
+    return quote_etag(f'{pk}.{version}.{format}')
+
+
+class ConditionalListMixin:
+    # валидаторы списка - версия product_lists и адрес запроса, для 304 в БД не ходим
+
+    def list(self, request, *args, **kwargs):
+        version, modified = get_version_info('product_lists')
+        return conditional_response(request, list_etag(request, version, modified, request.accepted_renderer.format),
+                                    modified, lambda: super(ConditionalListMixin, self).list(request, *args, **kwargs))
+
+
+class ConditionalRetrieveMixin:
+    # валидаторы товара - Product.version и updated_at, одним запросом по первичному ключу;
+    # тело ответа - из кэша по той же версии (api/product_cache.py)
+
+    def retrieve(self, request, *args, **kwargs):
+        pk = kwargs[self.lookup_url_kwarg or self.lookup_field]
+        version, updated_at = get_object_or_404(Product.objects.values_list('version', 'updated_at'), pk=pk)
+        etag = product_etag(pk, version, request.accepted_renderer.format)
+        return conditional_response(request, etag, int(updated_at.timestamp()),
+                                    lambda: Response(get_product_data(pk, version, updated_at)))
+
+
+class FacetListMixin:
+    # facets - счетчики фильтров по всему отфильтрованному списку, а не по странице (api/facets.py)
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        response.data['facets'] = get_facets(self, self.filter_queryset(self.get_queryset()))
+        return response
+
+
+class ProductsViewSet(ReadOnlyViewMixin, ConditionalListMixin, FacetListMixin, ReadOnlyModelViewSet):
+    queryset = ProductCard.objects.all()
+    serializer_class = ProductCardSerializer
 
 
 class MyOrdering(OrderingFilter):
@@ -119,124 +236,142 @@ class MyOrdering(OrderingFilter):
         return valid_fields
 
     def remove_invalid_fields(self, queryset, fields, view, request):
-        valid_fields = [item[0] for item in self.get_valid_fields(queryset, view, {'request': request})]
+        valid_fields = dict(self.get_valid_fields(queryset, view, {'request': request}))
+        prefix = '' if request.query_params.get('sortType', False) == 'inc' else '-'
 
-        if not (request.query_params.get('sortType', False) == 'inc'):
-            fields = ['-'+field for field in fields]
-
-        def term_valid(term):
-            if term.startswith("-"):
-                term = term[1:]
-            return term in valid_fields
-
-        return [term for term in fields if term_valid(term)]
-
-
-class ProductFilter(SearchFilter):
+        return [prefix + valid_fields[field] for field in fields if field in valid_fields]
 
     def filter_queryset(self, request, queryset, view):
-        search_fields = self.get_search_fields(view, request)
-        search_terms = self.get_search_terms(request)
-        conditions = []
-        if (not search_fields or not search_terms) and not request.query_params.get('category', False):
-            return queryset
-        elif request.query_params.get('category', False):
-            queries = [
-                Q(**{LOOKUP_SEP.join(['category__id', 'iexact']): request.query_params.get('category', False)})
-            ]
-            conditions.append(reduce(operator.and_, queries))
-
-        base = queryset
-        if search_fields and search_terms:
-            orm_lookups = [
-                self.construct_search(str(search_field))
-                for search_field in search_fields
-            ]
+        # при поиске без явной сортировки выдаем по релевантности
+        if not request.query_params.get(self.ordering_param) and 'search_rank' in queryset.query.annotations:
+            return queryset.order_by('-search_rank', *self.get_default_ordering(view))
+        return super().filter_queryset(request, queryset, view)
 
-            for search_term in search_terms:
-                queries = [
-                    Q(**{orm_lookup: search_term})
-                    for orm_lookup in orm_lookups
-                ]
-                conditions.append(reduce(operator.or_, queries))
 
-        queryset = queryset.filter(reduce(operator.and_, conditions))
-
-        if self.must_call_distinct(queryset, search_fields):
-            queryset = distinct(queryset, base)
-        return queryset
+class ProductFilter(SearchFilter):
 
+    def get_category_conditions(self, request, view):
+        # категория вместе со всеми подкатегориями (api/category_tree.py)
+        category = request.query_params.get('category', False)
+        if category:
+            if not category.isdigit():
+                raise ValidationError({'category': ['A valid integer is required.']})
+            return [subtree_condition(int(category))]
+        return []
 
-class ProductWithIdFilter(SearchFilter):
+    def get_search_terms(self, request):
+        # filter[name] или ?filter=текст, остальные ключи filter - фасетные фильтры
+        terms = get_filter_params(request.query_params).get('name', '')
+        return terms.replace('\x00', '').replace(',', ' ').split()
 
     def filter_queryset(self, request, queryset, view):
-        search_fields = self.get_search_fields(view, request)
+        conditions = self.get_category_conditions(request, view) + \
+            get_filter_conditions(get_filter_params(request.query_params))
+        if conditions:
+            queryset = queryset.filter(reduce(operator.and_, conditions))
         search_terms = self.get_search_terms(request)
-        conditions = []
-        queries = [Q(**{LOOKUP_SEP.join(['category__id', 'iexact']): str(view.kwargs['id'])})]
-        conditions.append(reduce(operator.and_, queries))
-        base = queryset
-        if search_fields and search_terms:
-            orm_lookups = [
-                self.construct_search(str(search_field))
-                for search_field in search_fields
-            ]
+        if search_terms:
+            queryset = get_search_backend().search(queryset, search_terms)
+        return queryset
 
-            for search_term in search_terms:
-                queries = [
-                    Q(**{orm_lookup: search_term})
-                    for orm_lookup in orm_lookups
-                ]
-                conditions.append(reduce(operator.or_, queries))
 
-        queryset = queryset.filter(reduce(operator.and_, conditions))
+class ProductWithIdFilter(ProductFilter):
 
-        if self.must_call_distinct(queryset, search_fields):
-            queryset = distinct(queryset, base)
-        return queryset
+    def get_category_conditions(self, request, view):
+        return [subtree_condition(view.kwargs['id'])]
 
 
 class ProductsCatalogViewSet(ProductsViewSet):
     pagination_class = PaginationProduct
     filter_backends = [ProductFilter, MyOrdering]
-    search_fields = ['title']
-    ordering_fields = ['rating', 'price', 'reviews', 'date']
+    ordering_fields = ['rating', 'price', ('reviews', 'review_count'), 'date']
     ordering = ['-date']
 
 
 class ProductsCatalogWithIdViewSet(ProductsViewSet):
     pagination_class = PaginationProduct
     filter_backends = [ProductWithIdFilter, MyOrdering]
-    search_fields = ['title']
-    ordering_fields = ['rating', 'price', 'reviews', 'date']
+    ordering_fields = ['rating', 'price', ('reviews', 'review_count'), 'date']
     ordering = ['-date']
 
 
-class ProductsPopularViewSet(ReadOnlyModelViewSet):
-    queryset = Product.objects.all().annotate(href=Concat(Value('/catalog/'), 'id', output_field=CharField()),
-                                              rev_c=Count('reviews'),
-                                              rating=Coalesce(Round(Avg('reviews__rate'), 1), 0.0)).\
-        order_by('-rev_c', '-rating')
-    serializer_class = ProductsSerializer
+def plain_data(data):
+    # ReturnList/ReturnDict держат ссылку на сериализатор, в кэш кладем обычные list/dict
+    if isinstance(data, dict):
+        return {key: plain_data(value) for key, value in data.items()}
+    if isinstance(data, list):
+        return [plain_data(value) for value in data]
+    return data
+
+
+class CachedListMixin:
+    # кэш всего ответа list(), сбрасывается сигналами через версию product_lists
+    cache_name = None
+
+    def get_cache_name(self):
+        return self.cache_name
 
+    async def aget_queryset(self):
+        # для api/async_views.py, если get_queryset() сам ходит в БД
+        return self.get_queryset()
 
-class ProductsLimitedViewSet(ReadOnlyModelViewSet):
-    queryset = Product.objects.filter(limited=True).\
-        annotate(href=Concat(Value('/catalog/'), 'id', output_field=CharField()),
-                 rating=Coalesce(Round(Avg('reviews__rate'), 1), 0.0))
-    serializer_class = ProductsSerializer
+    def list(self, request, *args, **kwargs):
+        data = get_or_build(self.get_cache_name(), 'product_lists',
+                            lambda: plain_data(super(CachedListMixin, self).list(request, *args, **kwargs).data))
+        return Response(data)
 
 
-class ProductsBannersViewSet(ReadOnlyModelViewSet):
-    queryset = Product.objects.filter(on_banner=True).\
-        annotate(href=Concat(Value('/catalog/'), 'id', output_field=CharField()),
-                 rating=Coalesce(Round(Avg('reviews__rate'), 1), 0.0))
-    serializer_class = ProductsSerializer
+class ProductsPopularViewSet(ReadOnlyViewMixin, ConditionalListMixin, CachedListMixin, ReadOnlyModelViewSet):
+    # лучшие товары из ProductPopularity (manage.py compute_popularity), ?category= - внутри категории
+    cache_name = 'popular'
+    queryset = ProductCard.objects.all()
+    serializer_class = ProductCardSerializer
 
+    def get_category(self):
+        category = self.request.query_params.get('category')
+        if category is not None and not category.isdigit():
+            raise ValidationError({'category': ['A valid integer is required.']})
+        return category
 
-class ProductViewSet(ReadOnlyModelViewSet):
-    queryset = Product.objects.annotate(href=Concat(Value('/catalog/'), 'id', output_field=CharField()),
-                                        rating=Coalesce(Round(Avg('reviews__rate'), 1), 0.0))
+    def get_cache_name(self):
+        category = self.get_category()
+        return f'{self.cache_name}:{category}' if category else self.cache_name
+
+    def get_queryset(self):
+        return self.get_ranked_queryset(ProductPopularity.objects.exists())
+
+    async def aget_queryset(self):
+        return self.get_ranked_queryset(await ProductPopularity.objects.aexists())
+
+    def get_ranked_queryset(self, ranked):
+        queryset = super().get_queryset()
+        category = self.get_category()
+        if not ranked:
+            # рейтинг еще не считали
+            if category:
+                queryset = queryset.filter(category=category)
+            return queryset.order_by('-review_count', '-rating')[:POPULARITY_TOP_N]
+        if category:
+            return queryset.filter(product__popularity__category=category).\
+                order_by('product__popularity__rank')[:POPULARITY_TOP_N]
+        return queryset.filter(product__popularity__isnull=False).\
+            order_by('-product__popularity__score', 'product__popularity__product')[:POPULARITY_TOP_N]
+
+
+class ProductsLimitedViewSet(ReadOnlyViewMixin, ConditionalListMixin, CachedListMixin, ReadOnlyModelViewSet):
+    cache_name = 'limited'
+    queryset = ProductCard.objects.filter(limited=True)
+    serializer_class = ProductCardSerializer
+
+
+class ProductsBannersViewSet(ReadOnlyViewMixin, ConditionalListMixin, CachedListMixin, ReadOnlyModelViewSet):
+    cache_name = 'banners'
+    queryset = ProductCard.objects.filter(on_banner=True)
+    serializer_class = ProductCardSerializer
+
+
+class ProductViewSet(ReadOnlyViewMixin, ConditionalRetrieveMixin, ReadOnlyModelViewSet):
+    queryset = product_queryset()
     serializer_class = ProductSerializer
 
 
@@ -245,65 +380,93 @@ class CreateReviewViewSet(CreateModelMixin, GenericViewSet):
     serializer_class = ReviewSerializer
 
 
+class ProductReviewsViewSet(ReadOnlyViewMixin, ListAPIView):
+    # все отзывы товара по страницам, новые первыми; ключ (date, id) индекса review_product_date_idx
+    serializer_class = ReviewSerializer
+    pagination_class = PaginationKeyset
+
+    def get_queryset(self):
+        get_object_or_404(Product.objects.values_list('pk'), pk=self.kwargs['pk'])
+        return Review.objects.filter(product_id=self.kwargs['pk']).order_by('-date', '-id')
+
+
 class BasketView(APIView):
 
     def get_products(self, request):
-        try:
-            products = Baskets.objects.filter(user=request.user).select_for_update('product').\
-                prefetch_related('product__reviews')
-            return products
-        except Product.DoesNotExist:
-            raise Http404
+        return Baskets.for_user(request.user)
 
     def get(self, request, format=None):
         products = self.get_products(request)
         serializer = BasketProductsSerializer(products, many=True)
         return Response(serializer.data)
 
-    def post(self, request, format=None):
+    def apply(self, request, operations):
+        ids = {product_id for product_id, _, _ in operations}
+        missing = ids - set(Product.objects.filter(pk__in=ids).values_list('id', flat=True))
+        if missing:
+            return Response({'id': [f'Product {product_id} does not exist' for product_id in sorted(missing)]},
+                            status=status.HTTP_400_BAD_REQUEST)
+        Baskets.apply_operations(request.user, operations)
+        products = self.get_products(request)
+        serializer = BasketProductsSerializer(products, many=True)
+        return Response(serializer.data, status=status.HTTP_200_OK)
 
+    def post(self, request, format=None):
         serializer = BasketChangesSerializer(data=request.data)
         if serializer.is_valid():
-            product = Product.objects.filter(pk=serializer.data['id']).first()
-            basket = Baskets.objects.filter(user=request.user, product= product).first()
-            if basket:
-                basket.prod_count = basket.prod_count + serializer.data['count']
-                basket.price_mult_count = basket.prod_count * product.price
-                basket.save(update_fields=['prod_count', 'price_mult_count'])
-                products = self.get_products(request)
-                serializer = BasketProductsSerializer(products, many=True)
-                return Response(serializer.data, status=status.HTTP_200_OK)
-            elif product:
-                price = serializer.data['count'] * product.price
-                Baskets.objects.create(product=product, user=request.user, prod_count=serializer.data['count'],
-                                       price_mult_count=price)
-                products = self.get_products(request)
-                serializer = BasketProductsSerializer(products, many=True)
-                return Response(serializer.data, status=status.HTTP_200_OK)
+            return self.apply(request, [(serializer.data['id'], serializer.data['count'], 'add')])
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     def delete(self, request, format=None):
         serializer = BasketChangesSerializer(data=request.data)
         if serializer.is_valid():
-            product = Product.objects.filter(pk=serializer.data['id']).first()
-            basket = Baskets.objects.filter(user=request.user, product= product).first()
-            if basket:
-                new_count = basket.prod_count - serializer.data['count']
-                if new_count > 0:
-                    basket.prod_count = new_count
-                    basket.price_mult_count = basket.prod_count * product.price
-                    basket.save(update_fields=['prod_count', 'price_mult_count'])
-                else:
-                    basket.delete()
-                products = self.get_products(request)
-                serializer = BasketProductsSerializer(products, many=True)
-                return Response(serializer.data, status=status.HTTP_200_OK)
+            return self.apply(request, [(serializer.data['id'], serializer.data['count'], 'remove')])
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class BasketBatchView(BasketView):
+    # [{"id": 1, "count": 2, "op": "add"}, ...] одним запросом и одной транзакцией
+    http_method_names = ['post', 'options']
+
+    def post(self, request, format=None):
+        serializer = BasketOperationSerializer(data=request.data, many=True)
+        if serializer.is_valid():
+            return self.apply(request, [(item['id'], item['count'], item['op']) for item in serializer.data])
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class SalesViewSet(ReadOnlyModelViewSet):
-    queryset = Sales.objects.prefetch_related('product').all()
+class PaginationSales(AsyncPageNumberMixin, PageNumberPagination):
+    page_size = 20
+    page_size_query_param = 'limit'
+    max_page_size = 100
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        return await self.apaginate_page(queryset, request)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'items': data,
+            'currentPage': self.page.number,
+            'lastPage': self.page.paginator.num_pages,
+        })
+
+
+class SalesViewSet(ReadOnlyViewMixin, CachedListMixin, FastListMixin, ReadOnlyModelViewSet):
+    # действующие сегодня скидки, новые первыми; порядок совпадает с индексом sales_window_idx
+    cache_name = 'sales'
     serializer_class = SalesSerializer
+    fast_serializer_class = FastSalesSerializer
+    pagination_class = PaginationSales
+
+    def get_queryset(self):
+        return Sales.active().select_related('product').prefetch_related('product__images').\
+            order_by('-dateFrom', '-dateTo', '-id')
+
+    def get_cache_name(self):
+        # набор действующих скидок меняется с датой, остальное сбрасывает версия product_lists
+        page = self.request.query_params.get(self.paginator.page_query_param, 1)
+        limit = self.paginator.get_page_size(self.request)
+        return f'{self.cache_name}:{timezone.localdate()}:{page}:{limit}'
 
 
 class MyModelMixin(CreateModelMixin):
@@ -324,15 +487,52 @@ class OrderViewSet(RetrieveAPIView, MyModelMixin):
     serializer_class = OrderSerializer
 
 
-class OrderListViewSet(ListAPIView, MyModelMixin):
-    queryset = Order.objects.prefetch_related('products').all()
+class OrderListViewSet(FastListMixin, ListAPIView, MyModelMixin):
     serializer_class = OrderSerializer
+    fast_serializer_class = FastOrderSerializer
+
+    def get_queryset(self):
+        # только заказы текущего пользователя (анонимному - пустой список)
+        return Order.objects.filter(user_id=self.request.user.id).prefetch_related('products').\
+            order_by('-createdAt', '-orderId')
+
+
+class OrderHistoryViewSet(FastListMixin, ListAPIView):
+    # ?cursor= - следующая страница, ключ (createdAt, orderId) индекса order_user_created_idx;
+    # по умолчанию только сводка заказа, ?products=true - со снимком товаров
+    pagination_class = PaginationKeyset
+
+    def with_products(self):
+        return is_true(self.request.query_params.get('products'))
+
+    def get_queryset(self):
+        queryset = Order.objects.filter(user_id=self.request.user.id).order_by('-createdAt', '-orderId')
+        return queryset.prefetch_related('products') if self.with_products() else queryset
+
+    def get_fast_serializer_class(self):
+        return FastOrderSerializer if self.with_products() else FastOrderSummarySerializer
+
+    def get_serializer_class(self):
+        if self.fast:
+            return super().get_serializer_class()
+        return OrderSerializer if self.with_products() else OrderSummarySerializer
+
+
+class OrderFromBasketView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = OrderFromBasketSerializer(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        order = serializer.save()
+        return Response(OrderSerializer(order).data, status=status.HTTP_201_CREATED)
 
 
 class LastActiveOrderViewSet(APIView):
 
     def get(self, request):
-        order = Order.objects.filter(user=request.user, active=True).prefetch_related('products').order_by('-createdAt').first()  #\
-        print(order)
+        # частичный индекс order_user_active_idx
+        order = Order.objects.filter(user_id=request.user.id, active=True).prefetch_related('products').\
+            order_by('-createdAt').first()
         serializer = OrderSerializer(order)
         return Response(serializer.data)
@@ -43,6 +43,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.RequestMetricsMiddleware',
+    'api.db_routing.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -87,6 +89,37 @@ DATABASES = {
         'ATOMIC_REQUESTS': True,
     }
 }
+# чтение read-only эндпоинтов с реплики (api/db_routing.py): база 'replica' (без ATOMIC_REQUESTS,
+# в тестах - зеркало default) и ее имя в API_READ_REPLICA. Здесь 'replica' указывает на ту же базу,
+# для настоящей реплики заменить HOST
+DATABASES['replica'] = {**DATABASES['default'], 'ATOMIC_REQUESTS': False, 'TEST': {'MIRROR': 'default'}}
+DATABASE_ROUTERS = ['api.db_routing.ReplicaRouter']
+API_READ_REPLICA = None
+
+# Кэш дерева категорий и списков товаров на главной. LocMemCache у каждого процесса свой,
+# при нескольких воркерах нужен общий бэкенд, например
+# 'django.core.cache.backends.filebased.FileBasedCache' с 'LOCATION': '/var/tmp/shop_cache'
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'shop',
+    }
+}
+
+API_RESPONSE_CACHE_TIMEOUT = 5 * 60
+
+# метрики по url name отдаются на /api/_metrics в формате Prometheus,
+# снимаются только для этой доли запросов
+API_METRICS_SAMPLE_RATE = 1.0
+# кроме staff-пользователей /api/_metrics доступен только с этих адресов (сборщик метрик)
+API_METRICS_ALLOWED_IPS = []
+
+# /api/products/popular: manage.py compute_popularity смешивает число отзывов, оценку и продажи,
+# вес продажи падает вдвое каждые API_POPULARITY_HALF_LIFE_DAYS дней
+API_POPULARITY_HALF_LIFE_DAYS = 14
+API_POPULARITY_TOP_N = 20
+API_POPULARITY_WEIGHTS = {'reviews': 1.0, 'rating': 1.0, 'sales': 2.0}
 
 
 # Password validation
@@ -141,4 +174,7 @@ REST_FRAMEWORK = {
     'SEARCH_PARAM': 'filter',
     'ORDERING_PARAM': 'sort',
     'COERCE_DECIMAL_TO_STRING': False,
+    # api.search.DatabaseSearchBackend выбирает tsvector (PostgreSQL) или FTS5 (SQLite),
+    # api.search.IcontainsSearchBackend - прежний поиск через icontains
+    'PRODUCT_SEARCH_BACKEND': 'api.search.DatabaseSearchBackend',
 }
\ No newline at end of file
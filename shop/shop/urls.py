@@ -22,6 +22,7 @@ from django.urls import path, include
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('frontend.urls')),
+    path('api/async/', include('api.async_urls')),
     path('api/', include('api.urls')),
 ]
 